@@ -1,111 +1,36 @@
 import sys
 import json
-import asyncio
+import bisect
+import enum
+import contextlib
+import hashlib
+import math
+import http.client
 import threading
 import time
 import os
-import urllib.request
+import posixpath
 import urllib.parse
+from array import array
+from collections import OrderedDict, deque
 from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List, Optional, Callable
+from typing import Dict, List, Optional, Callable, Tuple
+
+from klipperdesk_core import (
+    CONFIG_FILE, FULL_SUBSCRIPTION, TELEMETRY_SUBSCRIPTION, MINIMAL_SUBSCRIPTION,
+    NAN, Config, ConnectionEngine, ReconnectPolicy, StatusStore, LatencyHistogram, TelemetryLog, parse_klipper_status,
+    read_capture_header,
+    metric_line, render_metrics, serve_metrics, build_arg_parser, headless_main,
+)
+
+# Headless mode must not import PyQt at all
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    sys.exit(headless_main())
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtWidgets import QSystemTrayIcon, QMenu, QAction
 
-end = False
 updates_paused = False
-# Defaults
-CONFIG_FILE = "KDconfig.json"
-
-# Default subscribe payload for Moonraker
-DEFAULT_SUBSCRIBE_PAYLOAD = {
-    "jsonrpc": "2.0",
-    "method": "printer.objects.subscribe",
-    "params": {
-        "objects": {
-            "extruder": ["temperature", "target"],
-            "heater_bed": ["temperature", "target"],
-            "print_stats": ["state", "filename", "print_duration", "total_duration"],
-            "display_status": ["progress", "message"],
-            "virtual_sdcard": ["progress", "file_position", "file_size"],
-        }
-    },
-    "id": 42
-}
-
-
-# ---------------------------
-# Configuration Management
-# ---------------------------
-class Config:
-    def __init__(self, filename=CONFIG_FILE):
-        self.filename = filename
-        self.default_config = {
-            "printers": [
-                {"name": "Printer 1", "ip": "", "enabled": False},
-                {"name": "Printer 2", "ip": "", "enabled": False},
-                {"name": "Printer 3", "ip": "", "enabled": False},
-                {"name": "Printer 4", "ip": "", "enabled": False},
-                {"name": "Printer 5", "ip": "", "enabled": False},
-                {"name": "Printer 6", "ip": "", "enabled": False},
-                {"name": "Printer 7", "ip": "", "enabled": False},
-                {"name": "Printer 8", "ip": "", "enabled": False},
-                {"name": "Printer 9", "ip": "", "enabled": False},
-                {"name": "Printer 10", "ip": "", "enabled": False}
-            ],
-            "multiple_widgets": True,
-            "widget_opacity": 0.88,
-            "widget_width": 360,
-            "widget_height": 150,
-            "first_run": True
-        }
-        self.config = self.load_config()
-    
-    def load_config(self):
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    for key, value in self.default_config.items():
-                        if key not in config:
-                            config[key] = value
-                    return config
-            except Exception as e:
-                print(f"Error loading config: {e}")
-                return self.default_config.copy()
-        return self.default_config.copy()
-    
-    def save_config(self):
-        try:
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
-            return True
-        except Exception as e:
-            print(f"Error saving config: {e}")
-            return False
-    
-    def get_enabled_printers(self) -> List[Dict]:
-        return [p for p in self.config.get("printers", []) if p.get("enabled", False)]
-    
-    def update_printer(self, index: int, name: str, ip: str, enabled: bool):
-        printers = self.config.get("printers", [])
-        if index < len(printers):
-            printers[index]["name"] = name
-            printers[index]["ip"] = ip
-            printers[index]["enabled"] = enabled
-    
-    def set_widget_size(self, width: int, height: int):
-        self.config["widget_width"] = width
-        self.config["widget_height"] = height
-    
-    def set_widget_opacity(self, opacity: float):
-        self.config["widget_opacity"] = opacity
-    
-    def set_multiple_widgets(self, enabled: bool):
-        self.config["multiple_widgets"] = enabled
-    
-    def mark_first_run_complete(self):
-        self.config["first_run"] = False
 
 
 # ---------------------------
@@ -169,6 +94,10 @@ class SettingsDialog(QtWidgets.QDialog):
         size_layout.addWidget(self.height_spin)
         settings_layout.addLayout(size_layout)
         
+        # Graphs
+        self.graphs_check = QtWidgets.QCheckBox("Показывать графики температур и прогресса")
+        settings_layout.addWidget(self.graphs_check)
+        
         settings_group.setLayout(settings_layout)
         layout.addWidget(settings_group)
         
@@ -274,6 +203,8 @@ class SettingsDialog(QtWidgets.QDialog):
         self.width_spin.setValue(width)
         self.height_spin.setValue(height)
         
+        self.graphs_check.setChecked(self.config.config.get("show_graphs", False))
+        
     
     def save_settings(self):
         # Update printers
@@ -318,6 +249,7 @@ class SettingsDialog(QtWidgets.QDialog):
         self.config.config["widget_opacity"] = self.opacity_slider.value() / 100.0
         self.config.config["widget_width"] = self.width_spin.value()
         self.config.config["widget_height"] = self.height_spin.value()
+        self.config.config["show_graphs"] = self.graphs_check.isChecked()
         
         if self.config.save_config():
             self.accept()  # Закрываем диалог только при успешном сохранении
@@ -330,156 +262,843 @@ class SettingsDialog(QtWidgets.QDialog):
 # WebSocket Client Manager
 # ---------------------------
 class WebSocketManager(QtCore.QObject):
-    """Manages WebSocket connections in separate threads"""
-    data_received = QtCore.pyqtSignal(dict)  # Signal emitted when data is received
+    """Qt front of ConnectionEngine: mail notifications arrive as a queued signal"""
+    mail_ready = QtCore.pyqtSignal(str)  # printer ip, emitted once per batch of merged deltas
     
-    def __init__(self):
+    def __init__(self, policy: Optional[ReconnectPolicy] = None):
         super().__init__()
-        self.ws_threads = {}
-        self.stop_events = {}
+        self.engine = ConnectionEngine(on_mail=self.mail_ready.emit, policy=policy)
+        self.message_filter = self.engine.message_filter
+        self._network_manager = None
     
-    def start_printer(self, printer_info: Dict):
-        """Start WebSocket connection for a printer"""
-        import websockets
-        
-        ip = printer_info.get("ip", "")
-        if not ip:
-            return
-        
-        ws_url = f"ws://{ip}/websocket"
-        printer_name = printer_info.get("name", "Unknown")
-        
-        # Create stop event for this printer
-        stop_event = threading.Event()
-        self.stop_events[ip] = stop_event
-        
-        # Create and start thread
-        thread = threading.Thread(
-            target=self._ws_thread_func,
-            args=(ws_url, printer_name, ip, stop_event),
-            daemon=True
-        )
-        self.ws_threads[ip] = thread
-        thread.start()
-        print(f"[WebSocketManager] Started connection for {printer_name} ({ip})")
-    
-    def _ws_thread_func(self, ws_url: str, printer_name: str, printer_ip: str, stop_event: threading.Event):
-        """WebSocket thread function"""
-        import websockets
-        
-        async def consume():
-            backoff = 1
-            if end:
-                loop.close()
-            while not stop_event.is_set():
-                try:
-                    if end:
-                        break
-                    async with websockets.connect(ws_url) as ws:
-                        print(f"[{printer_name}] WebSocket подключен к {ws_url}")
-                        await ws.send(json.dumps(DEFAULT_SUBSCRIBE_PAYLOAD))
-                        backoff = 1
-                        
-                        async for raw in ws:
-                            if stop_event.is_set():
-                                break
-                            if end:
-                                break
-                            try:
-                                data = json.loads(raw)
-                                # Emit signal with data
-                                self.data_received.emit({
-                                    "type": "ws_message",
-                                    "raw": data,
-                                    "printer_name": printer_name,
-                                    "printer_ip": printer_ip,
-                                    "ts": time.time()
-                                })
-                            except Exception:
-                                continue
-                                
-                except Exception as e:
-                    print(f"[{printer_name}] Ошибка подключения: {e}; повтор через {backoff}с")
-                    time.sleep(backoff)
-                    backoff = min(backoff * 2, 20)
-        
-        # Run event loop in thread
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    def watch_network(self):
+        """Сеть снова доступна: переподключаемся сразу, не дожидаясь конца паузы"""
         try:
-            loop.run_until_complete(consume())
-        finally:
-            loop.close()
+            from PyQt5 import QtNetwork
+            self._network_manager = QtNetwork.QNetworkConfigurationManager(self)
+            self._network_manager.onlineStateChanged.connect(self._on_online_changed)
+        except Exception as e:
+            print(f"[WebSocket] Network change notifications unavailable: {e}")
+    
+    def _on_online_changed(self, online: bool):
+        if online:
+            print("[WebSocket] Network is back, reconnecting now")
+            self.engine.reconnect_now()
+    
+    def start_printer(self, printer_info: Dict):
+        self.engine.start_printer(printer_info)
     
     def stop_printer(self, ip: str):
-        """Stop WebSocket connection for a printer"""
-        if ip in self.stop_events:
-            self.stop_events[ip].set()
-            if ip in self.ws_threads:
-                self.ws_threads[ip].join(timeout=2)
-                del self.ws_threads[ip]
-            del self.stop_events[ip]
+        self.engine.stop_printer(ip)
     
     def stop_all(self):
-        """Stop all WebSocket connections"""
-        for ip in list(self.stop_events.keys()):
-            self.stop_printer(ip)
+        self.engine.stop_all()
+    
+    def set_subscription(self, ip: str, objects: Dict[str, List[str]]):
+        self.engine.set_subscription(ip, objects)
+    
+    def take_mail_stamped(self, ip: str) -> Tuple[Optional[Dict], float]:
+        return self.engine.take_mail_stamped(ip)
+    
+    def stats(self) -> Dict[str, int]:
+        return self.engine.stats()
+    
+    def shutdown(self):
+        self.engine.shutdown()
+
+
+# ---------------------------
+# Moonraker HTTP Client
+# ---------------------------
+class MoonrakerHttpClient:
+    """Keep-alive HTTP client for Moonraker REST calls.
+    
+    Idle connections are kept per host and reused; concurrency per host is
+    bounded by a semaphore. Safe to use from several worker threads.
+    """
+    # Errors that mean a pooled keep-alive connection was closed by the server
+    _STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                     BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+    
+    def __init__(self, timeout: float = 5.0, connect_timeout: float = 3.0, max_per_host: int = 2):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._idle = {}   # host -> [HTTPConnection]
+        self._slots = {}  # host -> BoundedSemaphore
+        self.metrics = {
+            "requests": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+            "errors": 0,
+        }
+    
+    @classmethod
+    def from_config(cls, config: "Config") -> "MoonrakerHttpClient":
+        return cls(
+            timeout=config.config.get("http_timeout", 5.0),
+            connect_timeout=config.config.get("http_connect_timeout", 3.0),
+            max_per_host=config.config.get("http_connections_per_host", 2)
+        )
+    
+    def _count(self, key: str):
+        with self._lock:
+            self.metrics[key] += 1
+    
+    def _slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_host)
+                self._slots[host] = slot
+            return slot
+    
+    def _checkout(self, host: str) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle:
+                return idle.pop(), True
+            self.metrics["connections_opened"] += 1
+        return http.client.HTTPConnection(host, timeout=self.connect_timeout), False
+    
+    def _checkin(self, host: str, conn: http.client.HTTPConnection):
+        with self._lock:
+            self._idle.setdefault(host, []).append(conn)
+    
+    def _request_once(self, host: str, url: str) -> bytes:
+        conn, reused = self._checkout(host)
+        try:
+            if conn.sock is None:
+                conn.connect()
+            # The connect timeout is shorter, reads may take the full timeout
+            conn.sock.settimeout(self.timeout)
+            conn.request("GET", url, headers={"Connection": "keep-alive"})
+            response = conn.getresponse()
+            body = response.read()
+            if reused:
+                # Counted only once the pooled connection actually answered
+                self._count("connections_reused")
+        except self._STALE_ERRORS:
+            conn.close()
+            if reused:
+                # Server dropped the idle connection: retry once on a fresh one
+                return self._request_once(host, url)
+            raise
+        except Exception:
+            conn.close()
+            raise
+        
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(host, conn)
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status} for {url}")
+        return body
+    
+    def get(self, host: str, path: str, params: Optional[Dict] = None) -> bytes:
+        """GET `path` from a Moonraker host ("ip" or "ip:port"), returns the body"""
+        url = path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        self._count("requests")
+        with self._slot(host):
+            try:
+                return self._request_once(host, url)
+            except Exception:
+                self._count("errors")
+                raise
+    
+    def get_json(self, host: str, path: str, params: Optional[Dict] = None) -> Dict:
+        return json.loads(self.get(host, path, params))
+    
+    def stats(self) -> Dict:
+        """Counters plus the share of requests served on a reused connection"""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats["idle_connections"] = sum(len(c) for c in self._idle.values())
+        total = stats["connections_opened"] + stats["connections_reused"]
+        stats["reuse_ratio"] = stats["connections_reused"] / total if total else 0.0
+        return stats
+    
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
 
 
 # ---------------------------
 # Thumbnail Loader
 # ---------------------------
+class ThumbnailDiskCache:
+    """PNG thumbnails on disk, keyed by printer, file and its `modified` time.
+    
+    Files are evicted least-recently-used first once the total size exceeds
+    `max_bytes`. Access order survives restarts through file mtimes.
+    """
+    INDEX_NAME = "index.json"
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> size, least recently used first
+        self._total_bytes = 0
+        self._latest = {}  # "ip:filename" -> file name of the newest known version
+        self.hits = 0
+        self.misses = 0
+        self._load()
+    
+    @classmethod
+    def shared(cls, directory: str, max_bytes: int) -> "ThumbnailDiskCache":
+        """One instance per directory, so every loader sees the same LRU state"""
+        directory = os.path.abspath(directory)
+        with cls._instances_lock:
+            cache = cls._instances.get(directory)
+            if cache is None:
+                cache = cls(directory, max_bytes)
+                cls._instances[directory] = cache
+            cache.max_bytes = max_bytes
+            return cache
+    
+    @classmethod
+    def from_config(cls, config: "Config") -> "ThumbnailDiskCache":
+        directory = config.config.get("thumbnail_cache_dir", "KDthumbnails")
+        max_mb = config.config.get("thumbnail_cache_mb", 64)
+        return cls.shared(directory, int(max_mb * 1024 * 1024))
+    
+    @staticmethod
+    def entry_name(ip: str, filename: str, modified, variant: str = "") -> str:
+        digest = hashlib.sha1(f"{ip}\0{filename}\0{modified}\0{variant}".encode("utf-8")).hexdigest()
+        return f"{digest}.png"
+    
+    def _load(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+            for _, name, size in sorted(files):
+                self._entries[name] = size
+                self._total_bytes += size
+            
+            index_path = os.path.join(self.directory, self.INDEX_NAME)
+            if os.path.exists(index_path):
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    latest = json.load(f)
+                self._latest = {k: v for k, v in latest.items() if v in self._entries}
+        except Exception as e:
+            print(f"[ThumbnailCache] Ошибка чтения кэша: {e}")
+    
+    def _save_index(self):
+        index_path = os.path.join(self.directory, self.INDEX_NAME)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._latest, f)
+        os.replace(tmp_path, index_path)
+    
+    def _read(self, name: str) -> Optional[bytes]:
+        """Read an entry and mark it as most recently used (lock held)"""
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            size = self._entries.pop(name, 0)
+            self._total_bytes -= size
+            return None
+        self._entries.move_to_end(name)
+        return data
+    
+    def get(self, ip: str, filename: str, modified, variant: str = "") -> Optional[bytes]:
+        """Return cached PNG bytes for this exact file version and thumbnail variant"""
+        name = self.entry_name(ip, filename, modified, variant)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            data = self._read(name)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self._latest.get(f"{ip}:{filename}") != name:
+                self._latest[f"{ip}:{filename}"] = name
+                self._save_index()
+            return data
+    
+    def get_latest(self, ip: str, filename: str) -> Optional[bytes]:
+        """Return the newest cached PNG for a file without knowing its version"""
+        with self._lock:
+            name = self._latest.get(f"{ip}:{filename}")
+            if name is None or name not in self._entries:
+                return None
+            return self._read(name)
+    
+    def put(self, ip: str, filename: str, modified, data: bytes, variant: str = ""):
+        name = self.entry_name(ip, filename, modified, variant)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            try:
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"[ThumbnailCache] Ошибка записи кэша: {e}")
+                return
+            self._total_bytes -= self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._total_bytes += len(data)
+            self._latest[f"{ip}:{filename}"] = name
+            self._evict()
+            try:
+                self._save_index()
+            except OSError:
+                pass
+    
+    def _evict(self):
+        """Remove least recently used files until the budget is met (lock held)"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        live = set(self._entries)
+        self._latest = {k: v for k, v in self._latest.items() if v in live}
+
+
+def thumbnail_covers(width: int, height: int, box_width: int, box_height: int) -> bool:
+    """True if a width x height image fitted into the box (keeping aspect) is not upscaled"""
+    return width >= box_width or height >= box_height
+
+
+def select_thumbnail_variant(thumbnails: List[Dict], box_width: int, box_height: int) -> Optional[Dict]:
+    """Pick the smallest thumbnail that covers the box, or the largest one if none does.
+    
+    A zero-sized box selects the largest variant.
+    """
+    variants = [t for t in thumbnails if isinstance(t, dict) and t.get('relative_path')]
+    if not variants:
+        return None
+    by_area = sorted(variants, key=lambda x: x.get('width', 0) * x.get('height', 0))
+    if box_width > 0 and box_height > 0:
+        for thumbnail in by_area:
+            if thumbnail_covers(thumbnail.get('width', 0), thumbnail.get('height', 0), box_width, box_height):
+                return thumbnail
+    return by_area[-1]
+
+
 class ThumbnailLoader:
-    def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=5)
-        self.cache = {}
-        
-    def fetch_thumbnail(self, ip: str, filename: str) -> Optional[QtGui.QPixmap]:
-        """Fetch thumbnail for given filename from printer IP"""
+    """Fetches thumbnail images from Moonraker (blocking, safe to call from worker threads)"""
+    METADATA_TTL = 30.0  # seconds a metadata response is shared between callers
+    
+    def __init__(self, http_client: MoonrakerHttpClient, disk_cache: Optional[ThumbnailDiskCache] = None):
+        self.http = http_client
+        self.disk_cache = disk_cache
+        self._metadata = OrderedDict()  # (ip, filename) -> (fetched_at, result)
+        self._metadata_lock = threading.Lock()
+    
+    def fetch_metadata(self, ip: str, filename: str) -> Dict:
+        """GET /server/files/metadata result, shared for a short time between callers"""
+        key = (ip, filename)
+        now = time.monotonic()
+        with self._metadata_lock:
+            entry = self._metadata.get(key)
+            if entry is not None and now - entry[0] < self.METADATA_TTL:
+                return entry[1]
+        result = self.http.get_json(ip, "/server/files/metadata", {"filename": filename}).get('result', {})
+        with self._metadata_lock:
+            self._metadata[key] = (now, result)
+            while len(self._metadata) > 64:
+                self._metadata.popitem(last=False)
+        return result
+    
+    @staticmethod
+    def _image_from_data(img_data: Optional[bytes]) -> Optional[QtGui.QImage]:
+        # QImage, unlike QPixmap, may be built outside the GUI thread
+        if not img_data:
+            return None
+        image = QtGui.QImage.fromData(img_data)
+        if image.isNull():
+            return None
+        return image
+    
+    def peek_cached(self, ip: str, filename: str) -> Optional[QtGui.QImage]:
+        """Return the last known thumbnail from disk, without network I/O"""
+        if self.disk_cache is None:
+            return None
+        return self._image_from_data(self.disk_cache.get_latest(ip, filename))
+    
+    def fetch_thumbnail(self, ip: str, filename: str, width: int = 0, height: int = 0) -> Optional[QtGui.QImage]:
+        """Fetch the smallest thumbnail variant that covers width x height device pixels"""
         if not ip or not filename:
             return None
         
-        cache_key = f"{ip}:{filename}"
-        if cache_key in self.cache:
-            return self.cache[cache_key]
-        
         try:
             # First, get file metadata
-            metadata_url = f"http://{ip}/server/files/metadata?filename={urllib.parse.quote(filename)}"
-            with urllib.request.urlopen(metadata_url, timeout=5) as response:
-                metadata = json.loads(response.read())
-                
-            thumbnails = metadata.get('result', {}).get('thumbnails', [])
+            result = self.fetch_metadata(ip, filename)
+        except Exception as e:
+            print(f"[Thumbnail] Ошибка загрузки превью: {e}")
+            # Printer unreachable: fall back to the last version we have on disk
+            return self.peek_cached(ip, filename)
+        
+        try:
+            thumbnails = result.get('thumbnails', [])
             if not thumbnails:
                 return None
-                
-            # Get the largest thumbnail
-            thumbnail = sorted(thumbnails, key=lambda x: x.get('width', 0) * x.get('height', 0))[-1]
-            relative_path = thumbnail.get('relative_path')
+            modified = result.get('modified')
             
-            if relative_path:
-                # Download thumbnail image
-                thumb_url = f"http://{ip}/server/files/gcodes/{urllib.parse.quote(relative_path)}"
-                with urllib.request.urlopen(thumb_url, timeout=5) as response:
-                    img_data = response.read()
-                
-                # Convert to QPixmap
-                pixmap = QtGui.QPixmap()
-                pixmap.loadFromData(img_data)
-                self.cache[cache_key] = pixmap
-                return pixmap
+            thumbnail = select_thumbnail_variant(thumbnails, width, height)
+            if thumbnail is None:
+                return None
+            variant = f"{thumbnail.get('width', 0)}x{thumbnail.get('height', 0)}"
+            
+            # Same file version already on disk: no image download needed
+            if self.disk_cache is not None and modified is not None:
+                image = self._image_from_data(self.disk_cache.get(ip, filename, modified, variant))
+                if image is not None:
+                    return image
+            
+            # relative_path is relative to the directory of the gcode file
+            thumb_path = posixpath.join(posixpath.dirname(filename), thumbnail['relative_path'])
+            img_data = self.http.get(ip, f"/server/files/gcodes/{urllib.parse.quote(thumb_path)}")
+            
+            image = self._image_from_data(img_data)
+            if image is None:
+                return None
+            if self.disk_cache is not None and modified is not None:
+                self.disk_cache.put(ip, filename, modified, img_data, variant)
+            return image
                 
         except Exception as e:
             print(f"[Thumbnail] Ошибка загрузки превью: {e}")
             return None
 
 
+class ThumbnailService(QtCore.QObject):
+    """Application-wide thumbnail provider.
+    
+    One bounded worker pool and one bounded in-memory LRU are shared by all
+    widgets. Concurrent requests for the same (ip, filename, size) are
+    coalesced into a single fetch whose result is delivered to every
+    subscriber. Callbacks always run in the GUI thread.
+    """
+    _image_ready = QtCore.pyqtSignal(str, str, int, int, QtGui.QImage)  # worker thread -> GUI thread
+    _metadata_ready = QtCore.pyqtSignal(object, object)  # (callback, metadata) worker -> GUI thread
+    _instance = None
+    
+    def __init__(self, loader: ThumbnailLoader, max_workers: int = 3, max_entries: int = 64):
+        super().__init__()
+        self.loader = loader
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="KlipperDesk-thumb")
+        self.max_entries = max_entries
+        # (ip, filename) -> (QPixmap, largest variant reached), least recently used first
+        self._memory = OrderedDict()
+        # (ip, filename, width, height) -> [callback], a key here means a fetch is in flight
+        self._subscribers = {}
+        self.memory_hits = 0
+        self.memory_misses = 0
+        self._image_ready.connect(self._deliver)
+        self._metadata_ready.connect(self._deliver_metadata)
+    
+    @staticmethod
+    def _loader_for(config: Optional[Config]) -> ThumbnailLoader:
+        if config is None:
+            return ThumbnailLoader(MoonrakerHttpClient())
+        return ThumbnailLoader(MoonrakerHttpClient.from_config(config), ThumbnailDiskCache.from_config(config))
+    
+    @classmethod
+    def instance(cls, config: Optional[Config] = None) -> "ThumbnailService":
+        """Return the shared service, creating it on first use"""
+        if cls._instance is None:
+            cls._instance = cls(cls._loader_for(config))
+        return cls._instance
+    
+    def reconfigure(self, config: Config):
+        """Apply saved settings: cache directory and size, HTTP timeouts and pool size"""
+        old_http = self.loader.http
+        # Fetches already running finish on the old loader; new ones use the new settings
+        self.loader = self._loader_for(config)
+        old_http.close()
+    
+    def request(self, ip: str, filename: str, size: QtCore.QSize,
+                callback: Callable[[QtGui.QPixmap], None]):
+        """Ask for a thumbnail covering `size` device pixels.
+        
+        `callback(pixmap)` may fire twice: cached version first, then the revalidated one.
+        """
+        if not ip or not filename:
+            return
+        width, height = size.width(), size.height()
+        entry = self._memory.get((ip, filename))
+        if entry is not None:
+            pixmap, largest = entry
+            self._memory.move_to_end((ip, filename))
+            if largest or thumbnail_covers(pixmap.width(), pixmap.height(), width, height):
+                self.memory_hits += 1
+                callback(pixmap)
+                return
+            # Too small for the enlarged widget: show it meanwhile, fetch a bigger variant
+            callback(pixmap)
+        
+        self.memory_misses += 1
+        key = (ip, filename, width, height)
+        if key in self._subscribers:
+            # Already being fetched: just wait for that result
+            self._subscribers[key].append(callback)
+            return
+        
+        # Show the last cached version right away, the fetch below revalidates it
+        if entry is None:
+            cached = self.loader.peek_cached(ip, filename)
+            if cached is not None:
+                callback(QtGui.QPixmap.fromImage(cached))
+        
+        self._subscribers[key] = [callback]
+        self.executor.submit(self._fetch, ip, filename, width, height)
+    
+    def request_metadata(self, ip: str, filename: str, callback: Callable[[Dict], None]):
+        """Fetch file metadata on the worker pool; `callback(metadata)` runs in the GUI thread"""
+        def fetch():
+            try:
+                metadata = self.loader.fetch_metadata(ip, filename)
+            except Exception as e:
+                print(f"[Thumbnail] Ошибка загрузки метаданных: {e}")
+                return
+            self._metadata_ready.emit(callback, metadata)
+        
+        self.executor.submit(fetch)
+    
+    @QtCore.pyqtSlot(object, object)
+    def _deliver_metadata(self, callback, metadata):
+        callback(metadata)
+    
+    def _fetch(self, ip: str, filename: str, width: int, height: int):
+        image = self.loader.fetch_thumbnail(ip, filename, width, height)
+        self._image_ready.emit(ip, filename, width, height,
+                               image if image is not None else QtGui.QImage())
+    
+    @QtCore.pyqtSlot(str, str, int, int, QtGui.QImage)
+    def _deliver(self, ip: str, filename: str, width: int, height: int, image: QtGui.QImage):
+        callbacks = self._subscribers.pop((ip, filename, width, height), [])
+        if image.isNull():
+            return
+        
+        pixmap = QtGui.QPixmap.fromImage(image)
+        # A variant that does not cover the box can only be the largest one available
+        largest = not thumbnail_covers(pixmap.width(), pixmap.height(), width, height)
+        self._memory[(ip, filename)] = (pixmap, largest)
+        self._memory.move_to_end((ip, filename))
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        
+        for callback in callbacks:
+            try:
+                callback(pixmap)
+            except RuntimeError:
+                # Subscriber widget was deleted while the fetch was running
+                continue
+    
+    def metrics_lines(self) -> List[str]:
+        """Cache hit counters in the Prometheus text format"""
+        layers = [("memory", self.memory_hits, self.memory_misses)]
+        disk_cache = self.loader.disk_cache
+        if disk_cache is not None:
+            layers.append(("disk", disk_cache.hits, disk_cache.misses))
+        out = ["# TYPE klipperdesk_thumbnail_cache_requests_total counter"]
+        for layer, hits, misses in layers:
+            out.append(metric_line("klipperdesk_thumbnail_cache_requests_total", hits, {"layer": layer, "result": "hit"}))
+            out.append(metric_line("klipperdesk_thumbnail_cache_requests_total", misses, {"layer": layer, "result": "miss"}))
+        out.append("# TYPE klipperdesk_thumbnail_cache_hit_ratio gauge")
+        for layer, hits, misses in layers:
+            out.append(metric_line("klipperdesk_thumbnail_cache_hit_ratio",
+                                   hits / (hits + misses) if hits + misses else 0.0, {"layer": layer}))
+        return out
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.loader.http.close()
+
+
+# ---------------------------
+# Telemetry History
+# ---------------------------
+TELEMETRY_COLUMNS = ("timestamp", "hotend_actual", "hotend_target", "bed_actual", "bed_target", "progress")
+
+
+class TelemetryRing:
+    """Fixed-capacity ring buffer of samples, one typed array('d') per column"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.columns = {name: array('d', [NAN]) * capacity for name in TELEMETRY_COLUMNS}
+        self._start = 0  # physical index of the oldest sample
+        self._count = 0
+        self.evicted = 0  # samples overwritten so far; 0 means the ring holds everything ever added
+    
+    def __len__(self):
+        return self._count
+    
+    def append(self, row: Tuple[float, ...]):
+        """Append one sample, `row` in TELEMETRY_COLUMNS order; overwrites the oldest when full"""
+        if self._count < self.capacity:
+            pos = (self._start + self._count) % self.capacity
+            self._count += 1
+        else:
+            pos = self._start
+            self._start = (self._start + 1) % self.capacity
+            self.evicted += 1
+        for name, value in zip(TELEMETRY_COLUMNS, row):
+            self.columns[name][pos] = value
+    
+    def timestamp_at(self, index: int) -> float:
+        """Timestamp of the index-th oldest sample"""
+        return self.columns["timestamp"][(self._start + index) % self.capacity]
+    
+    def first_timestamp(self) -> Optional[float]:
+        return self.timestamp_at(0) if self._count else None
+    
+    def last_timestamp(self) -> Optional[float]:
+        return self.timestamp_at(self._count - 1) if self._count else None
+    
+    def _bisect(self, ts: float) -> int:
+        """Logical index of the first sample with timestamp >= ts"""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp_at(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    
+    def _slice(self, column: array, lo: int, hi: int) -> array:
+        """Chronological slice [lo, hi) of a column, at most two array copies"""
+        a = (self._start + lo) % self.capacity
+        b = (self._start + hi) % self.capacity
+        if lo >= hi:
+            return array('d')
+        if a < b:
+            return column[a:b]
+        return column[a:] + column[:b]
+    
+    def query(self, since: float = 0.0, until: Optional[float] = None) -> Dict[str, array]:
+        """Columns for samples with since <= timestamp < until, located in O(log n)"""
+        lo = self._bisect(since)
+        hi = self._bisect(until) if until is not None else self._count
+        return {name: self._slice(column, lo, hi) for name, column in self.columns.items()}
+
+
+class _BucketAverager:
+    """Averages samples into fixed time buckets and appends each finished bucket to a ring"""
+    
+    def __init__(self, interval: float, ring: TelemetryRing):
+        self.interval = interval
+        self.ring = ring
+        self._bucket = None
+        self._sums = [0.0] * (len(TELEMETRY_COLUMNS) - 1)
+        self._counts = [0] * (len(TELEMETRY_COLUMNS) - 1)
+    
+    def add(self, row: Tuple[float, ...]):
+        bucket = int(row[0] // self.interval)
+        if bucket != self._bucket:
+            self.flush()
+            self._bucket = bucket
+        for i, value in enumerate(row[1:]):
+            if value == value:  # skip NaN (unknown value)
+                self._sums[i] += value
+                self._counts[i] += 1
+    
+    def pending(self) -> Optional[Tuple[float, ...]]:
+        """Average of the current, not yet finished bucket"""
+        if self._bucket is None:
+            return None
+        return (self._bucket * self.interval,) + tuple(s / c if c else NAN for s, c in zip(self._sums, self._counts))
+    
+    def flush(self):
+        row = self.pending()
+        if row is None:
+            return
+        self.ring.append(row)
+        self._bucket = None
+        self._sums = [0.0] * len(self._sums)
+        self._counts = [0] * len(self._counts)
+
+
+class TelemetryHistory:
+    """Bounded multi-resolution telemetry of one printer.
+    
+    Tiers: raw samples (about the last 10 minutes), 1 s averages for an hour
+    and 30 s averages for a day. Memory is fixed at construction time.
+    """
+    
+    def __init__(self, raw_capacity: int = 2400, tiers: Tuple[Tuple[float, int], ...] = ((1.0, 3600), (30.0, 2880))):
+        self.raw = TelemetryRing(raw_capacity)
+        self.tiers = [_BucketAverager(interval, TelemetryRing(capacity)) for interval, capacity in tiers]
+    
+    def add(self, ts: float, hotend_actual=None, hotend_target=None,
+            bed_actual=None, bed_target=None, progress=None):
+        row = tuple(NAN if v is None else float(v)
+                    for v in (ts, hotend_actual, hotend_target, bed_actual, bed_target, progress))
+        self.raw.append(row)
+        for tier in self.tiers:
+            tier.add(row)
+    
+    def query(self, since: float, until: Optional[float] = None) -> Dict[str, array]:
+        """Columns for a time range from the finest tier that holds all of it.
+        
+        A tier qualifies when it reaches back to `since` or has not evicted
+        anything yet (then it holds the whole history); otherwise the coarsest
+        tier answers. Averaged tiers include their unfinished newest bucket.
+        """
+        levels = [(self.raw, None)] + [(tier.ring, tier) for tier in self.tiers]
+        for ring, tier in levels:
+            first = ring.first_timestamp()
+            if ring.evicted == 0 or (first is not None and first <= since):
+                break
+        result = ring.query(since, until)
+        pending = tier.pending() if tier is not None else None
+        if pending is not None and pending[0] >= since and (until is None or pending[0] < until):
+            for name, value in zip(TELEMETRY_COLUMNS, pending):
+                result[name].append(value)
+        return result
+    
+    def memory_bytes(self) -> int:
+        rings = [self.raw] + [tier.ring for tier in self.tiers]
+        return sum(ring.capacity * len(TELEMETRY_COLUMNS) * 8 for ring in rings)
+
+
+# ---------------------------
+# Print ETA Estimation
+# ---------------------------
+class EtaEstimator:
+    """Remaining print time from file_position vs print_duration.
+    
+    Keeps exponentially weighted least-squares sums of bytes processed over
+    print time, so each sample costs O(1) and older parts of the print fade
+    out with `half_life` seconds. The measured estimate is blended with the
+    slicer's estimated_time, trusting the measurement more as the print
+    advances.
+    """
+    
+    def __init__(self, half_life: float = 900.0, min_samples: int = 5):
+        self.half_life = half_life
+        self.min_samples = min_samples
+        self.slicer_estimate = None  # seconds, from file metadata
+        self.reset()
+    
+    def reset(self):
+        self._origin = None  # first print_duration, keeps the sums well conditioned
+        self._last_duration = None
+        self._samples = 0
+        self._s0 = self._sx = self._sy = self._sxx = self._sxy = 0.0
+    
+    def add(self, print_duration: float, file_position: float):
+        """Feed one (print_duration, file_position) observation"""
+        if self._last_duration is not None:
+            if print_duration < self._last_duration:
+                # New print started
+                self.reset()
+            elif print_duration == self._last_duration:
+                # Paused or duplicate sample: no new information
+                return
+        if self._origin is None:
+            self._origin = print_duration
+        if self._last_duration is not None:
+            decay = 0.5 ** ((print_duration - self._last_duration) / self.half_life)
+            self._s0 *= decay
+            self._sx *= decay
+            self._sy *= decay
+            self._sxx *= decay
+            self._sxy *= decay
+        x = print_duration - self._origin
+        self._s0 += 1.0
+        self._sx += x
+        self._sy += file_position
+        self._sxx += x * x
+        self._sxy += x * file_position
+        self._last_duration = print_duration
+        self._samples += 1
+    
+    @property
+    def rate(self) -> Optional[float]:
+        """Bytes per second of print time, None until there is enough data"""
+        if self._samples < self.min_samples:
+            return None
+        denominator = self._s0 * self._sxx - self._sx * self._sx
+        if denominator <= 0:
+            return None
+        slope = (self._s0 * self._sxy - self._sx * self._sy) / denominator
+        return slope if slope > 0 else None
+    
+    def remaining(self, file_position: float, file_size: float,
+                  print_duration: Optional[float] = None) -> Optional[float]:
+        """Seconds left, or None if nothing sensible can be said yet"""
+        measured = None
+        rate = self.rate
+        if rate is not None and file_size > 0:
+            measured = max(0.0, file_size - file_position) / rate
+        
+        slicer = None
+        if self.slicer_estimate and print_duration is not None:
+            slicer = max(0.0, self.slicer_estimate - print_duration)
+        
+        if measured is None:
+            return slicer
+        if slicer is None or file_size <= 0:
+            return measured
+        done = min(1.0, max(0.0, file_position / file_size))
+        return done * measured + (1.0 - done) * slicer
+
+
+def format_duration(seconds: float) -> str:
+    """1:05:09 or 12:30"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def progress_text(printer_data) -> str:
+    """Progress bar caption: percentage plus remaining time when known"""
+    text = f"{int(printer_data.progress)}%"
+    if printer_data.eta is not None:
+        text += f" · {format_duration(printer_data.eta)}"
+    return text
+
+
 # ---------------------------
 # Printer Data Container
 # ---------------------------
+class PrinterField(enum.IntFlag):
+    """Bitmask of PrinterData fields, carried by PrinterData.data_updated"""
+    NONE = 0
+    PROGRESS = 1
+    FILENAME = 2
+    HOTEND = 4
+    BED = 8
+    STATUS = 16
+    ETA = 32
+    ALL = PROGRESS | FILENAME | HOTEND | BED | STATUS | ETA
+
+
 class PrinterData(QtCore.QObject):
     """Thread-safe printer data container with signals"""
-    data_updated = QtCore.pyqtSignal(object)  # Signal emitted when data changes
+    data_updated = QtCore.pyqtSignal(object, int)  # (printer_data, changed PrinterField mask)
     
     def __init__(self, name: str, ip: str):
         super().__init__()
@@ -492,8 +1111,45 @@ class PrinterData(QtCore.QObject):
         self._status = "idle"
         self.thumbnail = None
         self.last_thumbnail_filename = ""
-        self.progress_history = []
+        self.progress_history = deque(maxlen=5)
+        self.history = TelemetryHistory()
         self.last_update = time.time()
+        
+        # Remaining time estimation
+        self.eta_estimator = EtaEstimator()
+        self._eta = None  # seconds left
+        self._print_duration = None
+        self._file_position = None
+        self._file_size = None
+        
+        # Transaction state: changes are collected and emitted once
+        self._batch_depth = 0
+        self._pending = PrinterField.NONE
+    
+    def _set_field(self, attr: str, value, field: PrinterField):
+        if getattr(self, attr) == value:
+            return
+        setattr(self, attr, value)
+        self._pending |= field
+        if not self._batch_depth:
+            self._emit_pending()
+    
+    def _emit_pending(self) -> PrinterField:
+        changed, self._pending = self._pending, PrinterField.NONE
+        if changed:
+            self.data_updated.emit(self, int(changed))
+        return changed
+    
+    @contextlib.contextmanager
+    def batch_update(self):
+        """Group several field changes into a single data_updated emission"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._emit_pending()
     
     @property
     def progress(self):
@@ -501,8 +1157,7 @@ class PrinterData(QtCore.QObject):
     
     @progress.setter
     def progress(self, value):
-        self._progress = value
-        self.data_updated.emit(self)
+        self._set_field("_progress", value, PrinterField.PROGRESS)
     
     @property
     def filename(self):
@@ -510,8 +1165,7 @@ class PrinterData(QtCore.QObject):
     
     @filename.setter
     def filename(self, value):
-        self._filename = value
-        self.data_updated.emit(self)
+        self._set_field("_filename", value, PrinterField.FILENAME)
     
     @property
     def hotend_temp(self):
@@ -519,8 +1173,7 @@ class PrinterData(QtCore.QObject):
     
     @hotend_temp.setter
     def hotend_temp(self, value):
-        self._hotend_temp = value
-        self.data_updated.emit(self)
+        self._set_field("_hotend_temp", value, PrinterField.HOTEND)
     
     @property
     def bed_temp(self):
@@ -528,8 +1181,32 @@ class PrinterData(QtCore.QObject):
     
     @bed_temp.setter
     def bed_temp(self, value):
-        self._bed_temp = value
-        self.data_updated.emit(self)
+        self._set_field("_bed_temp", value, PrinterField.BED)
+    
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds until the print finishes, None if unknown"""
+        return self._eta
+    
+    @eta.setter
+    def eta(self, value):
+        self._set_field("_eta", value, PrinterField.ETA)
+    
+    def set_slicer_estimate(self, filename: str, estimated_time: Optional[float]):
+        """Slicer estimated_time from file metadata, ignored if the file changed meanwhile"""
+        if filename != self._filename:
+            return
+        self.eta_estimator.slicer_estimate = estimated_time
+        self._update_eta()
+    
+    def _update_eta(self):
+        if self._status not in ("printing", "paused") or self._file_position is None:
+            self.eta = None
+            return
+        remaining = self.eta_estimator.remaining(self._file_position, self._file_size or 0.0,
+                                                 self._print_duration)
+        # Whole seconds, so tiny fluctuations do not count as a change
+        self.eta = None if remaining is None else float(round(remaining))
     
     @property
     def status(self):
@@ -537,129 +1214,230 @@ class PrinterData(QtCore.QObject):
     
     @status.setter
     def status(self, value):
-        self._status = value
-        self.data_updated.emit(self)
+        self._set_field("_status", value, PrinterField.STATUS)
     
-    def update_from_parsed(self, parsed: Dict):
-        """Update data from parsed message"""
+    def update_from_parsed(self, parsed: Dict) -> PrinterField:
+        """Apply a parsed delta as one transaction, returns the fields that changed"""
         updated = False
         
-        if 'progress' in parsed:
-            val = int(round(float(parsed['progress'])))
-            val = max(0, min(100, val))
+        with self.batch_update():
+            if 'progress' in parsed:
+                val = int(round(float(parsed['progress'])))
+                val = max(0, min(100, val))
+                
+                # Filter progress jumps
+                if self.progress_history:
+                    last_val = self.progress_history[-1]
+                    if abs(val - last_val) > 10 and abs(val - last_val) < 90:
+                        if len(self.progress_history) >= 3:
+                            avg_val = sum(list(self.progress_history)[-3:]) / 3
+                            val = int((val + avg_val * 2) / 3)
+                
+                self.progress = val
+                self.progress_history.append(val)
+                updated = True
             
-            # Filter progress jumps
-            if self.progress_history:
-                last_val = self.progress_history[-1]
-                if abs(val - last_val) > 10 and abs(val - last_val) < 90:
-                    if len(self.progress_history) >= 3:
-                        avg_val = sum(self.progress_history[-3:]) / 3
-                        val = int((val + avg_val * 2) / 3)
+            if 'filename' in parsed:
+                if (parsed['filename'] or "") != self._filename:
+                    # Another file: estimates of the previous one no longer apply
+                    self.eta_estimator.reset()
+                    self.eta_estimator.slicer_estimate = None
+                self.filename = parsed['filename'] or ""
+                updated = True
             
-            self.progress = val
-            self.progress_history.append(val)
-            if len(self.progress_history) > 5:
-                self.progress_history.pop(0)
-            updated = True
-        
-        if 'filename' in parsed:
-            self.filename = parsed['filename'] or ""
-            updated = True
-        
-        if 'hotend' in parsed:
-            h = parsed['hotend']
-            self.hotend_temp = (
-                float(h.get('actual')) if h.get('actual') is not None else None,
-                float(h.get('target')) if h.get('target') is not None else None
-            )
-            updated = True
-        
-        if 'bed' in parsed:
-            b = parsed['bed']
-            self.bed_temp = (
-                float(b.get('actual')) if b.get('actual') is not None else None,
-                float(b.get('target')) if b.get('target') is not None else None
-            )
-            updated = True
-        
-        if 'status' in parsed:
-            self.status = parsed['status']
-            updated = True
-        
-        if updated:
-            self.last_update = time.time()
+            if 'hotend' in parsed:
+                h = parsed['hotend']
+                self.hotend_temp = (
+                    float(h.get('actual')) if h.get('actual') is not None else None,
+                    float(h.get('target')) if h.get('target') is not None else None
+                )
+                updated = True
+            
+            if 'bed' in parsed:
+                b = parsed['bed']
+                self.bed_temp = (
+                    float(b.get('actual')) if b.get('actual') is not None else None,
+                    float(b.get('target')) if b.get('target') is not None else None
+                )
+                updated = True
+            
+            if 'status' in parsed:
+                self.status = parsed['status']
+                updated = True
+            
+            if parsed.keys() & {'print_duration', 'file_position', 'file_size', 'status'}:
+                self._print_duration = parsed.get('print_duration', self._print_duration)
+                self._file_position = parsed.get('file_position', self._file_position)
+                self._file_size = parsed.get('file_size', self._file_size)
+                if self._print_duration is not None and self._file_position is not None:
+                    self.eta_estimator.add(self._print_duration, self._file_position)
+                self._update_eta()
+            
+            if updated:
+                self.last_update = time.time()
+                if parsed.keys() & {'progress', 'hotend', 'bed'}:
+                    self.history.add(self.last_update,
+                                     self._hotend_temp[0], self._hotend_temp[1],
+                                     self._bed_temp[0], self._bed_temp[1],
+                                     self._progress)
+            changed = self._pending
+        
+        return changed
 
 
 # ---------------------------
-# Message Parser
+# Sparkline Graphs
 # ---------------------------
-def parse_moonraker_message(raw: Dict) -> Optional[Dict]:
-    try:
-        if not isinstance(raw, dict):
-            return None
-        
-        method = raw.get('method')
-        if method == 'notify_status_update':
-            params = raw.get('params', [])
-            if params and isinstance(params, list) and len(params) > 0:
-                data = params[0]
-            else:
-                return None
-        elif 'result' in raw and raw.get('result', {}).get('status'):
-            data = raw['result']['status']
+class SparklineRenderer:
+    """Incrementally rendered temperature/progress graph on a backing pixmap.
+    
+    Each pixel column covers span / width seconds. On update the pixmap is
+    scrolled left by the number of elapsed columns and only the new columns
+    are drawn, each as a min/max bar of the samples inside it, so the cost is
+    bounded by the widget width, not by the sample count.
+    """
+    SERIES = (
+        ("hotend_actual", QtGui.QColor(255, 140, 60)),
+        ("bed_actual", QtGui.QColor(90, 170, 255)),
+        ("progress", QtGui.QColor(120, 220, 120)),
+    )
+    TEMPERATURES = ("hotend_actual", "hotend_target", "bed_actual", "bed_target")
+    
+    def __init__(self, span: float = 600.0):
+        self.span = span
+        self._pixmap = None
+        self._size = None
+        self._dpr = 1.0
+        self._last_col = None   # absolute index of the rightmost drawn column
+        self._temp_scale = 50.0  # °C mapped to the full height, in 50 °C steps of the visible peak
+        self._peaks = deque()  # (column, peak °C) with decreasing peaks: sliding-window maximum
+    
+    def invalidate(self):
+        self._pixmap = None
+    
+    def render(self, history: TelemetryHistory, size: QtCore.QSize, dpr: float,
+               now: Optional[float] = None) -> QtGui.QPixmap:
+        """Return the graph pixmap for `size`, updated up to `now`"""
+        now = time.time() if now is None else now
+        width = max(1, size.width())
+        sec_per_col = self.span / width
+        now_col = int(now // sec_per_col)
+        
+        full = (self._pixmap is None or self._size != size or self._dpr != dpr
+                or self._last_col is None or now_col - self._last_col >= width)
+        if not full:
+            # The previously rightmost column may have received more samples;
+            # one more column is read so the line joins up with it
+            first_col = self._last_col
+            data = history.query((first_col - 1) * sec_per_col, (now_col + 1) * sec_per_col)
+            self._track_peaks(data, first_col, sec_per_col)
+            self._expire_peaks(now_col - width + 1)
+            # A peak entering or leaving the window changes the scale, which means redrawing everything
+            full = self._scale() != self._temp_scale
+        
+        if full:
+            first_col = now_col - width + 1
+            data = history.query((first_col - 1) * sec_per_col, (now_col + 1) * sec_per_col)
+            self._peaks.clear()
+            self._track_peaks(data, first_col, sec_per_col)
+            self._temp_scale = self._scale()
+            self._size = QtCore.QSize(size)
+            self._dpr = dpr
+            self._pixmap = QtGui.QPixmap(int(width * dpr), int(size.height() * dpr))
+            self._pixmap.setDevicePixelRatio(dpr)
+            self._pixmap.fill(QtCore.Qt.transparent)
         else:
-            return None
-        
-        if not data or not isinstance(data, dict):
-            return None
-        
-        result = {}
-        
-        # Hotend temperature
-        if 'extruder' in data and isinstance(data['extruder'], dict):
-            extruder = data['extruder']
-            if 'temperature' in extruder:
-                temp = extruder['temperature']
-                result['hotend'] = {
-                    "actual": float(temp) if isinstance(temp, (int, float)) else None,
-                    "target": float(extruder.get('target')) if extruder.get('target') is not None else None
-                }
-        
-        # Bed temperature
-        if 'heater_bed' in data and isinstance(data['heater_bed'], dict):
-            heater_bed = data['heater_bed']
-            if 'temperature' in heater_bed:
-                temp = heater_bed['temperature']
-                result['bed'] = {
-                    "actual": float(temp) if isinstance(temp, (int, float)) else None,
-                    "target": float(heater_bed.get('target')) if heater_bed.get('target') is not None else None
-                }
-        
-        # Print stats
-        if 'print_stats' in data and isinstance(data['print_stats'], dict):
-            print_stats = data['print_stats']
-            
-            if 'filename' in print_stats:
-                result['filename'] = print_stats['filename']
-            
-            if 'state' in print_stats:
-                result['status'] = print_stats['state']
-        
-        # Progress from virtual_sdcard (most reliable)
-        if 'virtual_sdcard' in data and isinstance(data['virtual_sdcard'], dict):
-            vsd = data['virtual_sdcard']
-            if 'progress' in vsd:
-                try:
-                    progress = float(vsd['progress'])
-                    result['progress'] = int(round(progress * 100))
-                except Exception:
-                    pass
-        
-        return result
-        
-    except Exception as e:
-        print(f"[Parser] Error: {e}")
-        return None
+            shift = now_col - self._last_col
+            if shift > 0:
+                self._pixmap.scroll(-int(shift * dpr), 0, self._pixmap.rect())
+        
+        self._draw_columns(data, first_col, now_col, sec_per_col, width)
+        self._last_col = now_col
+        return self._pixmap
+    
+    def _track_peaks(self, data: Dict[str, array], first_col: int, sec_per_col: float):
+        """Fold the highest temperature of every column >= first_col into the running maximum"""
+        timestamps = data["timestamp"]
+        start = bisect.bisect_left(timestamps, first_col * sec_per_col)
+        per_col = {}
+        for name in self.TEMPERATURES:
+            values = data[name]
+            for i in range(start, len(timestamps)):
+                value = values[i]
+                col = int(timestamps[i] // sec_per_col)
+                if value > per_col.get(col, 0.0):  # NaN compares False
+                    per_col[col] = value
+        for col in sorted(per_col):
+            peak = per_col[col]
+            while self._peaks and self._peaks[-1][1] <= peak:
+                self._peaks.pop()
+            self._peaks.append((col, peak))
+    
+    def _expire_peaks(self, first_col: int):
+        while self._peaks and self._peaks[0][0] < first_col:
+            self._peaks.popleft()
+    
+    def _scale(self) -> float:
+        peak = self._peaks[0][1] if self._peaks else 0.0
+        return max(50.0, math.ceil(peak / 50.0) * 50.0)
+    
+    def _draw_columns(self, data: Dict[str, array], first_col: int, last_col: int,
+                      sec_per_col: float, width: int):
+        height = self._size.height()
+        
+        # Min/max and last value per pixel column and series
+        columns = {}
+        timestamps = data["timestamp"]
+        for name, _ in self.SERIES:
+            values = data[name]
+            scale = 100.0 if name == "progress" else self._temp_scale
+            per_col = columns.setdefault(name, {})
+            for ts, value in zip(timestamps, values):
+                if value != value:
+                    continue
+                col = int(ts // sec_per_col)
+                y = height - 1 - min(1.0, max(0.0, value / scale)) * (height - 1)
+                entry = per_col.get(col)
+                if entry is None:
+                    per_col[col] = [y, y, y]
+                else:
+                    entry[0] = min(entry[0], y)
+                    entry[1] = max(entry[1], y)
+                    entry[2] = y
+        
+        p = QtGui.QPainter(self._pixmap)
+        # Clear the columns being (re)drawn
+        x0 = width - 1 - (last_col - first_col)
+        p.setCompositionMode(QtGui.QPainter.CompositionMode_Clear)
+        p.fillRect(QtCore.QRectF(x0, 0, last_col - first_col + 1, height), QtCore.Qt.transparent)
+        p.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)
+        for name, color in self.SERIES:
+            p.setPen(QtGui.QPen(color, 1))
+            per_col = columns[name]
+            for col, (lo, hi, _) in per_col.items():
+                if col < first_col:
+                    continue
+                # Reach to the previous column's last value so the line stays continuous
+                previous = per_col.get(col - 1)
+                if previous is not None:
+                    lo, hi = min(lo, previous[2]), max(hi, previous[2])
+                x = width - 1 - (last_col - col) + 0.5
+                p.drawLine(QtCore.QPointF(x, lo), QtCore.QPointF(x, hi + 0.01))
+        p.end()
+
+
+class SparklineWidget(QtWidgets.QWidget):
+    """Small history graph for PrinterDisplayWidget"""
+    def __init__(self, printer_data: PrinterData, parent=None):
+        super().__init__(parent)
+        self.printer_data = printer_data
+        self.renderer = SparklineRenderer()
+        self.setFixedHeight(30)
+    
+    def paintEvent(self, e):
+        p = QtGui.QPainter(self)
+        pixmap = self.renderer.render(self.printer_data.history, self.size(), self.devicePixelRatioF())
+        p.drawPixmap(0, 0, pixmap)
 
 
 # ---------------------------
@@ -672,7 +1450,6 @@ class PrinterDisplayWidget(QtWidgets.QWidget):
         self.printer_data = printer_data
         self.config = config
         self.embedded = embedded
-        self.thumbnail_loader = ThumbnailLoader()
         
         self.init_ui()
         
@@ -771,6 +1548,12 @@ class PrinterDisplayWidget(QtWidgets.QWidget):
         
         layout.addLayout(temp_row)
         
+        # History graph
+        self.sparkline = None
+        if self.config.config.get("show_graphs", False):
+            self.sparkline = SparklineWidget(self.printer_data)
+            layout.addWidget(self.sparkline)
+        
         self.setLayout(layout)
         self.update_display()
     
@@ -785,58 +1568,70 @@ class PrinterDisplayWidget(QtWidgets.QWidget):
             p.drawRoundedRect(rect, 10, 10)
         super().paintEvent(e)
     
-    @QtCore.pyqtSlot(object)
-    def on_data_updated(self, printer_data):
+    @QtCore.pyqtSlot(object, int)
+    def on_data_updated(self, printer_data, changed):
         """Update display when data changes"""
-        self.update_display()
+        changed = PrinterField(changed)
+        self.update_display(changed)
+        if self.sparkline is not None and changed & (PrinterField.HOTEND | PrinterField.BED | PrinterField.PROGRESS):
+            self.sparkline.update()
         
         # Update thumbnail if needed
-        if printer_data.filename and printer_data.filename != printer_data.last_thumbnail_filename:
-            printer_data.last_thumbnail_filename = printer_data.filename
-            self.load_thumbnail(printer_data.ip, printer_data.filename)
+        if changed & PrinterField.FILENAME:
+            if printer_data.filename and printer_data.filename != printer_data.last_thumbnail_filename:
+                printer_data.last_thumbnail_filename = printer_data.filename
+                self.load_thumbnail(printer_data.ip, printer_data.filename)
     
-    def update_display(self):
-        """Update display from printer data"""
+    def update_display(self, changed: PrinterField = PrinterField.ALL):
+        """Update display from printer data, touching only the changed fields"""
         data = self.printer_data
         if updates_paused:
             return
-        # Update name (in case it was changed)
-        self.name_label.setText(data.name)
+        if changed == PrinterField.ALL:
+            # Update name (in case it was changed)
+            self.name_label.setText(data.name)
         
         # Update filename
-        self.filename_label.setText(data.filename or "—")
+        if changed & PrinterField.FILENAME:
+            self.filename_label.setText(data.filename or "—")
         
         # Update progress
-        self.progress_bar.setValue(int(data.progress))
-        self.progress_bar.setFormat(f"{int(data.progress)}%")
+        if changed & (PrinterField.PROGRESS | PrinterField.ETA):
+            self.progress_bar.setValue(int(data.progress))
+            self.progress_bar.setFormat(progress_text(data))
         
         # Update temperatures
-        hotend_text = f"Hotend: {data.hotend_temp[0]:.1f}°C" if data.hotend_temp[0] is not None else "Hotend: —"
-        if data.hotend_temp[1] is not None:
-            hotend_text += f" / {data.hotend_temp[1]:.0f}°C"
-        self.hotend_label.setText(hotend_text)
-        
-        bed_text = f"Bed: {data.bed_temp[0]:.1f}°C" if data.bed_temp[0] is not None else "Bed: —"
-        if data.bed_temp[1] is not None:
-            bed_text += f" / {data.bed_temp[1]:.0f}°C"
-        self.bed_label.setText(bed_text)
+        if changed & PrinterField.HOTEND:
+            hotend_text = f"Hotend: {data.hotend_temp[0]:.1f}°C" if data.hotend_temp[0] is not None else "Hotend: —"
+            if data.hotend_temp[1] is not None:
+                hotend_text += f" / {data.hotend_temp[1]:.0f}°C"
+            self.hotend_label.setText(hotend_text)
+        
+        if changed & PrinterField.BED:
+            bed_text = f"Bed: {data.bed_temp[0]:.1f}°C" if data.bed_temp[0] is not None else "Bed: —"
+            if data.bed_temp[1] is not None:
+                bed_text += f" / {data.bed_temp[1]:.0f}°C"
+            self.bed_label.setText(bed_text)
         
         # Update status
-        self.status_label.setText(f"Status: {data.status}")
+        if changed & PrinterField.STATUS:
+            self.status_label.setText(f"Status: {data.status}")
     
     def load_thumbnail(self, ip: str, filename: str):
-        """Load thumbnail in background"""
-        def load_and_update():
-            pixmap = self.thumbnail_loader.fetch_thumbnail(ip, filename)
-            if pixmap and not pixmap.isNull():
-                scaled = pixmap.scaled(self.thumb_label.size(),
-                                      QtCore.Qt.KeepAspectRatio,
-                                      QtCore.Qt.SmoothTransformation)
-                QtCore.QMetaObject.invokeMethod(self, "set_thumbnail",
-                                              QtCore.Qt.QueuedConnection,
-                                              QtCore.Q_ARG(QtGui.QPixmap, scaled))
-        
-        self.thumbnail_loader.executor.submit(load_and_update)
+        """Load thumbnail through the shared thumbnail service"""
+        def on_thumbnail(pixmap: QtGui.QPixmap):
+            # Ignore late results for a file that is no longer printing
+            if filename != self.printer_data.filename:
+                return
+            dpr = self.devicePixelRatioF()
+            scaled = pixmap.scaled(self.thumb_label.size() * dpr,
+                                   QtCore.Qt.KeepAspectRatio,
+                                   QtCore.Qt.SmoothTransformation)
+            scaled.setDevicePixelRatio(dpr)
+            self.set_thumbnail(scaled)
+        
+        size = self.thumb_label.size() * self.devicePixelRatioF()
+        ThumbnailService.instance(self.config).request(ip, filename, size, on_thumbnail)
     
     @QtCore.pyqtSlot(QtGui.QPixmap)
     def set_thumbnail(self, pixmap: QtGui.QPixmap):
@@ -859,12 +1654,16 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         self.printers_data = printers_data
         self.config = config
         self.on_settings_callback = on_settings_callback
-        self.thumbnail_loader = ThumbnailLoader()
-        self.thumbnails = {}  # Cache for thumbnails: {printer_index: pixmap}
+        self.thumbnails = {}  # Source thumbnails: {printer_index: (filename, pixmap)}
+        # Ready-to-blit pixmaps: {(printer_index, filename, width, height, dpr): pixmap}
+        self._thumbnail_render_cache = {}
+        self._sparklines = {}  # printer_index -> SparklineRenderer
         
         self._drag_pos = None
         self.footer_visible = False
         self.hovered_printer = -1  # Index of currently hovered printer, -1 for none
+        self.debug_hud = None  # DebugHud while the overlay is enabled
+        self._painted_ips = []  # printers whose block the current repaint covers, for the HUD
         
         self.init_ui()
         self.setup_animations()
@@ -887,6 +1686,9 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         
         # Constants for layout (matching PrinterDisplayWidget embedded mode)
         self.printer_height = 140  # Slightly increased for better spacing
+        self.show_graphs = self.config.config.get("show_graphs", False)
+        self.graph_height = 40 if self.show_graphs else 0
+        self.printer_height += self.graph_height
         self.spacing = 6  # Increased spacing between printers
         self.padding_h = 8  # Horizontal padding
         self.padding_v = 4  # Vertical padding for embedded mode
@@ -911,19 +1713,36 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         self.footer_animation.setEasingCurve(QtCore.QEasingCurve.OutCubic)
         self.footer_animation.valueChanged.connect(self.update_footer_height)
     
+    def event(self, e):
+        # UpdateRequest repaints the dirty region, so time it for the debug HUD
+        if self.debug_hud is None or e.type() != QtCore.QEvent.UpdateRequest:
+            return super().event(e)
+        self._painted_ips = []
+        started = time.perf_counter()
+        result = super().event(e)
+        self.debug_hud.record_paint(self._painted_ips, time.perf_counter() - started)
+        return result
+    
     def paintEvent(self, e):
         p = QtGui.QPainter(self)
         p.setRenderHint(QtGui.QPainter.Antialiasing)
         
+        # Repaint only what Qt asked for (accumulated update(rect) calls)
+        region = e.region()
+        p.setClipRegion(region)
+        
         # Draw main background
         rect = self.rect()
         p.setBrush(QtGui.QColor(18, 20, 25, 220))
         p.setPen(QtCore.Qt.NoPen)
         p.drawRoundedRect(rect, 10, 10)
         
-        # Draw each printer's block
+        # Draw each printer's block that intersects the dirty region
         for i, printer_data in enumerate(self.printers_data):
-            self.draw_printer_block(p, i, printer_data)
+            if region.intersects(self.block_rect(i)):
+                self.draw_printer_block(p, i, printer_data, region)
+                if self.debug_hud is not None:
+                    self._painted_ips.append(printer_data.ip)
         
         # Draw footer if visible
         if self.footer_height > 0:
@@ -931,13 +1750,58 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         
         super().paintEvent(e)
     
-    def draw_printer_block(self, p: QtGui.QPainter, index: int, printer_data: PrinterData):
-        """Draw a single printer's information block matching PrinterDisplayWidget layout"""
+    def block_rect(self, index: int) -> QtCore.QRect:
+        """Rectangle of a printer block"""
+        y_pos = index * (self.printer_height + self.spacing)
+        return QtCore.QRect(0, y_pos, self.width, self.printer_height)
+    
+    def block_layout(self, index: int) -> Dict[str, QtCore.QRect]:
+        """Sub-rectangles of a printer block: name, thumb, filename, progress, temps"""
         y_pos = index * (self.printer_height + self.spacing)
+        inner_width = self.width - 2 * self.padding_h
+        thumb_y = y_pos + self.padding_v + 24 + 6  # Name height + spacing
+        progress_y = thumb_y + 60 + 6  # Thumbnail height + spacing
+        temp_y = progress_y + 18 + 6  # Progress bar height + spacing
+        return {
+            "name": QtCore.QRect(self.padding_h, y_pos + self.padding_v, inner_width, 24),
+            "thumb": QtCore.QRect(self.padding_h, thumb_y, 80, 60),
+            "filename": QtCore.QRect(self.padding_h + 80 + 6, thumb_y,
+                                     self.width - self.padding_h - (80 + 6) - self.padding_h, 60),
+            "progress": QtCore.QRect(self.padding_h, progress_y, inner_width, 18),
+            "temps": QtCore.QRect(self.padding_h, temp_y, inner_width, 20),
+            "graph": QtCore.QRect(self.padding_h, temp_y + 20 + 2, inner_width, max(0, self.graph_height - 10)),
+        }
+    
+    def mark_dirty(self, index: int, changed: PrinterField = PrinterField.ALL):
+        """Schedule a repaint of the parts of a printer block affected by `changed`"""
+        if not 0 <= index < self.printer_count:
+            return
+        if changed == PrinterField.ALL:
+            self.update(self.block_rect(index))
+            return
+        layout = self.block_layout(index)
+        if changed & PrinterField.FILENAME:
+            self.update(layout["filename"])
+            self.update(layout["thumb"])
+        if changed & (PrinterField.PROGRESS | PrinterField.ETA):
+            self.update(layout["progress"])
+        if changed & (PrinterField.HOTEND | PrinterField.BED | PrinterField.STATUS):
+            # Hotend, bed and status share one row whose spacing depends on all three texts
+            self.update(layout["temps"])
+        if self.show_graphs and changed & (PrinterField.HOTEND | PrinterField.BED | PrinterField.PROGRESS):
+            self.update(layout["graph"])
+    
+    def draw_printer_block(self, p: QtGui.QPainter, index: int, printer_data: PrinterData,
+                           region: Optional[QtGui.QRegion] = None):
+        """Draw a single printer's information block matching PrinterDisplayWidget layout"""
+        block_rect = self.block_rect(index)
+        layout = self.block_layout(index)
+        y_pos = block_rect.y()
         
-        # Draw printer block background (matching embedded widget)
-        block_rect = QtCore.QRect(0, y_pos, self.width, self.printer_height)
+        def dirty(part: str) -> bool:
+            return region is None or region.intersects(layout[part])
         
+        # Draw printer block background (matching embedded widget)
         # Hover effect (subtle)
         if index == self.hovered_printer:
             p.setBrush(QtGui.QColor(35, 40, 50, 180))
@@ -953,57 +1817,72 @@ class MultiPrinterWidget(QtWidgets.QWidget):
             p.drawLine(0, y_pos + self.printer_height, 
                       self.width, y_pos + self.printer_height)
         
-        # Draw printer name (center top)
-        p.setPen(QtGui.QPen(QtGui.QColor(255, 255, 255)))
-        font = p.font()
-        font.setBold(True)
-        font.setPointSize(14)
-        p.setFont(font)
+        # Every part starts from the same bold base font, so a partial repaint
+        # renders exactly like a full pass
+        base_font = QtGui.QFont(self.font())
+        base_font.setBold(True)
+        font = QtGui.QFont(base_font)
         
-        name_rect = QtCore.QRect(self.padding_h, y_pos + self.padding_v, 
-                                self.width - 2 * self.padding_h, 24)
-        p.drawText(name_rect, QtCore.Qt.AlignCenter, printer_data.name)
+        # Draw printer name (center top)
+        if dirty("name"):
+            p.setPen(QtGui.QPen(QtGui.QColor(255, 255, 255)))
+            font.setBold(True)
+            font.setPointSize(14)
+            p.setFont(font)
+            p.drawText(layout["name"], QtCore.Qt.AlignCenter, printer_data.name)
         
         # Draw thumbnail area (left side, 80x60)
-        thumb_y = y_pos + self.padding_v + 24 + 6  # Name height + spacing
-        thumb_rect = QtCore.QRect(self.padding_h, thumb_y, 80, 60)
-        self.draw_thumbnail(p, thumb_rect, index, printer_data)
+        if dirty("thumb"):
+            p.setFont(base_font)
+            self.draw_thumbnail(p, layout["thumb"], index, printer_data)
         
         # Draw filename (right side of thumbnail)
-        font.setBold(True)
-        font.setPointSize(12)
-        p.setFont(font)
-        
-        filename = printer_data.filename or "—"
-        # Wrap filename if too long
-        if len(filename) > 30:
-            # Try to find a good break point
-            if len(filename) > 60:
-                filename = filename[:57] + "..."
-        
-        filename_rect = QtCore.QRect(self.padding_h + 80 + 6, thumb_y, 
-                                    self.width - self.padding_h - (80 + 6) - self.padding_h, 60)
-        
-        # Draw filename with word wrap - ИСПРАВЛЕНО
-        p.save()
-        p.setPen(QtGui.QPen(QtGui.QColor(255, 255, 255)))
-        
-        # Используем правильную перегрузку drawText
-        text_option = QtGui.QTextOption()
-        text_option.setWrapMode(QtGui.QTextOption.WordWrap)
-        text_option.setAlignment(QtCore.Qt.AlignTop | QtCore.Qt.AlignLeft)
-        
-        # Преобразуем QRect в QRectF и используем правильную сигнатуру
-        p.drawText(QtCore.QRectF(filename_rect), filename, text_option)
-        p.restore()
+        if dirty("filename"):
+            font.setBold(True)
+            font.setPointSize(12)
+            p.setFont(font)
+            
+            filename = printer_data.filename or "—"
+            # Wrap filename if too long
+            if len(filename) > 30:
+                # Try to find a good break point
+                if len(filename) > 60:
+                    filename = filename[:57] + "..."
+            
+            # Draw filename with word wrap - ИСПРАВЛЕНО
+            p.save()
+            p.setPen(QtGui.QPen(QtGui.QColor(255, 255, 255)))
+            
+            # Используем правильную перегрузку drawText
+            text_option = QtGui.QTextOption()
+            text_option.setWrapMode(QtGui.QTextOption.WordWrap)
+            text_option.setAlignment(QtCore.Qt.AlignTop | QtCore.Qt.AlignLeft)
+            
+            # Преобразуем QRect в QRectF и используем правильную сигнатуру
+            p.drawText(QtCore.QRectF(layout["filename"]), filename, text_option)
+            p.restore()
         
         # Draw progress bar (below thumbnail row)
-        progress_y = thumb_y + 60 + 6  # Thumbnail height + spacing
-        self.draw_progress_bar(p, progress_y, printer_data)
+        if dirty("progress"):
+            p.setFont(base_font)
+            self.draw_progress_bar(p, layout["progress"].y(), printer_data)
         
         # Draw temperatures and status (below progress bar)
-        temp_y = progress_y + 18 + 6  # Progress bar height + spacing
-        self.draw_temperatures(p, temp_y, printer_data)
+        if dirty("temps"):
+            p.setFont(base_font)
+            self.draw_temperatures(p, layout["temps"].y(), printer_data)
+        
+        # Draw history graph (below temperatures)
+        if self.show_graphs and dirty("graph"):
+            self.draw_graph(p, layout["graph"], index, printer_data)
+    
+    def draw_graph(self, p: QtGui.QPainter, rect: QtCore.QRect, index: int, printer_data: PrinterData):
+        """Draw the incrementally rendered history graph of a printer"""
+        renderer = self._sparklines.get(index)
+        if renderer is None:
+            renderer = self._sparklines[index] = SparklineRenderer()
+        pixmap = renderer.render(printer_data.history, rect.size(), self.devicePixelRatioF())
+        p.drawPixmap(rect.topLeft(), pixmap)
     
     def draw_thumbnail(self, p: QtGui.QPainter, rect: QtCore.QRect, index: int, printer_data: PrinterData):
         """Draw thumbnail matching the style from PrinterDisplayWidget"""
@@ -1013,15 +1892,15 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         p.drawRoundedRect(rect, 4, 4)
         
         # Draw thumbnail if available
-        if index in self.thumbnails and not self.thumbnails[index].isNull():
-            pixmap = self.thumbnails[index]
-            # Scale pixmap to fit while keeping aspect ratio
-            scaled = pixmap.scaled(rect.size(), 
-                                 QtCore.Qt.KeepAspectRatio, 
-                                 QtCore.Qt.SmoothTransformation)
-            pixmap_x = rect.x() + (rect.width() - scaled.width()) // 2
-            pixmap_y = rect.y() + (rect.height() - scaled.height()) // 2
-            p.drawPixmap(pixmap_x, pixmap_y, scaled)
+        rendered = self.rendered_thumbnail(index, rect.size())
+        if rendered is not None:
+            # Pixmap is already scaled for this size and DPI, just blit it
+            dpr = rendered.devicePixelRatio()
+            width = int(round(rendered.width() / dpr))
+            height = int(round(rendered.height() / dpr))
+            pixmap_x = rect.x() + (rect.width() - width) // 2
+            pixmap_y = rect.y() + (rect.height() - height) // 2
+            p.drawPixmap(pixmap_x, pixmap_y, rendered)
         else:
             # Draw placeholder text (matching the original)
             p.setPen(QtGui.QPen(QtGui.QColor(200, 200, 200)))
@@ -1042,11 +1921,6 @@ class MultiPrinterWidget(QtWidgets.QWidget):
                           line_height,
                           QtCore.Qt.AlignCenter, 
                           line)
-            
-            # Check if we need to load thumbnail
-            if printer_data.filename and printer_data.filename != getattr(printer_data, 'last_thumbnail_filename', None):
-                printer_data.last_thumbnail_filename = printer_data.filename
-                self.load_thumbnail(index, printer_data.ip, printer_data.filename)
     
     def draw_progress_bar(self, p: QtGui.QPainter, y: int, printer_data: PrinterData):
         """Draw progress bar matching the style from PrinterDisplayWidget"""
@@ -1083,7 +1957,7 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         p.setFont(font)
         
         # Используем правильную перегрузку drawText
-        p.drawText(bar_rect, QtCore.Qt.AlignCenter, f"{progress}%")
+        p.drawText(bar_rect, QtCore.Qt.AlignCenter, progress_text(printer_data))
     
     def draw_temperatures(self, p: QtGui.QPainter, y: int, printer_data: PrinterData):
         """Draw temperature and status information matching PrinterDisplayWidget layout"""
@@ -1169,32 +2043,86 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         self.setFixedSize(self.width, new_height)
     
     def load_thumbnail(self, printer_index: int, ip: str, filename: str):
-        """Load thumbnail for a specific printer"""
-        def load_and_update():
-            pixmap = self.thumbnail_loader.fetch_thumbnail(ip, filename)
-            if pixmap and not pixmap.isNull():
-                # Scale to match thumbnail size (80x60)
-                scaled = pixmap.scaled(80, 60, 
-                                     QtCore.Qt.KeepAspectRatio, 
-                                     QtCore.Qt.SmoothTransformation)
-                QtCore.QMetaObject.invokeMethod(
-                    self, "set_thumbnail", 
-                    QtCore.Qt.QueuedConnection,
-                    QtCore.Q_ARG(int, printer_index),
-                    QtCore.Q_ARG(QtGui.QPixmap, scaled)
-                )
+        """Load thumbnail for a specific printer through the shared thumbnail service"""
+        printer_data = self.printers_data[printer_index]
         
-        self.thumbnail_loader.executor.submit(load_and_update)
+        def on_thumbnail(pixmap: QtGui.QPixmap):
+            # Ignore late results for a file that is no longer printing
+            if filename == printer_data.filename:
+                self.set_thumbnail(printer_index, filename, pixmap)
+        
+        # Ask for the smallest variant that is still sharp at the current DPI
+        size = self.block_layout(printer_index)["thumb"].size() * self.devicePixelRatioF()
+        ThumbnailService.instance(self.config).request(ip, filename, size, on_thumbnail)
     
-    @QtCore.pyqtSlot(int, QtGui.QPixmap)
-    def set_thumbnail(self, printer_index: int, pixmap: QtGui.QPixmap):
+    @QtCore.pyqtSlot(int, str, QtGui.QPixmap)
+    def set_thumbnail(self, printer_index: int, filename: str, pixmap: QtGui.QPixmap):
         """Set thumbnail for a specific printer and trigger repaint"""
         if pixmap and not pixmap.isNull():
-            self.thumbnails[printer_index] = pixmap
-            self.update()
+            current = self.thumbnails.get(printer_index)
+            if current is not None and current[0] == filename and current[1].cacheKey() == pixmap.cacheKey():
+                return
+            self.thumbnails[printer_index] = (filename, pixmap)
+            self.invalidate_thumbnail_cache(printer_index)
+            if 0 <= printer_index < self.printer_count:
+                self.update(self.block_layout(printer_index)["thumb"])
+    
+    def rendered_thumbnail(self, printer_index: int, size: QtCore.QSize) -> Optional[QtGui.QPixmap]:
+        """Return the thumbnail pre-scaled for `size` at the current devicePixelRatio"""
+        entry = self.thumbnails.get(printer_index)
+        if entry is None or entry[1].isNull():
+            return None
+        filename, source = entry
+        dpr = self.devicePixelRatioF()
+        key = (printer_index, filename, size.width(), size.height(), dpr)
+        rendered = self._thumbnail_render_cache.get(key)
+        if rendered is None:
+            target_w, target_h = int(size.width() * dpr), int(size.height() * dpr)
+            if not thumbnail_covers(source.width(), source.height(), target_w, target_h):
+                # Widget got larger or moved to a HiDPI screen: upgrade to a bigger variant
+                self._request_thumbnail_upgrade(printer_index, filename)
+            rendered = source.scaled(int(size.width() * dpr), int(size.height() * dpr),
+                                     QtCore.Qt.KeepAspectRatio,
+                                     QtCore.Qt.SmoothTransformation)
+            rendered.setDevicePixelRatio(dpr)
+            self._thumbnail_render_cache[key] = rendered
+        return rendered
     
-    @QtCore.pyqtSlot(object)
-    def on_data_updated(self, printer_data):
+    def _request_thumbnail_upgrade(self, printer_index: int, filename: str):
+        printer_data = self.printers_data[printer_index]
+        if filename != printer_data.filename:
+            return
+        # Not from inside paintEvent: the service may answer synchronously
+        QtCore.QTimer.singleShot(0, lambda: self.load_thumbnail(printer_index, printer_data.ip, filename))
+    
+    def invalidate_thumbnail_cache(self, printer_index: Optional[int] = None):
+        """Drop pre-scaled thumbnails for one printer, or all of them"""
+        if printer_index is None:
+            self._thumbnail_render_cache.clear()
+            return
+        for key in [k for k in self._thumbnail_render_cache if k[0] == printer_index]:
+            del self._thumbnail_render_cache[key]
+    
+    def showEvent(self, e):
+        # Moving to a monitor with another scale factor changes devicePixelRatio
+        window = self.windowHandle()
+        if window is not None and not getattr(self, '_screen_signal_connected', False):
+            window.screenChanged.connect(self.on_screen_changed)
+            self._screen_signal_connected = True
+        super().showEvent(e)
+    
+    def on_screen_changed(self, screen):
+        self.invalidate_thumbnail_cache()
+        self.update()
+    
+    def resizeEvent(self, e):
+        # Footer animation only changes the height; block geometry follows the width
+        if e.oldSize().width() != e.size().width():
+            self.invalidate_thumbnail_cache()
+        super().resizeEvent(e)
+    
+    @QtCore.pyqtSlot(object, int)
+    def on_data_updated(self, printer_data, changed):
         """Handle data update from any printer"""
         if updates_paused:
             return
@@ -1203,13 +2131,14 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         try:
             printer_index = self.printers_data.index(printer_data)
             # Trigger thumbnail load if filename changed
-            if printer_data.filename and printer_data.filename != getattr(printer_data, 'last_thumbnail_filename', None):
+            if (changed & PrinterField.FILENAME and printer_data.filename
+                    and printer_data.filename != getattr(printer_data, 'last_thumbnail_filename', None)):
                 printer_data.last_thumbnail_filename = printer_data.filename
                 self.load_thumbnail(printer_index, printer_data.ip, printer_data.filename)
         except ValueError:
-            pass
+            return
         
-        self.update()
+        self.mark_dirty(printer_index, PrinterField(changed))
     
     # Mouse event handlers
     def mousePressEvent(self, e):
@@ -1228,10 +2157,11 @@ class MultiPrinterWidget(QtWidgets.QWidget):
         if self.hovered_printer >= self.printer_count:
             self.hovered_printer = -1
         
-        # Only repaint if hover state changed
+        # Only repaint if hover state changed, and only the two affected blocks
         old_hover = getattr(self, '_last_hovered', -1)
         if old_hover != self.hovered_printer:
-            self.update()
+            self.mark_dirty(old_hover)
+            self.mark_dirty(self.hovered_printer)
             self._last_hovered = self.hovered_printer
         
         # Handle dragging
@@ -1262,8 +2192,9 @@ class MultiPrinterWidget(QtWidgets.QWidget):
     def leaveEvent(self, event):
         if self._drag_pos is None:
             self.hide_footer()
+        self.mark_dirty(self.hovered_printer)
         self.hovered_printer = -1
-        self.update()
+        self._last_hovered = -1
         super().leaveEvent(event)
     
     def show_footer(self):
@@ -1293,6 +2224,7 @@ class SinglePrinterWidget(QtWidgets.QWidget):
         self.setup_context_menu()
         self._drag_pos = None
         self.footer_visible = False
+        self.debug_hud = None  # DebugHud while the overlay is enabled
         
         self.init_ui()
         self.setup_animations()
@@ -1316,8 +2248,6 @@ class SinglePrinterWidget(QtWidgets.QWidget):
     def close_widget(self):
         """Закрываем окно виджета и выполняем скрипт закрытия"""
         print(f"[{self.printer_data.name}] Виджет закрыт через контекстное меню")
-        global end 
-        end = True
         self.close()  # закрывает окно
     def init_ui(self):
         self.setWindowTitle(f"Widget - {self.printer_data.name}")
@@ -1331,6 +2261,8 @@ class SinglePrinterWidget(QtWidgets.QWidget):
         width = self.config.config.get("widget_width", 360)
         height = self.config.config.get("widget_height", 150)
         opacity = self.config.config.get("widget_opacity", 0.88)
+        if self.config.config.get("show_graphs", False):
+            height += 36  # Room for the history graph
         
         self.setFixedSize(width, height)
         self.setWindowOpacity(opacity)
@@ -1374,6 +2306,15 @@ class SinglePrinterWidget(QtWidgets.QWidget):
             # Запускаем следующий кадр
             self._move_timer.start()
     
+    def event(self, e):
+        # UpdateRequest repaints the window with its child labels, so time it for the debug HUD
+        if self.debug_hud is None or e.type() != QtCore.QEvent.UpdateRequest:
+            return super().event(e)
+        started = time.perf_counter()
+        result = super().event(e)
+        self.debug_hud.record_paint([self.printer_data.ip], time.perf_counter() - started)
+        return result
+    
     def paintEvent(self, e):
         p = QtGui.QPainter(self)
         p.setRenderHint(QtGui.QPainter.Antialiasing)
@@ -1476,6 +2417,12 @@ class TrayIconManager(QtCore.QObject):
             # Создаем контекстное меню
             menu = QMenu()
             
+            # Отладочная панель с задержками по этапам
+            hud_action = QAction("Отладочная панель", menu)
+            hud_action.setCheckable(True)
+            hud_action.toggled.connect(self.parent().set_debug_hud)
+            menu.addAction(hud_action)
+            
             # Действие "Выход"
             exit_action = QAction("Выход", menu)
             exit_action.triggered.connect(self.exit_application)
@@ -1530,54 +2477,254 @@ class TrayIconManager(QtCore.QObject):
     
     def exit_application(self):
         """Exit application gracefully"""
-        global end
-        end = True
-        
         # Закрываем все окна
         app = QtWidgets.QApplication.instance()
         for window in app.topLevelWidgets():
             window.close()
         
-        # Показываем сообщение
-        self.tray_icon.showMessage(
-            "Klipper Desk",
-            "Приложение завершает работу...",
-            QSystemTrayIcon.Information,
-            1000
-        )
-        
-        # Завершаем приложение
-        QtCore.QTimer.singleShot(1200, app.quit)
+        # Соединения закрываются параллельно в KlipperApp.shutdown за ограниченное время, ждать не нужно
+        app.quit()
+
+
+# ---------------------------
+# Refresh Scheduler
+# ---------------------------
+class RefreshScheduler(QtCore.QObject):
+    """Wakes the UI pump only when printers have pending changes.
+    
+    Each printer is flushed at most once per its interval: `fast_ms` while it
+    is heating or printing, `idle_ms` otherwise. While all windows are hidden
+    the pump runs every `hidden_ms`, or not at all if that is 0.
+    """
+    
+    def __init__(self, flush: Callable[[set], None], is_fast: Callable[[str], bool],
+                 fast_ms: int = 100, idle_ms: int = 1000, hidden_ms: int = 0, parent=None):
+        super().__init__(parent)
+        self._flush = flush
+        self._is_fast = is_fast
+        self.fast_ms = fast_ms
+        self.idle_ms = idle_ms
+        self.hidden_ms = hidden_ms
+        self.visible = True
+        self._pending = set()
+        self._last_flush = {}  # ip -> monotonic time of the last flush
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._on_timeout)
+    
+    def interval_ms(self, ip: str) -> int:
+        if not self.visible:
+            return self.hidden_ms
+        return self.fast_ms if self._is_fast(ip) else self.idle_ms
+    
+    def notify(self, ip: str):
+        """A printer has new data in the status store"""
+        self._pending.add(ip)
+        self._schedule()
+    
+    def set_visible(self, visible: bool):
+        if visible == self.visible:
+            return
+        self.visible = visible
+        self._timer.stop()
+        self._schedule()
+    
+    def stop(self):
+        self._timer.stop()
+        self._pending.clear()
+        self._last_flush.clear()
+    
+    def _schedule(self):
+        if not self._pending or (not self.visible and self.hidden_ms <= 0):
+            return
+        now = time.monotonic()
+        due = min(self._last_flush.get(ip, 0.0) + self.interval_ms(ip) / 1000.0 for ip in self._pending)
+        delay = max(0, int((due - now) * 1000))
+        # Only move an already running timer earlier, never later
+        if self._timer.isActive() and self._timer.remainingTime() <= delay:
+            return
+        self._timer.start(delay)
+    
+    def _on_timeout(self):
+        now = time.monotonic()
+        ready = {ip for ip in self._pending
+                 if now >= self._last_flush.get(ip, 0.0) + self.interval_ms(ip) / 1000.0 - 0.01}
+        self._pending -= ready
+        for ip in ready:
+            self._last_flush[ip] = now
+        if ready:
+            self._flush(ready)
+        self._schedule()
+
+
+# ---------------------------
+# Debug HUD
+# ---------------------------
+class DebugHud(QtWidgets.QWidget):
+    """Overlay with per-stage timings of the data path: network -> pump -> paint.
+    
+    Exists only while enabled from the tray; every probe in the pipeline is
+    guarded by `if hud is not None`, so a disabled HUD costs one attribute check.
+    """
+    REFRESH_MS = 1000
+    HEARTBEAT_MS = 50
+    
+    def __init__(self, app: "KlipperApp"):
+        super().__init__()
+        self.app = app
+        self._arrivals = {}  # ip -> monotonic receipt of the oldest frame not yet applied by the pump
+        self._unpainted = {}  # ip -> receipt of the oldest frame whose visible change is not painted yet
+        self._latency = {}   # ip -> [sum, max, count] of frame-to-paint latencies, seconds
+        self._parse = {}     # ip -> [sum, count] of parse_klipper_status durations
+        self._paint = [0.0, 0.0, 0]  # sum, max, count of window repaints
+        self._busy = 0.0     # seconds spent in the pump and in repaints
+        self._lag = 0.0      # worst heartbeat delay, seconds
+        self._received = {}  # ip -> frame counter at the previous refresh
+        self._last_refresh = time.monotonic()
+        self._last_beat = self._last_refresh
+        
+        self.setWindowTitle("KlipperDesk HUD")
+        self.setWindowFlags(QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint | QtCore.Qt.Tool)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setAttribute(QtCore.Qt.WA_ShowWithoutActivating)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 200); color: #9f9; padding: 6px;")
+        self.label = QtWidgets.QLabel(self)
+        self.label.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.label)
+        
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.timeout.connect(self.refresh)
+        self._refresh_timer.start(self.REFRESH_MS)
+        # Heartbeat: how late the GUI thread gets to a timer shows how blocked it is
+        self._heartbeat = QtCore.QTimer(self)
+        self._heartbeat.setTimerType(QtCore.Qt.PreciseTimer)
+        self._heartbeat.timeout.connect(self._beat)
+        self._heartbeat.start(self.HEARTBEAT_MS)
+        self.refresh()
+    
+    def record_arrival(self, ip: str, received_at: float):
+        """New data for a printer reached the store; `received_at` is its socket receipt time"""
+        self._arrivals.setdefault(ip, received_at)
+    
+    def record_applied(self, ip: str, changed: bool):
+        """The pump applied a printer's data; only a visible change waits for a paint"""
+        received_at = self._arrivals.pop(ip, None)
+        if received_at is not None and changed:
+            self._unpainted.setdefault(ip, received_at)
+    
+    def record_parse(self, ip: str, seconds: float):
+        entry = self._parse.setdefault(ip, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    
+    def record_pump(self, seconds: float):
+        self._busy += seconds
+    
+    def record_paint(self, ips: List[str], seconds: float):
+        """A window finished repainting; `ips` are the printers whose area it redrew"""
+        self._busy += seconds
+        self._paint[0] += seconds
+        self._paint[1] = max(self._paint[1], seconds)
+        self._paint[2] += 1
+        now = time.monotonic()
+        for ip in ips:
+            received_at = self._unpainted.pop(ip, None)
+            if received_at is None:
+                continue  # hover, animation or another printer's change: nothing new shown
+            latency = now - received_at
+            entry = self._latency.setdefault(ip, [0.0, 0.0, 0])
+            entry[0] += latency
+            entry[1] = max(entry[1], latency)
+            entry[2] += 1
+    
+    def _beat(self):
+        now = time.monotonic()
+        self._lag = max(self._lag, now - self._last_beat - self.HEARTBEAT_MS / 1000.0)
+        self._last_beat = now
+    
+    def refresh(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_refresh, 1e-6)
+        self._last_refresh = now
+        engine = self.app.ws_manager.engine
+        
+        lines = [f"{'printer':<14}{'msg/s':>7}{'e2e avg/max ms':>16}{'parse us':>10}{'tick ms':>9}"]
+        for ip, printer_data in list(self.app.printers_data.items()):
+            counters = engine.counters.get(ip)
+            received = counters.received if counters is not None else 0
+            rate = (received - self._received.get(ip, received)) / elapsed
+            self._received[ip] = received
+            lat_sum, lat_max, lat_count = self._latency.pop(ip, (0.0, 0.0, 0))
+            parse_sum, parse_count = self._parse.pop(ip, (0.0, 0))
+            e2e = f"{lat_sum / lat_count * 1000:.0f}/{lat_max * 1000:.0f}" if lat_count else "-"
+            parse = f"{parse_sum / parse_count * 1e6:.0f}" if parse_count else "-"
+            tick = self.app.refresh_scheduler.interval_ms(ip)
+            lines.append(f"{printer_data.name[:13]:<14}{rate:>7.1f}{e2e:>16}{parse:>10}{tick:>9}")
+        
+        paint_sum, paint_max, paint_count = self._paint
+        paint = f"{paint_sum / paint_count * 1000:.2f}/{paint_max * 1000:.2f} ms" if paint_count else "-"
+        lines.append(f"paint avg/max {paint}, {paint_count / elapsed:.1f}/s")
+        lines.append(f"GUI busy {self._busy / elapsed * 100:.1f}%, max loop lag {max(self._lag, 0.0) * 1000:.0f} ms")
+        self._paint = [0.0, 0.0, 0]
+        self._busy = 0.0
+        self._lag = 0.0
+        
+        self.label.setText("\n".join(lines))
+        self.adjustSize()
+        screen = QtWidgets.QApplication.primaryScreen()
+        if screen is not None:
+            area = screen.availableGeometry()
+            self.move(area.right() - self.width() - 10, area.top() + 10)
+
 
 # ---------------------------
 # Main Application
 # ---------------------------
 class KlipperApp(QtCore.QObject):
     """Main application controller"""
-    def __init__(self, config_file: str = CONFIG_FILE):
+    def __init__(self, config_file: str = CONFIG_FILE, record_path: Optional[str] = None,
+                 replay_path: Optional[str] = None, replay_speed: float = 1.0):
         super().__init__()
         self.config = Config(config_file)
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
         self.printers_data = {}  # ip -> PrinterData
-        self.ws_manager = WebSocketManager()
+        # ip -> name for the metrics thread; replaced, never mutated, so a scrape reads a stable dict
+        self._printer_names = {}
+        self.ws_manager = WebSocketManager(ReconnectPolicy.from_config(self.config))
+        self.ws_manager.watch_network()
+        self.thumbnail_service = ThumbnailService.instance(self.config)
         self.widgets = []
-        self.tray_manager = None  # Добавьте этот атрибут
         
-        # Очередь для накопления данных
-        self._data_queue = {}
-        self._update_timer = QtCore.QTimer()
-        self._update_timer.setInterval(500)
-        self._update_timer.timeout.connect(self._process_data_queue)
+        # Хранилище состояния принтеров (слияние дельт Moonraker)
+        self.status_store = StatusStore()
+        self._seen_versions = {}  # ip -> last store version applied to PrinterData
+        self.parse_latency = LatencyHistogram()  # parse_klipper_status in the pump, GUI thread
+        self.metrics_server = None
+        self.debug_hud = None
+        
+        # Журнал телеметрии пишет сетевой поток, так что скрытым окнам насос не нужен
+        self.refresh_scheduler = RefreshScheduler(
+            self._process_data_queue, self._needs_fast_refresh,
+            fast_ms=self.config.config.get("refresh_fast_ms", 100),
+            idle_ms=self.config.config.get("refresh_idle_ms", 1000),
+            hidden_ms=self.config.config.get("refresh_hidden_ms", 0),
+            parent=self
+        )
         
         # Connect WebSocket manager signals
-        self.ws_manager.data_received.connect(self.handle_websocket_data)
+        self.ws_manager.mail_ready.connect(self.handle_printer_mail)
+        
+        # Инициализируем tray icon (один раз на всё время работы)
+        self.tray_manager = TrayIconManager(self)
     
     def initialize(self):
         """Initialize application based on config"""
-        # Инициализируем tray icon
-        self.tray_manager = TrayIconManager(self)
-        
         # Show settings on first run
-        if self.config.config.get("first_run", True):
+        if self.config.config.get("first_run", True) and not self.replay_path:
             dialog = SettingsDialog(self.config)
             if dialog.exec_() != QtWidgets.QDialog.Accepted:
                 return False
@@ -1586,11 +2733,19 @@ class KlipperApp(QtCore.QObject):
             self.config.save_config()
         
         # Get enabled printers
-        enabled_printers = self.config.get_enabled_printers()
+        try:
+            enabled_printers = self.enabled_printers()
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.warning(None, "Ошибка", f"Не удалось открыть запись: {e}")
+            return False
         if not enabled_printers:
             QtWidgets.QMessageBox.warning(None, "Ошибка", "Нет включенных принтеров!")
             return False
         
+        # Журнал телеметрии на диске пишется при приёме каждой дельты (только по желанию пользователя)
+        if not self.replay_path:
+            self._open_telemetry_log()
+        
         # Initialize printer data and start WebSocket connections
         for printer in enabled_printers:
             name = printer.get("name", "Unknown")
@@ -1598,16 +2753,31 @@ class KlipperApp(QtCore.QObject):
             ind = printer.get("index")
             if ip:
                 self.printers_data[ip] = PrinterData(name, ip)
-                self.ws_manager.start_printer(printer)
+                self.printers_data[ip].data_updated.connect(self.on_printer_data_updated)
+                if not self.replay_path:
+                    self.ws_manager.start_printer(printer)
+        self._printer_names = {ip: printer_data.name for ip, printer_data in self.printers_data.items()}
         
-        # Start update timer
-        self._update_timer.start()
+        engine = self.ws_manager.engine
+        if self.replay_path:
+            # Записанный поток идёт через тот же путь, что и живые соединения
+            engine.start_replay(self.replay_path, self.replay_speed)
+        elif self.record_path and engine.recorder is None:
+            engine.start_recording(self.record_path, enabled_printers)
+        
+        self.start_metrics_server()
         
         return True
     
+    def enabled_printers(self) -> List[Dict]:
+        """Printers from the config, or the ones stored in the capture being replayed"""
+        if self.replay_path:
+            return read_capture_header(self.replay_path)["printers"]
+        return self.config.get_enabled_printers()
+    
     def create_widgets(self):
         """Create widgets based on mode"""
-        enabled_printers = self.config.get_enabled_printers()
+        enabled_printers = self.enabled_printers()
         printer_data_list = [self.printers_data.get(p["ip"]) for p in enabled_printers if p["ip"] in self.printers_data]
         
         if not printer_data_list:
@@ -1621,6 +2791,8 @@ class KlipperApp(QtCore.QObject):
             for printer_data in printer_data_list:
                 widget = SinglePrinterWidget(printer_data, self.config, self.open_settings)
                 widget.move(x, y)
+                widget.debug_hud = self.debug_hud
+                widget.installEventFilter(self)
                 widget.show()
                 self.widgets.append(widget)
                 y += widget.height() + 20  # Stagger windows with gap
@@ -1628,34 +2800,100 @@ class KlipperApp(QtCore.QObject):
             # Create single widget with all printers
             widget = MultiPrinterWidget(printer_data_list, self.config, self.open_settings)
             widget.move(80, 80)
+            widget.debug_hud = self.debug_hud
+            widget.installEventFilter(self)
             widget.show()
             self.widgets.append(widget)
         
+        self._update_visibility()
         return True
     
-    @QtCore.pyqtSlot(dict)
-    def handle_websocket_data(self, msg: Dict):
-        """Handle incoming WebSocket data (called from any thread)"""
-        if msg.get("type") == "ws_message":
-            printer_ip = msg.get("printer_ip")
-            if printer_ip not in self.printers_data:
-                return
-            
-            parsed = parse_moonraker_message(msg.get("raw"))
+    @QtCore.pyqtSlot(str)
+    def handle_printer_mail(self, printer_ip: str):
+        """Move a printer's merged deltas into the store (queued into the main thread)"""
+        if printer_ip not in self.printers_data:
+            return
+        status, received_at = self.ws_manager.take_mail_stamped(printer_ip)
+        if status and self.status_store.apply(printer_ip, status):
+            # Сливаем дельту в хранилище вместо немедленного обновления
+            self.refresh_scheduler.notify(printer_ip)
+            if self.debug_hud is not None:
+                self.debug_hud.record_arrival(printer_ip, received_at)
+    
+    def _needs_fast_refresh(self, ip: str) -> bool:
+        """Heating or printing printers refresh at the fast rate"""
+        printer_data = self.printers_data.get(ip)
+        if printer_data is None:
+            return False
+        if printer_data.status == "printing":
+            return True
+        for actual, target in (printer_data.hotend_temp, printer_data.bed_temp):
+            if target and actual is not None and abs(target - actual) > 2.0:
+                return True
+        return False
+    
+    def eventFilter(self, obj, event):
+        if event.type() in (QtCore.QEvent.Show, QtCore.QEvent.Hide, QtCore.QEvent.WindowStateChange):
+            # Re-evaluate after the event has been processed by the widget
+            QtCore.QTimer.singleShot(0, self._update_visibility)
+        return False
+    
+    def _update_visibility(self):
+        """Adjust the refresh rate and Moonraker subscriptions to what is on screen"""
+        shown = set()
+        for w in self.widgets:
+            if w.isVisible() and not w.isMinimized():
+                if isinstance(w, MultiPrinterWidget):
+                    shown.update(pd.ip for pd in w.printers_data)
+                else:
+                    shown.add(w.printer_data.ip)
+        self.refresh_scheduler.set_visible(bool(shown))
+        
+        # Скрытые принтеры получают только состояние; температуры — лишь если пользователь включил журнал
+        hidden = MINIMAL_SUBSCRIPTION if self.ws_manager.engine.telemetry_log is None else TELEMETRY_SUBSCRIPTION
+        for ip in self.printers_data:
+            self.ws_manager.set_subscription(ip, FULL_SUBSCRIPTION if ip in shown else hidden)
+    
+    def _process_data_queue(self, dirty: set):
+        """Apply store changes since the last flush to PrinterData (called in main thread)
+        
+        `dirty` is a set the scheduler has already swapped out, so ingest may keep
+        adding to the next one. Nothing here runs the event loop: widgets only
+        mark dirty regions, and Qt paints them once after this slot returns.
+        """
+        hud = self.debug_hud
+        pump_started = time.perf_counter()
+        
+        # Snapshot: read everything changed in the store before touching any widget
+        updates = []
+        for ip in dirty:
+            printer_data = self.printers_data.get(ip)
+            if printer_data is None:
+                continue
+            # Only objects touched since the last flush, with their full merged state
+            version, objects = self.status_store.changed_objects_since(ip, self._seen_versions.get(ip, 0))
+            self._seen_versions[ip] = version
+            if not objects:
+                continue
+            started = time.perf_counter()
+            parsed = parse_klipper_status(objects)
+            parse_time = time.perf_counter() - started
+            self.parse_latency.observe(parse_time)
+            if hud is not None:
+                hud.record_parse(ip, parse_time)
             if parsed:
-                # Сохраняем данные в очередь вместо немедленного обновления
-                self._data_queue[printer_ip] = parsed
-    
-    @QtCore.pyqtSlot()
-    def _process_data_queue(self):
-        """Process queued data from WebSocket (called in main thread)"""
-        for ip, parsed in self._data_queue.items():
-            if ip in self.printers_data:
-                self.printers_data[ip].update_from_parsed(parsed)
-        self._data_queue.clear()
+                updates.append((ip, printer_data, parsed))
+        
+        # Apply: one data_updated per printer, repaint is deferred to the event loop
+        changed = set()
+        for ip, printer_data, parsed in updates:
+            if printer_data.update_from_parsed(parsed):
+                changed.add(ip)
         
-        # Принудительно обрабатываем события очереди для более плавного обновления
-        QtWidgets.QApplication.processEvents()
+        if hud is not None:
+            for ip in dirty:
+                hud.record_applied(ip, ip in changed)
+            hud.record_pump(time.perf_counter() - pump_started)
     
     def open_settings(self):
         """Open settings dialog and restart application if needed"""
@@ -1671,13 +2909,18 @@ class KlipperApp(QtCore.QObject):
             
             # Stop all WebSocket connections
             self.ws_manager.stop_all()
-            self._update_timer.stop()
+            self.refresh_scheduler.stop()
             
             # Clear old data
+            self._printer_names = {}
             self.printers_data.clear()
-            self._data_queue.clear()
+            self.status_store.clear()
+            self._seen_versions.clear()
             self.widgets.clear()
             
+            # Кэш превью и HTTP-клиент создаются из конфигурации: применяем новые значения
+            self.thumbnail_service.reconfigure(self.config)
+            
             # Reinitialize
             if self.initialize():
                 self.create_widgets()
@@ -1688,26 +2931,75 @@ class KlipperApp(QtCore.QObject):
                 widget.raise_()
                 widget.activateWindow()
     
+    @QtCore.pyqtSlot(object, int)
+    def on_printer_data_updated(self, printer_data, changed):
+        """Fetch the slicer time estimate whenever a new file starts"""
+        if changed & PrinterField.FILENAME and printer_data.filename:
+            filename = printer_data.filename
+            
+            def on_metadata(metadata: Dict):
+                printer_data.set_slicer_estimate(filename, metadata.get('estimated_time'))
+            
+            self.thumbnail_service.request_metadata(printer_data.ip, filename, on_metadata)
+    
+    def _open_telemetry_log(self):
+        """(Re)open the telemetry log from the config and hand it to the connection engine"""
+        engine = self.ws_manager.engine
+        old, engine.telemetry_log = engine.telemetry_log, TelemetryLog.from_config(self.config)
+        if old is not None:
+            old.close()
+    
+    def set_debug_hud(self, enabled: bool):
+        """Show or remove the debug overlay; probes are inactive while it is off"""
+        if enabled and self.debug_hud is None:
+            self.debug_hud = DebugHud(self)
+            self.debug_hud.show()
+        elif not enabled and self.debug_hud is not None:
+            self.debug_hud.close()
+            self.debug_hud.deleteLater()
+            self.debug_hud = None
+        for widget in self.widgets:
+            widget.debug_hud = self.debug_hud
+    
+    def start_metrics_server(self):
+        """Optional Prometheus endpoint (metrics_port > 0), served from its own thread"""
+        port = self.config.config.get("metrics_port", 0)
+        if not port or self.metrics_server is not None:
+            return
+        host = self.config.config.get("metrics_host", "127.0.0.1")
+        try:
+            self.metrics_server = serve_metrics(self.metrics_text, host, port)
+            print(f"[Metrics] http://{host}:{port}/metrics")
+        except OSError as e:
+            print(f"[Metrics] Не удалось открыть порт {port}: {e}")
+    
+    def metrics_text(self) -> str:
+        """Runs in the metrics thread: touches only the store and counters, never widgets"""
+        return render_metrics(self.ws_manager.engine, self.status_store, self._printer_names,
+                              self.parse_latency, self.thumbnail_service.metrics_lines())
+    
     def shutdown(self):
         """Shutdown application"""
-        self._update_timer.stop()
-        self.ws_manager.stop_all()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        self.refresh_scheduler.stop()
+        self.ws_manager.shutdown()
+        self.thumbnail_service.shutdown()
 
 
 # ---------------------------
 # Main runner
 # ---------------------------
 def main():
-    import argparse
-    parser = argparse.ArgumentParser(description="Floating Klipper gadget")
-    parser.add_argument("--config", default=CONFIG_FILE, help="Config file path")
-    args = parser.parse_args()
+    args = build_arg_parser().parse_args()
     
     app = QtWidgets.QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)  # Добавьте эту строку!
     
     # Create and initialize application
-    klipper_app = KlipperApp(args.config)
+    klipper_app = KlipperApp(args.config, record_path=args.record,
+                             replay_path=args.replay, replay_speed=args.replay_speed)
     if not klipper_app.initialize():
         sys.exit(1)
     
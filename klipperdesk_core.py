@@ -0,0 +1,1552 @@
+"""Qt-free monitoring core of KlipperDesk.
+
+Configuration, the Moonraker connection engine, message parsing and the
+status store live here so they can run without PyQt, both under the
+desktop widgets and in the headless daemon (`KlipperDesk.py --headless`).
+"""
+import argparse
+import asyncio
+import bisect
+import gzip
+import json
+import mmap
+import os
+import random
+import re
+import signal
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Callable, Tuple
+
+# Defaults
+CONFIG_FILE = "KDconfig.json"
+
+# Objects Moonraker streams for a printer shown in a widget
+FULL_SUBSCRIPTION = {
+    "extruder": ["temperature", "target"],
+    "heater_bed": ["temperature", "target"],
+    "print_stats": ["state", "filename", "print_duration", "total_duration"],
+    "virtual_sdcard": ["progress", "file_position", "file_size"],
+}
+# Hidden printer whose telemetry is still logged to disk (only when the user enabled the log)
+TELEMETRY_SUBSCRIPTION = {
+    "extruder": ["temperature", "target"],
+    "heater_bed": ["temperature", "target"],
+    "print_stats": ["state"],
+    "virtual_sdcard": ["progress"],
+}
+# Hidden printer by default, nothing but its state (tray-only mode)
+MINIMAL_SUBSCRIPTION = {
+    "print_stats": ["state"],
+}
+
+
+def subscribe_payload(objects: Dict[str, List[str]]) -> Dict:
+    """JSON-RPC request replacing the connection's subscription with `objects`"""
+    return {
+        "jsonrpc": "2.0",
+        "method": "printer.objects.subscribe",
+        "params": {"objects": objects},
+        "id": 42
+    }
+
+
+# Default subscribe payload for Moonraker
+DEFAULT_SUBSCRIBE_PAYLOAD = subscribe_payload(FULL_SUBSCRIPTION)
+
+
+# ---------------------------
+# Configuration Management
+# ---------------------------
+def user_data_dir() -> str:
+    """Per-user directory for data the app writes on its own (not the working directory)"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(base, "KlipperDesk")
+
+
+class Config:
+    def __init__(self, filename=CONFIG_FILE):
+        self.filename = filename
+        self.default_config = {
+            "printers": [
+                {"name": "Printer 1", "ip": "", "enabled": False},
+                {"name": "Printer 2", "ip": "", "enabled": False},
+                {"name": "Printer 3", "ip": "", "enabled": False},
+                {"name": "Printer 4", "ip": "", "enabled": False},
+                {"name": "Printer 5", "ip": "", "enabled": False},
+                {"name": "Printer 6", "ip": "", "enabled": False},
+                {"name": "Printer 7", "ip": "", "enabled": False},
+                {"name": "Printer 8", "ip": "", "enabled": False},
+                {"name": "Printer 9", "ip": "", "enabled": False},
+                {"name": "Printer 10", "ip": "", "enabled": False}
+            ],
+            "multiple_widgets": True,
+            "widget_opacity": 0.88,
+            "widget_width": 360,
+            "widget_height": 150,
+            "show_graphs": False,
+            "telemetry_log_enabled": False,
+            "telemetry_log_dir": "",  # empty: <user data dir>/telemetry
+            "telemetry_log_rotate_mb": 8,
+            "telemetry_log_keep_files": 14,
+            "refresh_fast_ms": 100,
+            "refresh_idle_ms": 1000,
+            "refresh_hidden_ms": 0,
+            "thumbnail_cache_dir": "KDthumbnails",
+            "thumbnail_cache_mb": 64,
+            "http_timeout": 5.0,
+            "http_connect_timeout": 3.0,
+            "http_connections_per_host": 2,
+            "headless_host": "127.0.0.1",
+            "headless_port": 7130,
+            "metrics_host": "127.0.0.1",
+            "metrics_port": 0,
+            "reconnect_min_s": 0.5,
+            "reconnect_max_s": 20.0,
+            "ws_open_timeout": 5.0,
+            "ws_ping_interval": 10.0,
+            "ws_ping_timeout": 10.0,
+            "first_run": True
+        }
+        self.config = self.load_config()
+    
+    def load_config(self):
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                    for key, value in self.default_config.items():
+                        if key not in config:
+                            config[key] = value
+                    return config
+            except Exception as e:
+                print(f"Error loading config: {e}")
+                return self.default_config.copy()
+        return self.default_config.copy()
+    
+    def save_config(self):
+        try:
+            with open(self.filename, 'w', encoding='utf-8') as f:
+                json.dump(self.config, f, indent=2, ensure_ascii=False)
+            return True
+        except Exception as e:
+            print(f"Error saving config: {e}")
+            return False
+    
+    def get_enabled_printers(self) -> List[Dict]:
+        return [p for p in self.config.get("printers", []) if p.get("enabled", False)]
+    
+    def update_printer(self, index: int, name: str, ip: str, enabled: bool):
+        printers = self.config.get("printers", [])
+        if index < len(printers):
+            printers[index]["name"] = name
+            printers[index]["ip"] = ip
+            printers[index]["enabled"] = enabled
+    
+    def set_widget_size(self, width: int, height: int):
+        self.config["widget_width"] = width
+        self.config["widget_height"] = height
+    
+    def set_widget_opacity(self, opacity: float):
+        self.config["widget_opacity"] = opacity
+    
+    def set_multiple_widgets(self, enabled: bool):
+        self.config["multiple_widgets"] = enabled
+    
+    def mark_first_run_complete(self):
+        self.config["first_run"] = False
+
+
+# ---------------------------
+# Message Filter
+# ---------------------------
+class MessageFilter:
+    """Decides from the raw frame text whether a Moonraker message is worth decoding.
+    
+    Notifications are sniffed by method name in the first bytes of the frame
+    (Moonraker writes "method" before "params"); only registered methods are
+    decoded. Frames without a method are RPC responses and always decoded.
+    """
+    _METHOD_RE = re.compile(r'"method"\s*:\s*"([^"]+)"')
+    _SNIFF_BYTES = 128
+    
+    def __init__(self, methods=("notify_status_update",)):
+        self._lock = threading.Lock()
+        self._methods = set(methods)
+        self.decoded = {}  # method -> frames decoded ("" for responses)
+        self.skipped = {}  # method -> frames skipped without decoding
+    
+    def register(self, method: str):
+        with self._lock:
+            self._methods.add(method)
+    
+    def unregister(self, method: str):
+        with self._lock:
+            self._methods.discard(method)
+    
+    @classmethod
+    def sniff_method(cls, raw) -> str:
+        """Top-level method of a frame, or "" if it has none"""
+        head = raw[:cls._SNIFF_BYTES]
+        if isinstance(head, bytes):
+            head = head.decode("utf-8", "replace")
+        match = cls._METHOD_RE.search(head)
+        return match.group(1) if match else ""
+    
+    def accept(self, raw) -> bool:
+        method = self.sniff_method(raw)
+        with self._lock:
+            wanted = not method or method in self._methods
+            counters = self.decoded if wanted else self.skipped
+            counters[method] = counters.get(method, 0) + 1
+        return wanted
+    
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {"decoded": dict(self.decoded), "skipped": dict(self.skipped)}
+
+
+# ---------------------------
+# Printer Mailbox
+# ---------------------------
+class PrinterMailbox:
+    """Bounded hand-off of status deltas from the network thread to the GUI.
+    
+    Deltas are deep-merged while they wait, so a stalled GUI costs at most
+    `max_fields` pending fields per printer instead of a queue of frames.
+    `put` returns True only when the mailbox was empty, so the GUI is
+    notified once per batch.
+    """
+    
+    def __init__(self, max_fields: int = 512):
+        self.max_fields = max_fields
+        self._lock = threading.Lock()
+        self._pending = {}  # object -> {field: value}
+        self._fields = 0
+        self.frames = 0     # deltas put into the mailbox
+        self.coalesced = 0  # deltas merged into mail the GUI had not taken yet
+        self.dropped = 0    # deltas (partly) discarded because the mailbox was full
+        self.batches = 0    # notifications sent to the GUI
+        self.oldest = 0.0   # monotonic receipt time of the first frame in the pending mail
+    
+    def put(self, delta: Dict, received_at: Optional[float] = None) -> bool:
+        """Merge a delta; `received_at` is the monotonic time its frame came off the socket"""
+        with self._lock:
+            self.frames += 1
+            was_empty = not self._pending
+            if not was_empty:
+                self.coalesced += 1
+            overflow = False
+            for obj, fields in delta.items():
+                if not isinstance(fields, dict):
+                    continue
+                pending = self._pending.get(obj)
+                for field, value in fields.items():
+                    if pending is not None and field in pending:
+                        pending[field] = value
+                    elif self._fields < self.max_fields:
+                        if pending is None:
+                            pending = self._pending[obj] = {}
+                        pending[field] = value
+                        self._fields += 1
+                    else:
+                        overflow = True
+            if overflow:
+                self.dropped += 1
+            if was_empty and self._pending:
+                self.batches += 1
+                self.oldest = time.monotonic() if received_at is None else received_at
+                return True
+            return False
+    
+    def take(self) -> Optional[Dict]:
+        """Return the merged delta and empty the mailbox"""
+        return self.take_stamped()[0]
+    
+    def take_stamped(self) -> Tuple[Optional[Dict], float]:
+        """Like take, plus the monotonic receipt time of the oldest frame in it"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._fields = 0
+            return pending or None, self.oldest
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"frames": self.frames, "coalesced": self.coalesced,
+                    "dropped": self.dropped, "batches": self.batches,
+                    "pending_fields": self._fields}
+
+
+# ---------------------------
+# Stream Capture
+# ---------------------------
+CAPTURE_FORMAT = "klipperdesk-capture"
+
+
+class CaptureWriter:
+    """Writes raw Moonraker frames with their receive time to a gzip JSON-lines file.
+    
+    The first line is a header listing the printers; every further line is
+    {"t": wall clock receive time, "ip": printer, "raw": frame text}.
+    The stream is sync-flushed every `FLUSH_FRAMES` frames and on `flush()`,
+    so a killed process leaves a readable (truncated) capture behind.
+    """
+    FLUSH_FRAMES = 100
+    FLUSH_INTERVAL = 1.0  # seconds between flushes driven by ConnectionEngine
+    
+    def __init__(self, path: str, printers: List[Dict]):
+        self.path = path
+        self.frames = 0
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wb", compresslevel=6)
+        header = {"format": CAPTURE_FORMAT, "version": 1, "started": time.time(),
+                  "printers": [{"name": p.get("name", "Unknown"), "ip": p.get("ip", "")} for p in printers]}
+        self._file.write((json.dumps(header, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+    
+    def write(self, ip: str, received_at: float, raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", "replace")
+        line = json.dumps({"t": received_at, "ip": ip, "raw": raw}, ensure_ascii=False)
+        with self._lock:
+            if self._file is not None:
+                self._file.write((line + "\n").encode("utf-8"))
+                self.frames += 1
+                self._unflushed += 1
+                if self._unflushed >= self.FLUSH_FRAMES:
+                    self._sync()
+    
+    def flush(self):
+        """Push everything written so far to disk as a complete deflate block"""
+        with self._lock:
+            if self._file is not None and self._unflushed:
+                self._sync()
+    
+    def _sync(self):
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+        self._unflushed = 0
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_capture_header(path: str) -> Dict:
+    """Header of a capture; ValueError if the file is not a (complete enough) capture"""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            line = f.readline()
+    except EOFError:
+        line = ""
+    except gzip.BadGzipFile:
+        raise ValueError(f"{path} is not a KlipperDesk capture")
+    if not line.endswith("\n"):
+        raise ValueError(f"{path}: capture is empty or truncated, no header")
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != CAPTURE_FORMAT:
+        raise ValueError(f"{path} is not a KlipperDesk capture")
+    return header
+
+
+def iter_capture(path: str):
+    """Yield (receive time, ip, raw frame) for every frame of a capture.
+    
+    A capture cut off by a crash ends after its last complete line.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        f.readline()  # header
+        while True:
+            try:
+                line = f.readline()
+            except EOFError:
+                line = ""
+                truncated = True
+            else:
+                truncated = bool(line) and not line.endswith("\n")
+            if truncated:
+                print(f"[Capture] {path} is truncated, stopping at the last complete frame")
+                return
+            if not line:
+                return
+            if line.strip():
+                frame = json.loads(line)
+                yield frame["t"], frame["ip"], frame["raw"]
+
+
+# ---------------------------
+# Connection Engine
+# ---------------------------
+class SessionCounters:
+    """Per-printer connection counters, written only by the network thread"""
+    
+    def __init__(self):
+        self.attempts = 0       # connection attempts, the first one included
+        self.connects = 0       # successful connections
+        self.received = 0       # frames received
+        self.decoded = 0        # frames passed through json.loads
+        self.skipped = 0        # frames dropped by the message filter
+        self.decode_errors = 0  # frames that were not valid JSON
+        self.backoff = 0.0      # seconds the session is waiting before reconnecting
+    
+    @property
+    def reconnects(self) -> int:
+        return max(self.attempts - 1, 0)
+
+
+class ReconnectPolicy:
+    """Timeouts and backoff for printer connections.
+    
+    Delays use decorrelated jitter (random between `min_delay` and three times
+    the previous delay, capped at `max_delay`), so clients that lost their
+    printers at the same moment do not reconnect in lockstep.
+    """
+    
+    def __init__(self, min_delay: float = 0.5, max_delay: float = 20.0, open_timeout: float = 5.0,
+                 ping_interval: float = 10.0, ping_timeout: float = 10.0, close_timeout: float = 2.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.open_timeout = open_timeout
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.close_timeout = close_timeout
+    
+    @classmethod
+    def from_config(cls, config: Config) -> "ReconnectPolicy":
+        return cls(min_delay=config.config.get("reconnect_min_s", 0.5),
+                   max_delay=config.config.get("reconnect_max_s", 20.0),
+                   open_timeout=config.config.get("ws_open_timeout", 5.0),
+                   ping_interval=config.config.get("ws_ping_interval", 10.0),
+                   ping_timeout=config.config.get("ws_ping_timeout", 10.0))
+    
+    def next_delay(self, previous: float) -> float:
+        """Delay before the next attempt; `previous` is 0 for the first retry after a drop"""
+        # Seeding with min_delay jitters the first retry too: [min, 3*min] instead of exactly min
+        return min(self.max_delay, random.uniform(self.min_delay, max(self.min_delay, previous) * 3))
+
+
+class ConnectionEngine:
+    """Multiplexes all printer WebSocket connections on one shared event loop.
+    
+    `on_mail(ip)` is called from the network thread once per batch of merged
+    deltas; the receiver collects them with `take_mail(ip)`.
+    """
+    
+    def __init__(self, on_mail: Callable[[str], None], policy: Optional[ReconnectPolicy] = None):
+        self.on_mail = on_mail
+        self.policy = policy or ReconnectPolicy()
+        self.counters = {}  # ip -> SessionCounters
+        self.decode_latency = LatencyHistogram()  # json.loads + extract_status, network thread
+        self.recorder = None  # CaptureWriter receiving every raw frame, if recording
+        self.telemetry_log = None  # TelemetryLog receiving every parsed delta, if enabled
+        self.replay = None  # concurrent.futures.Future of a running capture replay
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self.sessions = {}  # ip -> concurrent.futures.Future of the printer task
+        self._subscriptions = {}  # ip -> objects dict sent on (re)connect
+        self.mailboxes = {}  # ip -> PrinterMailbox
+        self.message_filter = MessageFilter()  # shared by all sessions
+        self._sockets = {}  # ip -> (open websocket, objects it is subscribed to), loop thread only
+        self._wakeups = {}  # ip -> asyncio.Event that cuts a backoff wait short, loop thread only
+        self._probes = set()  # running _probe tasks; the loop keeps only weak references
+    
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the shared background event loop on first use"""
+        with self._loop_lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._run_loop,
+                    args=(self._loop,),
+                    name="KlipperDesk-ws-loop",
+                    daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+    
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        """Body of the single network thread"""
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+    
+    def start_printer(self, printer_info: Dict):
+        """Start WebSocket connection for a printer"""
+        ip = printer_info.get("ip", "")
+        if not ip or ip in self.sessions:
+            return
+        
+        ws_url = f"ws://{ip}/websocket"
+        printer_name = printer_info.get("name", "Unknown")
+        
+        # Schedule the printer session as a task on the shared loop
+        mailbox = self.mailboxes[ip] = PrinterMailbox()
+        counters = self.counters[ip] = SessionCounters()
+        loop = self._ensure_loop()
+        self.sessions[ip] = asyncio.run_coroutine_threadsafe(
+            self._consume(ws_url, printer_name, ip, mailbox, counters), loop
+        )
+        print(f"[ConnectionEngine] Started connection for {printer_name} ({ip})")
+    
+    async def _consume(self, ws_url: str, printer_name: str, printer_ip: str,
+                       mailbox: PrinterMailbox, counters: SessionCounters):
+        """Connection session for one printer, runs as a task on the shared loop"""
+        import websockets
+        
+        policy = self.policy
+        wakeup = self._wakeups[printer_ip] = asyncio.Event()
+        delay = 0.0
+        try:
+            while True:
+                counters.attempts += 1
+                ws = None
+                try:
+                    # Пинги обнаруживают полуоткрытые соединения, вместо того чтобы вечно показывать старые данные
+                    async with websockets.connect(ws_url, open_timeout=policy.open_timeout,
+                                                  ping_interval=policy.ping_interval,
+                                                  ping_timeout=policy.ping_timeout,
+                                                  close_timeout=policy.close_timeout) as ws:
+                        print(f"[{printer_name}] WebSocket подключен к {ws_url}")
+                        objects = self._subscriptions.get(printer_ip, FULL_SUBSCRIPTION)
+                        await ws.send(json.dumps(subscribe_payload(objects)))
+                        self._sockets[printer_ip] = (ws, objects)
+                        counters.connects += 1
+                        delay = 0.0
+                        
+                        async for raw in ws:
+                            received_at = time.monotonic()
+                            if self.recorder is not None:
+                                self.recorder.write(printer_ip, time.time(), raw)
+                            self._ingest(raw, printer_ip, mailbox, counters, received_at)
+                    reason, clean = "соединение закрыто", True
+                except websockets.ConnectionClosed as e:
+                    # Принтер закрыл соединение сам (например, перезапуск Moonraker, код 1012) — это не ошибка
+                    reason, clean = str(e), getattr(e, "rcvd", None) is not None
+                except Exception as e:
+                    reason = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                    clean = False
+                finally:
+                    # A restarted session for the same printer may already own the slot
+                    if ws is not None and self._sockets.get(printer_ip, (None,))[0] is ws:
+                        del self._sockets[printer_ip]
+                
+                delay = policy.next_delay(delay)
+                if clean:
+                    print(f"[{printer_name}] Соединение закрыто: {reason}; переподключение через {delay:.1f}с")
+                else:
+                    print(f"[{printer_name}] Ошибка подключения: {reason}; повтор через {delay:.1f}с")
+                # Never block the shared loop: other printers keep running meanwhile
+                counters.backoff = delay
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                counters.backoff = 0.0
+        finally:
+            if self._wakeups.get(printer_ip) is wakeup:
+                del self._wakeups[printer_ip]
+    
+    def reconnect_now(self):
+        """Network changed: retry waiting printers at once and re-check open connections"""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake_all)
+    
+    def _wake_all(self):
+        for event in list(self._wakeups.values()):
+            event.set()
+        for ws, _ in list(self._sockets.values()):
+            task = asyncio.ensure_future(self._probe(ws))
+            self._probes.add(task)
+            task.add_done_callback(self._probes.discard)
+    
+    async def _probe(self, ws):
+        """Ping an open connection now; close it if the peer no longer answers"""
+        try:
+            pong = await ws.ping()
+            await asyncio.wait_for(pong, self.policy.ping_timeout)
+        except asyncio.TimeoutError:
+            await ws.close()
+        except Exception:
+            pass
+    
+    def _ingest(self, raw, printer_ip: str, mailbox: PrinterMailbox, counters: SessionCounters,
+                received_at: float):
+        """Filter, decode and hand one raw frame to the printer's mailbox.
+        
+        `received_at` (monotonic) travels with the delta, so latency probes
+        include the filter and decode time.
+        """
+        counters.received += 1
+        # Не декодируем уведомления, на которые никто не подписан
+        if not self.message_filter.accept(raw):
+            counters.skipped += 1
+            return
+        started = time.perf_counter()
+        try:
+            status = extract_status(json.loads(raw))
+        except ValueError:
+            counters.decode_errors += 1
+            return
+        self.decode_latency.observe(time.perf_counter() - started)
+        counters.decoded += 1
+        if not status:
+            return
+        telemetry_log = self.telemetry_log
+        if telemetry_log is not None:
+            # Журнал пишется по каждой дельте в момент приёма, а не по такту интерфейса
+            parsed = parse_klipper_status(status)
+            if parsed and not TELEMETRY_FIELDS.isdisjoint(parsed):
+                telemetry_log.append(printer_ip, parsed)
+        # Сливаем дельту в почтовый ящик; получатель будится один раз на пачку
+        if mailbox.put(status, received_at):
+            self.on_mail(printer_ip)
+    
+    def start_recording(self, path: str, printers: List[Dict]):
+        """Write every raw frame received from now on to a capture file"""
+        self.stop_recording()
+        recorder = self.recorder = CaptureWriter(path, printers)
+        asyncio.run_coroutine_threadsafe(self._flush_recording(recorder), self._ensure_loop())
+        print(f"[ConnectionEngine] Recording to {path}")
+    
+    async def _flush_recording(self, recorder: CaptureWriter):
+        """Flush the capture once a second, so a crash loses at most the last second"""
+        while self.recorder is recorder:
+            await asyncio.sleep(recorder.FLUSH_INTERVAL)
+            recorder.flush()
+    
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+            print(f"[ConnectionEngine] Recorded {recorder.frames} frames to {recorder.path}")
+    
+    def start_replay(self, path: str, speed: float = 1.0, on_done: Optional[Callable[[Dict], None]] = None):
+        """Feed a capture through the ingest path instead of live connections.
+        
+        `speed` scales the recorded timing (2.0 is twice as fast), 0 replays
+        as fast as possible. `on_done(summary)` is called from the network thread.
+        """
+        printers = read_capture_header(path)["printers"]
+        for printer in printers:
+            self.mailboxes[printer["ip"]] = PrinterMailbox()
+            self.counters[printer["ip"]] = SessionCounters()
+        loop = self._ensure_loop()
+        self.replay = asyncio.run_coroutine_threadsafe(self._replay(path, speed, on_done), loop)
+        print(f"[ConnectionEngine] Replaying {path} at {'max' if speed <= 0 else f'{speed:g}x'} speed")
+    
+    async def _replay(self, path: str, speed: float, on_done: Optional[Callable[[Dict], None]]):
+        frames = 0
+        started = time.monotonic()
+        first = None
+        for received_at, ip, raw in iter_capture(path):
+            mailbox, counters = self.mailboxes.get(ip), self.counters.get(ip)
+            if mailbox is None or counters is None:
+                continue
+            if speed > 0:
+                if first is None:
+                    first = received_at
+                delay = (received_at - first) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif frames % 256 == 0:
+                await asyncio.sleep(0)  # let the receiver take its mail
+            self._ingest(raw, ip, mailbox, counters, time.monotonic())
+            frames += 1
+        elapsed = time.monotonic() - started
+        summary = {"frames": frames, "seconds": elapsed, "frames_per_second": frames / elapsed if elapsed else 0.0}
+        print(f"[ConnectionEngine] Replay finished: {frames} frames in {elapsed:.2f} s "
+              f"({summary['frames_per_second']:.0f} frames/s)")
+        if on_done is not None:
+            on_done(summary)
+    
+    def set_subscription(self, ip: str, objects: Dict[str, List[str]]):
+        """Change the objects streamed for a printer, re-subscribing if connected"""
+        if self._subscriptions.get(ip) == objects:
+            return
+        self._subscriptions[ip] = objects
+        loop = self._loop
+        if ip in self.sessions and loop is not None and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._resubscribe(ip, objects), loop)
+    
+    async def _resubscribe(self, ip: str, objects: Dict[str, List[str]]):
+        """Send a new printer.objects.subscribe on the open connection"""
+        ws, current = self._sockets.get(ip, (None, None))
+        if ws is None or current == objects:
+            return  # Not connected (the session subscribes on connect) or nothing to change
+        try:
+            await ws.send(json.dumps(subscribe_payload(objects)))
+            self._sockets[ip] = (ws, objects)
+            print(f"[ConnectionEngine] {ip}: подписка на {', '.join(sorted(objects))}")
+        except Exception as e:
+            print(f"[ConnectionEngine] {ip}: resubscribe failed: {e}")
+    
+    def stop_printer(self, ip: str):
+        """Stop WebSocket connection for a printer"""
+        self._subscriptions.pop(ip, None)
+        self.mailboxes.pop(ip, None)
+        self.counters.pop(ip, None)
+        session = self.sessions.pop(ip, None)
+        if session is not None:
+            # Cancelling the future cancels the task inside the loop thread
+            session.cancel()
+    
+    def take_mail(self, ip: str) -> Optional[Dict]:
+        """Merged status delta received for a printer since the last call"""
+        mailbox = self.mailboxes.get(ip)
+        return mailbox.take() if mailbox is not None else None
+    
+    def take_mail_stamped(self, ip: str) -> Tuple[Optional[Dict], float]:
+        """Like take_mail, plus the monotonic receipt time of its oldest frame"""
+        mailbox = self.mailboxes.get(ip)
+        return mailbox.take_stamped() if mailbox is not None else (None, 0.0)
+    
+    def is_connected(self, ip: str) -> bool:
+        return ip in self._sockets
+    
+    def stats(self) -> Dict[str, int]:
+        """Mailbox counters summed over all printers"""
+        totals = {}
+        for mailbox in list(self.mailboxes.values()):
+            for key, value in mailbox.stats().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+    
+    def stop_all(self):
+        """Stop all WebSocket connections and any replay"""
+        for ip in list(self.sessions.keys()):
+            self.stop_printer(ip)
+        if self.replay is not None:
+            self.replay.cancel()
+            self.replay = None
+            self.mailboxes.clear()
+            self.counters.clear()
+    
+    async def _cancel_all(self, grace: float):
+        """Cancel every task left on the shared loop, all at once.
+        
+        Sockets get `grace` seconds for a polite close handshake; the ones a
+        silent printer never acknowledges are then aborted, so the total wait
+        does not depend on the number of printers.
+        """
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=grace)
+        if pending:
+            for ws, _ in list(self._sockets.values()):
+                ws.transport.abort()
+            await asyncio.wait(pending, timeout=0.1)
+    
+    def shutdown(self, timeout: float = 1.0):
+        """Stop all connections and the shared event loop within about `timeout` seconds"""
+        started = time.monotonic()
+        self.stop_recording()
+        if self.mailboxes:
+            print(f"[ConnectionEngine] mailbox stats: {self.stats()}")
+            print(f"[ConnectionEngine] filter stats: {self.message_filter.stats()}")
+        self.stop_all()
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = None
+            self._loop_thread = None
+        if loop is not None and not loop.is_closed():
+            # Let cancelled sessions unwind before the loop goes away
+            try:
+                asyncio.run_coroutine_threadsafe(self._cancel_all(timeout * 0.5), loop).result(timeout=timeout)
+            except Exception:
+                pass
+            loop.call_soon_threadsafe(loop.stop)
+        if thread is not None:
+            thread.join(timeout=max(0.1, timeout - (time.monotonic() - started)))
+        telemetry_log, self.telemetry_log = self.telemetry_log, None
+        if telemetry_log is not None:
+            telemetry_log.close()
+
+
+# ---------------------------
+# Message Parser
+# ---------------------------
+def extract_status(raw: Dict) -> Optional[Dict]:
+    """Return the Klipper status dict carried by a Moonraker message, if any"""
+    try:
+        if not isinstance(raw, dict):
+            return None
+        
+        method = raw.get('method')
+        if method == 'notify_status_update':
+            params = raw.get('params', [])
+            if params and isinstance(params, list) and len(params) > 0:
+                data = params[0]
+            else:
+                return None
+        elif 'result' in raw and raw.get('result', {}).get('status'):
+            data = raw['result']['status']
+        else:
+            return None
+        
+        if not data or not isinstance(data, dict):
+            return None
+        return data
+    
+    except Exception as e:
+        print(f"[Parser] Error: {e}")
+        return None
+
+
+def parse_moonraker_message(raw: Dict) -> Optional[Dict]:
+    data = extract_status(raw)
+    if data is None:
+        return None
+    return parse_klipper_status(data)
+
+
+def parse_klipper_status(data: Dict) -> Optional[Dict]:
+    """Convert Klipper objects ({object: {field: value}}) into display fields"""
+    try:
+        result = {}
+        
+        # Hotend temperature
+        if 'extruder' in data and isinstance(data['extruder'], dict):
+            extruder = data['extruder']
+            if 'temperature' in extruder:
+                temp = extruder['temperature']
+                result['hotend'] = {
+                    "actual": float(temp) if isinstance(temp, (int, float)) else None,
+                    "target": float(extruder.get('target')) if extruder.get('target') is not None else None
+                }
+        
+        # Bed temperature
+        if 'heater_bed' in data and isinstance(data['heater_bed'], dict):
+            heater_bed = data['heater_bed']
+            if 'temperature' in heater_bed:
+                temp = heater_bed['temperature']
+                result['bed'] = {
+                    "actual": float(temp) if isinstance(temp, (int, float)) else None,
+                    "target": float(heater_bed.get('target')) if heater_bed.get('target') is not None else None
+                }
+        
+        # Print stats
+        if 'print_stats' in data and isinstance(data['print_stats'], dict):
+            print_stats = data['print_stats']
+            
+            if 'filename' in print_stats:
+                result['filename'] = print_stats['filename']
+            
+            if 'state' in print_stats:
+                result['status'] = print_stats['state']
+            
+            if isinstance(print_stats.get('print_duration'), (int, float)):
+                result['print_duration'] = float(print_stats['print_duration'])
+        
+        # Progress from virtual_sdcard (most reliable)
+        if 'virtual_sdcard' in data and isinstance(data['virtual_sdcard'], dict):
+            vsd = data['virtual_sdcard']
+            if 'progress' in vsd:
+                try:
+                    progress = float(vsd['progress'])
+                    result['progress'] = int(round(progress * 100))
+                except Exception:
+                    pass
+            for key in ('file_position', 'file_size'):
+                if isinstance(vsd.get(key), (int, float)):
+                    result[key] = float(vsd[key])
+        
+        return result
+        
+    except Exception as e:
+        print(f"[Parser] Error: {e}")
+        return None
+
+
+# ---------------------------
+# Printer Status Store
+# ---------------------------
+class StatusStore:
+    """Per-printer Klipper object state, deep-merged from Moonraker deltas.
+    
+    Every changed (object, field) pair gets a new version number; consumers
+    remember the last version they saw and ask only for what changed since.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}    # ip -> {object: {field: value}}
+        self._journal = {}   # ip -> {(object, field): version}, ordered by version
+        self._versions = {}  # ip -> latest version
+    
+    def apply(self, ip: str, delta: Dict) -> bool:
+        """Merge a status delta for a printer, returns True if anything changed"""
+        changed = False
+        with self._lock:
+            status = self._status.setdefault(ip, {})
+            journal = self._journal.setdefault(ip, {})
+            version = self._versions.get(ip, 0)
+            for obj, fields in delta.items():
+                if not isinstance(fields, dict):
+                    continue
+                current = status.setdefault(obj, {})
+                for field, value in fields.items():
+                    if field in current and current[field] == value:
+                        continue
+                    current[field] = value
+                    version += 1
+                    # Re-insert to keep the journal ordered by version
+                    journal.pop((obj, field), None)
+                    journal[(obj, field)] = version
+                    changed = True
+            self._versions[ip] = version
+        return changed
+    
+    def version(self, ip: str) -> int:
+        with self._lock:
+            return self._versions.get(ip, 0)
+    
+    def snapshot(self, ip: str) -> Tuple[int, Dict]:
+        """Return (version, copy of the full merged status) for a printer"""
+        with self._lock:
+            status = self._status.get(ip, {})
+            return self._versions.get(ip, 0), {obj: dict(fields) for obj, fields in status.items()}
+    
+    def changes_since(self, ip: str, since: int) -> Tuple[int, Dict]:
+        """Return (version, {object: {field: value}}) for fields changed after `since`.
+        
+        Walks the journal from the newest entry backwards, so the cost is
+        proportional to the number of changed fields only.
+        """
+        changes = {}
+        with self._lock:
+            version = self._versions.get(ip, 0)
+            if version <= since:
+                return version, changes
+            status = self._status[ip]
+            for (obj, field) in reversed(self._journal[ip]):
+                if self._journal[ip][(obj, field)] <= since:
+                    break
+                changes.setdefault(obj, {})[field] = status[obj][field]
+        return version, changes
+    
+    def changed_objects_since(self, ip: str, since: int) -> Tuple[int, Dict]:
+        """Like changes_since, but returns the full merged state of each changed object"""
+        with self._lock:
+            version = self._versions.get(ip, 0)
+            if version <= since:
+                return version, {}
+            status = self._status[ip]
+            journal = self._journal[ip]
+            objects = set()
+            for key in reversed(journal):
+                if journal[key] <= since:
+                    break
+                objects.add(key[0])
+            return version, {obj: dict(status[obj]) for obj in objects}
+    
+    def remove(self, ip: str):
+        with self._lock:
+            self._status.pop(ip, None)
+            self._journal.pop(ip, None)
+            self._versions.pop(ip, None)
+    
+    def clear(self):
+        with self._lock:
+            self._status.clear()
+            self._journal.clear()
+            self._versions.clear()
+
+
+# ---------------------------
+# Metrics
+# ---------------------------
+PRINTER_STATES = ("standby", "printing", "paused", "complete", "cancelled", "error")
+
+
+class LatencyHistogram:
+    """Prometheus-style histogram of durations in seconds.
+    
+    observe() takes no lock so it never stalls ingest; each instance is meant
+    to have a single writer thread, readers may see a slightly torn snapshot.
+    """
+    DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+    
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+    
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+    
+    def lines(self, name: str, labels: Dict[str, str]) -> List[str]:
+        counts = list(self.counts)
+        out = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            out.append(metric_line(f"{name}_bucket", cumulative, dict(labels, le=le)))
+        out.append(metric_line(f"{name}_sum", self.sum, labels))
+        out.append(metric_line(f"{name}_count", cumulative, labels))
+        return out
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def metric_line(name: str, value: float, labels: Optional[Dict[str, str]] = None) -> str:
+    """One sample in the Prometheus text exposition format"""
+    if labels:
+        pairs = ",".join(f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+        return f"{name}{{{pairs}}} {value}"
+    return f"{name} {value}"
+
+
+# Per-printer metric families, in output order
+_PRINTER_METRICS = (
+    ("klipperdesk_temperature_celsius", "gauge"),
+    ("klipperdesk_progress_ratio", "gauge"),
+    ("klipperdesk_printer_state", "gauge"),
+    ("klipperdesk_ws_connected", "gauge"),
+    ("klipperdesk_ws_backoff_seconds", "gauge"),
+    ("klipperdesk_ws_reconnects_total", "counter"),
+    ("klipperdesk_messages_total", "counter"),
+    ("klipperdesk_mailbox_total", "counter"),
+)
+
+
+def render_metrics(engine: ConnectionEngine, store: StatusStore, printers: Dict[str, str],
+                   parse_latency: Optional[LatencyHistogram] = None,
+                   extra: Optional[List[str]] = None) -> str:
+    """Prometheus text for the fleet (`printers`: ip -> name) and client internals.
+    
+    Only reads counters and store snapshots, so it is safe to call from an
+    HTTP thread while ingest keeps running.
+    """
+    # Samples of one family must be contiguous, so collect them per family first
+    families = {name: [] for name, _ in _PRINTER_METRICS}
+    for ip, name in list(printers.items()):
+        labels = {"printer": name, "ip": ip}
+        _, status = store.snapshot(ip)
+        parsed = parse_klipper_status(status) or {}
+        for heater in ("hotend", "bed"):
+            for kind in ("actual", "target"):
+                value = (parsed.get(heater) or {}).get(kind)
+                if value is not None:
+                    families["klipperdesk_temperature_celsius"].append(
+                        (value, dict(labels, heater=heater, kind=kind)))
+        if "progress" in parsed:
+            families["klipperdesk_progress_ratio"].append((parsed["progress"] / 100.0, labels))
+        state = parsed.get("status")
+        for known in PRINTER_STATES:
+            families["klipperdesk_printer_state"].append((int(state == known), dict(labels, state=known)))
+        
+        counters = engine.counters.get(ip)
+        if counters is not None:
+            families["klipperdesk_ws_connected"].append((int(engine.is_connected(ip)), labels))
+            families["klipperdesk_ws_backoff_seconds"].append((counters.backoff, labels))
+            families["klipperdesk_ws_reconnects_total"].append((counters.reconnects, labels))
+            for kind in ("received", "decoded", "skipped", "decode_errors"):
+                families["klipperdesk_messages_total"].append((getattr(counters, kind), dict(labels, kind=kind)))
+        mailbox = engine.mailboxes.get(ip)
+        if mailbox is not None:
+            stats = mailbox.stats()
+            for kind in ("frames", "coalesced", "dropped", "batches"):
+                families["klipperdesk_mailbox_total"].append((stats[kind], dict(labels, kind=kind)))
+    
+    out = []
+    for name, kind in _PRINTER_METRICS:
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(metric_line(name, value, labels) for value, labels in families[name])
+    
+    out.append("# TYPE klipperdesk_filter_frames_total counter")
+    filter_stats = engine.message_filter.stats()
+    for result in ("decoded", "skipped"):
+        for method, count in sorted(filter_stats[result].items()):
+            out.append(metric_line("klipperdesk_filter_frames_total", count,
+                                   {"method": method or "response", "result": result}))
+    
+    out.append("# TYPE klipperdesk_parse_seconds histogram")
+    out.extend(engine.decode_latency.lines("klipperdesk_parse_seconds", {"stage": "decode"}))
+    if parse_latency is not None:
+        out.extend(parse_latency.lines("klipperdesk_parse_seconds", {"stage": "parse"}))
+    if extra:
+        out.extend(extra)
+    return "\n".join(out) + "\n"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics in the Prometheus text format"""
+    render = None  # () -> str, set by serve_metrics
+    
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        self.send_metrics(type(self).render())
+    
+    def send_metrics(self, text: str):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass  # Без записи каждого запроса в консоль
+
+
+SERVER_POLL_INTERVAL = 0.05  # seconds; bounds how long server.shutdown() blocks
+
+
+def serve_metrics(render: Callable[[], str], host: str, port: int) -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread; returns the running server"""
+    handler = type("BoundMetricsRequestHandler", (MetricsRequestHandler,), {"render": staticmethod(render)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": SERVER_POLL_INTERVAL},
+                     name="KlipperDesk-metrics", daemon=True).start()
+    return server
+
+
+# ---------------------------
+# Telemetry Log
+# ---------------------------
+# One fixed-size record per parsed delta: timestamp, hotend actual/target,
+# bed actual/target, progress (NaN = not part of the delta) and state code
+# (0 = not part of the delta).
+TELEMETRY_RECORD = struct.Struct("<dfffffB3x")
+# Sparse index entry, written every TelemetryLogWriter.index_every records
+TELEMETRY_INDEX = struct.Struct("<dQ")
+PRINT_STATES = ("",) + PRINTER_STATES
+UNKNOWN_STATE_CODE = 255
+TELEMETRY_FIELDS = frozenset(("hotend", "bed", "progress", "status"))  # parsed keys stored in a record
+NAN = float("nan")
+
+
+def encode_telemetry_record(ts: float, parsed: Dict) -> bytes:
+    """Pack a parse_moonraker_message() result into one fixed-size record"""
+    hotend = parsed.get('hotend') or {}
+    bed = parsed.get('bed') or {}
+    progress = parsed.get('progress')
+    state = parsed.get('status')
+    if state is None:
+        state_code = 0
+    elif state in PRINT_STATES:
+        state_code = PRINT_STATES.index(state)
+    else:
+        state_code = UNKNOWN_STATE_CODE
+    
+    def value(v):
+        return NAN if v is None else float(v)
+    
+    return TELEMETRY_RECORD.pack(
+        ts,
+        value(hotend.get('actual')), value(hotend.get('target')),
+        value(bed.get('actual')), value(bed.get('target')),
+        value(progress), state_code
+    )
+
+
+class TelemetryLogWriter:
+    """Append-only telemetry log of one printer with size/age based rotation"""
+    
+    def __init__(self, directory: str, ip: str, rotate_bytes: int = 8 * 1024 * 1024,
+                 rotate_seconds: float = 24 * 3600, index_every: int = 256):
+        self.directory = directory
+        self.prefix = re.sub(r"[^0-9A-Za-z.-]", "_", ip)
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.index_every = index_every
+        self.path = None  # current .kdlog file
+        self._log = None
+        self._index = None
+        self._records = 0
+        self._opened_at = 0.0
+    
+    def _open(self, ts: float):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(ts))
+        base = os.path.join(self.directory, f"{self.prefix}-{stamp}")
+        # Buffered appends: the OS sees a write per 64 KB, not per record
+        self.path = base + ".kdlog"
+        self._log = open(self.path, "ab", buffering=64 * 1024)
+        self._index = open(base + ".kdidx", "ab", buffering=4 * 1024)
+        self._records = self._log.tell() // TELEMETRY_RECORD.size
+        self._opened_at = ts
+    
+    def append(self, ts: float, parsed: Dict):
+        if self._log is not None and (
+                self._records * TELEMETRY_RECORD.size >= self.rotate_bytes
+                or ts - self._opened_at >= self.rotate_seconds):
+            self.close()
+        if self._log is None:
+            self._open(ts)
+        if self._records % self.index_every == 0:
+            self._index.write(TELEMETRY_INDEX.pack(ts, self._records))
+        self._log.write(encode_telemetry_record(ts, parsed))
+        self._records += 1
+    
+    def flush(self):
+        if self._log is not None:
+            self._log.flush()
+            self._index.flush()
+    
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._index.close()
+            self._log = None
+            self._index = None
+
+
+class TelemetryLogReader:
+    """Memory-mapped reader of one .kdlog file.
+    
+    Records are in timestamp order, so a time range is found by bisecting
+    the sparse index and then the records of one index block: O(log n).
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._log_map = self._map(path)
+        index_path = path[:-len(".kdlog")] + ".kdidx"
+        self._index_map = self._map(index_path) if os.path.exists(index_path) else None
+        self.count = len(self._log_map) // TELEMETRY_RECORD.size if self._log_map is not None else 0
+        self._index_count = len(self._index_map) // TELEMETRY_INDEX.size if self._index_map is not None else 0
+    
+    @staticmethod
+    def _map(path: str) -> Optional[mmap.mmap]:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def timestamp_at(self, n: int) -> float:
+        return struct.unpack_from("<d", self._log_map, n * TELEMETRY_RECORD.size)[0]
+    
+    def _bisect_records(self, ts: float, lo: int, hi: int) -> int:
+        """First record number in [lo, hi) with timestamp >= ts"""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp_at(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    
+    def find(self, ts: float) -> int:
+        """Record number of the first record with timestamp >= ts"""
+        if self.count == 0:
+            return 0
+        lo, hi = 0, self.count
+        if self._index_count:
+            # Narrow down to one index block first
+            a, b = 0, self._index_count
+            while a < b:
+                mid = (a + b) // 2
+                if TELEMETRY_INDEX.unpack_from(self._index_map, mid * TELEMETRY_INDEX.size)[0] < ts:
+                    a = mid + 1
+                else:
+                    b = mid
+            if a > 0:
+                lo = TELEMETRY_INDEX.unpack_from(self._index_map, (a - 1) * TELEMETRY_INDEX.size)[1]
+            if a < self._index_count:
+                hi = min(hi, TELEMETRY_INDEX.unpack_from(self._index_map, a * TELEMETRY_INDEX.size)[1])
+        return self._bisect_records(ts, lo, hi)
+    
+    def read_range(self, since: float, until: float) -> List[Tuple]:
+        """Unpacked records with since <= timestamp < until"""
+        if self.count == 0:
+            return []
+        start, stop = self.find(since), self.find(until)
+        view = memoryview(self._log_map)[start * TELEMETRY_RECORD.size:stop * TELEMETRY_RECORD.size]
+        try:
+            return list(TELEMETRY_RECORD.iter_unpack(view))
+        finally:
+            view.release()
+    
+    def close(self):
+        for m in (self._log_map, self._index_map):
+            if m is not None:
+                m.close()
+
+
+class TelemetryLog:
+    """Per-printer telemetry logs in one directory.
+    
+    Written by the network thread for every parsed delta; buffered writes
+    are flushed every `flush_seconds`. Safe to read from other threads.
+    """
+    
+    def __init__(self, directory: str, rotate_bytes: int = 8 * 1024 * 1024,
+                 rotate_seconds: float = 24 * 3600, keep_files: int = 14, flush_seconds: float = 5.0):
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.keep_files = keep_files
+        self.flush_seconds = flush_seconds
+        self._writers = {}  # ip -> TelemetryLogWriter
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._closed = False
+    
+    @classmethod
+    def from_config(cls, config: "Config") -> Optional["TelemetryLog"]:
+        """The log is opt-in; by default it lives in the per-user data directory"""
+        if not config.config.get("telemetry_log_enabled", False):
+            return None
+        return cls(
+            config.config.get("telemetry_log_dir") or os.path.join(user_data_dir(), "telemetry"),
+            rotate_bytes=int(config.config.get("telemetry_log_rotate_mb", 8) * 1024 * 1024),
+            keep_files=config.config.get("telemetry_log_keep_files", 14)
+        )
+    
+    def append(self, ip: str, parsed: Dict, ts: Optional[float] = None):
+        with self._lock:
+            if self._closed:
+                return
+            writer = self._writers.get(ip)
+            if writer is None:
+                writer = self._writers[ip] = TelemetryLogWriter(
+                    self.directory, ip, self.rotate_bytes, self.rotate_seconds)
+            path = writer.path
+            writer.append(time.time() if ts is None else ts, parsed)
+            if writer.path != path:
+                # A new file was started: drop the oldest ones beyond the retention
+                self._prune(writer.prefix)
+            if time.monotonic() - self._flushed_at >= self.flush_seconds:
+                self._flush_locked()
+    
+    def files(self, ip: str) -> List[str]:
+        """Log files of a printer, oldest first (names sort by start time)"""
+        prefix = re.sub(r"[^0-9A-Za-z.-]", "_", ip) + "-"
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith(prefix) and name.endswith(".kdlog"))
+    
+    def _prune(self, prefix: str):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(prefix + "-") and name.endswith(".kdlog"))
+        for name in names[:-self.keep_files] if self.keep_files > 0 else []:
+            base = os.path.join(self.directory, name[:-len(".kdlog")])
+            for ext in (".kdlog", ".kdidx"):
+                try:
+                    os.remove(base + ext)
+                except OSError:
+                    pass
+    
+    def read_range(self, ip: str, since: float, until: float) -> List[Tuple]:
+        """Records of a printer in a time range, across rotated files"""
+        with self._lock:
+            writer = self._writers.get(ip)
+            if writer is not None:
+                writer.flush()
+        records = []
+        for path in self.files(ip):
+            reader = TelemetryLogReader(path)
+            try:
+                if reader.count and reader.timestamp_at(reader.count - 1) >= since and reader.timestamp_at(0) < until:
+                    records.extend(reader.read_range(since, until))
+            finally:
+                reader.close()
+        return records
+    
+    def _flush_locked(self):
+        for writer in self._writers.values():
+            writer.flush()
+        self._flushed_at = time.monotonic()
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+
+
+# ---------------------------
+# Headless Monitor
+# ---------------------------
+class HeadlessMonitor:
+    """Connection engine and status store for the whole fleet, without any UI"""
+    
+    def __init__(self, config: Config):
+        self.config = config
+        self.printers = {}  # ip -> printer config entry
+        self.status_store = StatusStore()
+        self.engine = ConnectionEngine(on_mail=self._on_mail, policy=ReconnectPolicy.from_config(config))
+        self.parse_latency = LatencyHistogram()  # written by the network thread only
+        self._parsed = {}  # ip -> display fields, replaced (never mutated) on every batch
+        self._seen_versions = {}  # ip -> last store version parsed
+        self._last_update = {}  # ip -> wall clock time of the last merged batch
+    
+    def _on_mail(self, ip: str):
+        """Runs in the network thread; the store does its own locking"""
+        status = self.engine.take_mail(ip)
+        if not status or not self.status_store.apply(ip, status):
+            return
+        version, objects = self.status_store.changed_objects_since(ip, self._seen_versions.get(ip, 0))
+        self._seen_versions[ip] = version
+        started = time.perf_counter()
+        parsed = parse_klipper_status(objects)
+        self.parse_latency.observe(time.perf_counter() - started)
+        if parsed:
+            self._parsed[ip] = dict(self._parsed.get(ip, {}), **parsed)
+        self._last_update[ip] = time.time()
+    
+    def start(self, record_path: Optional[str] = None):
+        self.engine.telemetry_log = TelemetryLog.from_config(self.config)
+        for printer in self.config.get_enabled_printers():
+            ip = printer.get("ip", "")
+            if ip:
+                self.printers[ip] = printer
+                self.engine.start_printer(printer)
+        if record_path and self.printers:
+            self.engine.start_recording(record_path, list(self.printers.values()))
+    
+    def start_replay(self, path: str, speed: float = 1.0, on_done: Optional[Callable[[Dict], None]] = None):
+        """Take the printers from a capture and feed it through the engine"""
+        for printer in read_capture_header(path)["printers"]:
+            self.printers[printer["ip"]] = printer
+        self.engine.start_replay(path, speed, on_done)
+    
+    def printer_state(self, ip: str) -> Dict:
+        state = {
+            "name": self.printers[ip].get("name", "Unknown"),
+            "ip": ip,
+            "connected": self.engine.is_connected(ip),
+            "last_update": self._last_update.get(ip),
+            "version": self._seen_versions.get(ip, 0),
+        }
+        state.update(self._parsed.get(ip, {}))
+        return state
+    
+    def fleet_state(self) -> Dict:
+        return {
+            "time": time.time(),
+            "printers": [self.printer_state(ip) for ip in list(self.printers)],
+        }
+    
+    def metrics_text(self) -> str:
+        names = {ip: printer.get("name", "Unknown") for ip, printer in list(self.printers.items())}
+        return render_metrics(self.engine, self.status_store, names, self.parse_latency)
+    
+    def shutdown(self):
+        self.engine.shutdown()
+
+
+class HeadlessRequestHandler(MetricsRequestHandler):
+    """GET /fleet (or /) for all printers, /printers/<ip> for one printer's raw objects, /metrics"""
+    monitor = None  # HeadlessMonitor, set by serve_headless
+    
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path in ("", "/fleet"):
+            self._send_json(200, self.monitor.fleet_state())
+        elif path.startswith("/printers/") and path[len("/printers/"):] in self.monitor.printers:
+            ip = path[len("/printers/"):]
+            version, status = self.monitor.status_store.snapshot(ip)
+            self._send_json(200, {"ip": ip, "version": version, "status": status})
+        elif path == "/metrics":
+            self.send_metrics(self.monitor.metrics_text())
+        else:
+            self._send_json(404, {"error": "not found"})
+    
+    def _send_json(self, code: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_headless(monitor: HeadlessMonitor, host: str, port: int) -> ThreadingHTTPServer:
+    """Create the JSON endpoint for a monitor; call serve_forever() on the result"""
+    handler = type("BoundHeadlessRequestHandler", (HeadlessRequestHandler,), {"monitor": monitor})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Floating Klipper gadget")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Config file path")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run without Qt and serve fleet state as JSON over HTTP")
+    parser.add_argument("--host", default=None, help="Headless HTTP address (default from config)")
+    parser.add_argument("--port", type=int, default=None, help="Headless HTTP port (default from config)")
+    parser.add_argument("--record", metavar="PATH", help="Write every raw Moonraker frame to a gzip capture")
+    parser.add_argument("--replay", metavar="PATH", help="Feed a capture instead of connecting to printers")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="Replay speed factor, 0 for as fast as possible (default 1)")
+    return parser
+
+
+def headless_main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    config = Config(args.config)
+    host = args.host or config.config.get("headless_host", "127.0.0.1")
+    port = args.port if args.port is not None else config.config.get("headless_port", 7130)
+    
+    monitor = HeadlessMonitor(config)
+    server = serve_headless(monitor, host, port)
+    if args.replay:
+        # После воспроизведения печатаем итоговое состояние и выходим: удобно для регрессий
+        def on_replay_done(summary: Dict):
+            print(json.dumps(dict(monitor.fleet_state(), replay=summary), ensure_ascii=False, indent=2))
+            threading.Thread(target=server.shutdown).start()
+        try:
+            monitor.start_replay(args.replay, args.replay_speed, on_replay_done)
+        except (OSError, ValueError) as e:
+            print(f"[Headless] Не удалось открыть запись: {e}")
+            server.server_close()
+            monitor.shutdown()
+            return 1
+    else:
+        monitor.start(args.record)
+    if not monitor.printers:
+        print("[Headless] Нет включенных принтеров!")
+        server.server_close()
+        monitor.shutdown()
+        return 1
+    
+    print(f"[Headless] {len(monitor.printers)} printer(s), serving http://{host}:{port}/fleet")
+    # SIGTERM от systemd и т.п.: останавливаем сервер из другого потока, затем закрываем соединения
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever(poll_interval=SERVER_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        monitor.shutdown()
+    return 0
@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+IP = "127.0.0.1:9"  # discard port: connections fail and back off, which is all these tests need
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    app.setQuitOnLastWindowClosed(False)
+    return app
+
+
+@pytest.fixture
+def make_app(qapp, tmp_path):
+    import KlipperDesk
+    apps = []
+
+    def make(**settings):
+        config_path = tmp_path / "KDconfig.json"
+        config_path.write_text(json.dumps(dict({
+            "first_run": False,
+            "thumbnail_cache_dir": str(tmp_path / "thumbnails"),
+            "telemetry_log_dir": str(tmp_path / "telemetry"),
+            "printers": [{"name": "Test", "ip": IP, "enabled": True}],
+        }, **settings)), encoding="utf-8")
+        app = KlipperDesk.KlipperApp(str(config_path))
+        assert app.initialize() and app.create_widgets()
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        for widget in app.widgets:
+            widget.close()
+        app.shutdown()
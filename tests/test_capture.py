@@ -0,0 +1,77 @@
+import json
+import shutil
+
+import pytest
+
+from klipperdesk_core import CaptureWriter, ConnectionEngine, iter_capture, read_capture_header
+
+PRINTERS = [{"name": "A", "ip": "10.0.0.1"}, {"name": "B", "ip": "10.0.0.2"}]
+
+
+def notify(temperature):
+    status = {"extruder": {"temperature": temperature}}
+    return json.dumps({"jsonrpc": "2.0", "method": "notify_status_update", "params": [status, 0.0]})
+
+
+def record(path, frames, close=True):
+    writer = CaptureWriter(str(path), PRINTERS)
+    for i in range(frames):
+        writer.write(PRINTERS[i % 2]["ip"], 1000.0 + i, notify(20.0 + i))
+    if close:
+        writer.close()
+    return writer
+
+
+def replay(path):
+    engine = ConnectionEngine(on_mail=lambda ip: None)
+    done = []
+    engine.start_replay(str(path), speed=0, on_done=done.append)
+    engine.replay.result(timeout=10)
+    mail = {p["ip"]: engine.take_mail(p["ip"]) for p in PRINTERS}
+    engine.shutdown()
+    return done[0], mail
+
+
+def test_record_then_replay(tmp_path):
+    path = tmp_path / "capture.jsonl.gz"
+    record(path, 250)
+
+    assert read_capture_header(str(path))["printers"] == PRINTERS
+    summary, mail = replay(path)
+
+    assert summary["frames"] == 250
+    assert mail["10.0.0.1"] == {"extruder": {"temperature": 20.0 + 248}}
+    assert mail["10.0.0.2"] == {"extruder": {"temperature": 20.0 + 249}}
+
+
+def test_capture_of_a_killed_process_replays_flushed_frames(tmp_path):
+    path, copy = tmp_path / "capture.jsonl.gz", tmp_path / "killed.jsonl.gz"
+    writer = record(path, 250, close=False)
+    shutil.copy(path, copy)  # what is on disk if the process dies now
+    writer.close()
+
+    summary, _ = replay(copy)
+
+    assert summary["frames"] == 2 * CaptureWriter.FLUSH_FRAMES
+
+
+def test_cut_off_last_line_is_skipped(tmp_path):
+    path, cut = tmp_path / "capture.jsonl.gz", tmp_path / "cut.jsonl.gz"
+    record(path, 250)
+    data = path.read_bytes()
+    cut.write_bytes(data[:len(data) * 2 // 3])
+
+    frames = list(iter_capture(str(cut)))
+
+    assert 0 < len(frames) < 250
+    assert [t for t, _, _ in frames] == [1000.0 + i for i in range(len(frames))]
+
+
+@pytest.mark.parametrize("size", [0, 12])
+def test_capture_without_header_is_rejected(tmp_path, size):
+    path, cut = tmp_path / "capture.jsonl.gz", tmp_path / "cut.jsonl.gz"
+    record(path, 10)
+    cut.write_bytes(path.read_bytes()[:size])
+
+    with pytest.raises(ValueError, match="empty or truncated"):
+        ConnectionEngine(on_mail=lambda ip: None).start_replay(str(cut))
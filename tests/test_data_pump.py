@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+
+from PyQt5 import QtWidgets
+
+from conftest import IP
+
+DELTAS = 3000
+RATE = 2000.0  # deltas per second
+
+
+def notify(i):
+    status = {"extruder": {"temperature": 20.0 + i * 0.01},
+              "print_stats": {"state": "printing", "print_duration": float(i)}}
+    return json.dumps({"jsonrpc": "2.0", "method": "notify_status_update", "params": [status, 0.0]})
+
+
+def test_pump_keeps_up_with_a_flood_of_deltas(make_app):
+    app = make_app()
+    engine = app.ws_manager.engine
+    mailbox, counters = engine.mailboxes[IP], engine.counters[IP]
+
+    depth = {"now": 0, "max": 0}      # nesting of mail handling and pump slots
+    queued = {"now": 0, "max": 0}     # mail notifications not yet handled by the GUI
+    fields = {"max": 0}
+
+    def enter(fn):
+        def wrapped(*args):
+            depth["now"] += 1
+            depth["max"] = max(depth["max"], depth["now"])
+            try:
+                fields["max"] = max(fields["max"], mailbox._fields)
+                return fn(*args)
+            finally:
+                depth["now"] -= 1
+        return wrapped
+
+    def on_mail(ip):
+        queued["now"] += 1
+        queued["max"] = max(queued["max"], queued["now"])
+        app.ws_manager.mail_ready.emit(ip)
+
+    handle = enter(app.handle_printer_mail)
+
+    def handle_mail(ip):
+        queued["now"] -= 1
+        handle(ip)
+
+    app.ws_manager.mail_ready.disconnect()
+    app.ws_manager.mail_ready.connect(handle_mail)
+    engine.on_mail = on_mail
+    app.refresh_scheduler._flush = enter(app.refresh_scheduler._flush)
+
+    def feed():
+        started = time.monotonic()
+        for i in range(DELTAS):
+            delay = started + i / RATE - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            engine._ingest(notify(i), IP, mailbox, counters, time.monotonic())
+        elapsed["feed"] = time.monotonic() - started
+
+    elapsed = {}
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    while feeder.is_alive():
+        QtWidgets.QApplication.processEvents()
+    # Let the last batch travel through the mailbox and one more pump tick
+    deadline = time.monotonic() + 2.0
+    while time.monotonic() < deadline and (
+            mailbox._pending or app._seen_versions.get(IP) != app.status_store.version(IP)):
+        QtWidgets.QApplication.processEvents()
+        time.sleep(0.005)
+
+    assert DELTAS / elapsed["feed"] > 1000
+    assert depth["max"] == 1
+    assert queued["max"] <= 1
+    assert fields["max"] <= mailbox.max_fields and mailbox.dropped == 0
+
+    # Nothing lost: the pump saw the latest store version and shows the last delta
+    assert app._seen_versions[IP] == app.status_store.version(IP)
+    _, status = app.status_store.snapshot(IP)
+    assert status["print_stats"]["print_duration"] == float(DELTAS - 1)
+    assert status["extruder"]["temperature"] == 20.0 + (DELTAS - 1) * 0.01
+    assert app.printers_data[IP].hotend_temp[0] == 20.0 + (DELTAS - 1) * 0.01
+    assert mailbox.frames == DELTAS
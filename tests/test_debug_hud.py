@@ -0,0 +1,65 @@
+import time
+from types import SimpleNamespace
+
+from PyQt5 import QtWidgets
+
+from klipperdesk_core import Config, ConnectionEngine
+from KlipperDesk import DebugHud, MultiPrinterWidget, PrinterData
+
+IPS = ["10.0.0.1", "10.0.0.2"]
+
+
+def latency_count(hud, ip):
+    return hud._latency.get(ip, [0.0, 0.0, 0])[2]
+
+
+def test_latency_is_closed_only_by_a_paint_of_changed_data(qapp):
+    app = SimpleNamespace(ws_manager=SimpleNamespace(engine=ConnectionEngine(on_mail=lambda ip: None)),
+                          printers_data={})
+    hud = DebugHud(app)
+    received_at = time.monotonic() - 0.25
+
+    hud.record_arrival(IPS[0], received_at)
+    hud.record_applied(IPS[0], changed=False)
+    hud.record_paint(IPS, 0.001)
+    assert latency_count(hud, IPS[0]) == 0  # nothing visible changed
+
+    hud.record_arrival(IPS[0], received_at)
+    hud.record_arrival(IPS[0], received_at + 0.1)  # merged frame: the oldest receipt wins
+    hud.record_applied(IPS[0], changed=True)
+    hud.record_paint([IPS[1]], 0.001)
+    assert latency_count(hud, IPS[0]) == 0  # another printer's block was repainted
+
+    hud.record_paint([IPS[0]], 0.001)
+    assert latency_count(hud, IPS[0]) == 1
+    assert hud._latency[IPS[0]][1] >= 0.25
+    hud.close()
+
+
+def test_multi_widget_reports_only_repainted_blocks(qapp, tmp_path):
+    printers = [PrinterData(f"P{i}", ip) for i, ip in enumerate(IPS)]
+    widget = MultiPrinterWidget(printers, Config(str(tmp_path / "KDconfig.json")), lambda: None)
+    widget.show()
+    qapp.processEvents()
+
+    painted = []
+
+    class Probe:
+        def record_paint(self, ips, seconds):
+            painted.append(list(ips))
+
+    widget.debug_hud = Probe()
+    widget.update(widget.block_rect(1))
+    QtWidgets.QApplication.processEvents()
+
+    assert painted == [[IPS[1]]]
+    widget.close()
+
+
+def test_reinitialize_keeps_a_single_tray_icon(make_app):
+    app = make_app()
+    tray = app.tray_manager
+
+    assert app.initialize()  # what open_settings does after the dialog is accepted
+
+    assert app.tray_manager is tray
@@ -0,0 +1,77 @@
+import pytest
+
+from KlipperDesk import EtaEstimator
+
+SIZE = 1_000_000.0
+RATE = 500.0  # bytes per second of print time
+
+
+def feed(estimator, start, end, step=10.0, rate=RATE, offset=0.0):
+    t = start
+    while t <= end:
+        estimator.add(t, offset + (t - start) * rate)
+        t += step
+    return offset + (end - start) * rate
+
+
+def test_linear_feed_recovers_the_rate():
+    estimator = EtaEstimator()
+    position = feed(estimator, 0.0, 600.0)
+
+    assert estimator.rate == pytest.approx(RATE)
+    assert estimator.remaining(position, SIZE, 600.0) == pytest.approx((SIZE - position) / RATE)
+
+
+def test_not_enough_samples_and_no_slicer_estimate():
+    estimator = EtaEstimator(min_samples=5)
+    for t in range(4):
+        estimator.add(float(t), t * RATE)
+
+    assert estimator.rate is None
+    assert estimator.remaining(3 * RATE, SIZE, 3.0) is None
+
+
+def test_paused_print_adds_no_samples():
+    estimator = EtaEstimator()
+    position = feed(estimator, 0.0, 300.0)
+    rate, samples = estimator.rate, estimator._samples
+
+    for _ in range(100):  # print_duration does not advance while paused
+        estimator.add(300.0, position)
+
+    assert estimator._samples == samples
+    assert estimator.rate == pytest.approx(rate)
+
+
+def test_stall_slows_the_rate_down():
+    estimator = EtaEstimator(half_life=120.0)
+    position = feed(estimator, 0.0, 600.0)
+    feed(estimator, 610.0, 1200.0, rate=0.0, offset=position)  # long move-free section, e.g. a heat soak
+
+    assert estimator.rate < RATE / 4
+
+
+def test_blend_moves_from_slicer_to_measurement():
+    estimator = EtaEstimator()
+    estimator.slicer_estimate = 4000.0
+    feed(estimator, 0.0, 600.0)
+
+    measured = (SIZE - SIZE / 2) / RATE
+    slicer = 4000.0 - 1000.0
+    assert estimator.remaining(SIZE / 2, SIZE, 1000.0) == pytest.approx((measured + slicer) / 2)
+    assert estimator.remaining(SIZE, SIZE, 2000.0) == pytest.approx(0.0)
+
+
+def test_slicer_estimate_alone():
+    estimator = EtaEstimator()
+    estimator.slicer_estimate = 3600.0
+
+    assert estimator.remaining(0.0, SIZE, 600.0) == pytest.approx(3000.0)
+
+
+def test_new_print_resets_the_fit():
+    estimator = EtaEstimator()
+    feed(estimator, 0.0, 600.0)
+    feed(estimator, 0.0, 600.0, rate=RATE * 2)  # print_duration went back: a new job
+
+    assert estimator.rate == pytest.approx(RATE * 2)
@@ -0,0 +1,38 @@
+from klipperdesk_core import PrinterMailbox
+
+
+def test_mailbox_notifies_once_per_batch():
+    mailbox = PrinterMailbox()
+
+    assert mailbox.put({"extruder": {"temperature": 20.0}})
+    assert not mailbox.put({"extruder": {"temperature": 21.0}})
+    assert mailbox.take() == {"extruder": {"temperature": 21.0}}
+    assert mailbox.take() is None
+    assert mailbox.put({"extruder": {"temperature": 22.0}})
+
+    assert mailbox.stats() == {"frames": 3, "coalesced": 1, "dropped": 0, "batches": 2, "pending_fields": 1}
+
+
+def test_full_mailbox_keeps_merging_pending_fields():
+    mailbox = PrinterMailbox(max_fields=4)
+    mailbox.put({"extruder": {"temperature": 20.0, "target": 0.0}, "heater_bed": {"temperature": 25.0, "target": 0.0}})
+
+    for i in range(100):  # full, but every delta only touches fields already waiting
+        mailbox.put({"extruder": {"temperature": 21.0 + i}, "heater_bed": {"target": 60.0}})
+
+    assert mailbox.stats()["dropped"] == 0
+    assert mailbox.take() == {"extruder": {"temperature": 120.0, "target": 0.0},
+                              "heater_bed": {"temperature": 25.0, "target": 60.0}}
+
+
+def test_full_mailbox_drops_only_new_fields():
+    mailbox = PrinterMailbox(max_fields=2)
+    mailbox.put({"extruder": {"temperature": 20.0, "target": 0.0}})
+
+    mailbox.put({"extruder": {"temperature": 30.0}, "print_stats": {"state": "printing"}})
+
+    assert mailbox.stats()["dropped"] == 1
+    assert mailbox.take() == {"extruder": {"temperature": 30.0, "target": 0.0}}
+    # Taking the mail frees the room again
+    mailbox.put({"print_stats": {"state": "printing"}})
+    assert mailbox.take() == {"print_stats": {"state": "printing"}}
@@ -0,0 +1,42 @@
+import json
+
+from klipperdesk_core import MessageFilter
+
+
+def frame(method, padding=""):
+    return json.dumps({"jsonrpc": "2.0", "padding": padding, "method": method, "params": [{}, 0.0]})
+
+
+def test_method_beyond_the_sniffed_prefix_is_decoded():
+    raw = frame("notify_proc_stat_update", padding="x" * 200)
+    assert raw.index('"method"') > MessageFilter._SNIFF_BYTES
+
+    assert MessageFilter.sniff_method(raw) == ""
+    assert MessageFilter().accept(raw)  # treated like a response: decoded, never lost
+
+
+def test_method_cut_by_the_prefix_is_decoded():
+    raw = frame("notify_proc_stat_update", padding="x" * (MessageFilter._SNIFF_BYTES - 50))
+    assert raw.index('"method"') < MessageFilter._SNIFF_BYTES < raw.index('"params"')
+
+    assert MessageFilter.sniff_method(raw) == ""
+    assert MessageFilter().accept(raw)
+
+
+def test_escaped_quotes_do_not_fake_a_method():
+    raw = frame("notify_proc_stat_update", padding='say "method": "notify_status_update"')
+    assert '\\"method\\"' in raw
+
+    assert MessageFilter.sniff_method(raw) == "notify_proc_stat_update"
+    assert not MessageFilter().accept(raw)
+
+
+def test_sniffing_bytes_frames():
+    message_filter = MessageFilter()
+    raw = frame("notify_status_update").encode("utf-8")
+
+    assert MessageFilter.sniff_method(raw) == "notify_status_update"
+    assert message_filter.accept(raw)
+    assert not message_filter.accept(frame("notify_gcode_response"))
+    assert message_filter.stats() == {"decoded": {"notify_status_update": 1},
+                                      "skipped": {"notify_gcode_response": 1}}
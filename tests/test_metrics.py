@@ -0,0 +1,23 @@
+from conftest import IP
+
+
+class ChangingDict(dict):
+    """Stands in for printers_data while the GUI thread rebuilds it"""
+
+    def __iter__(self):
+        raise RuntimeError("dictionary changed size during iteration")
+
+    def items(self):
+        raise RuntimeError("dictionary changed size during iteration")
+
+    def values(self):
+        raise RuntimeError("dictionary changed size during iteration")
+
+
+def test_scrape_reads_a_snapshot_not_the_gui_dict(make_app):
+    app = make_app()
+    app.printers_data = ChangingDict(app.printers_data)
+
+    text = app.metrics_text()
+
+    assert f'klipperdesk_ws_connected{{printer="Test",ip="{IP}"}}' in text
@@ -0,0 +1,31 @@
+import random
+
+from klipperdesk_core import ReconnectPolicy
+
+
+def delays(policy, count):
+    result, delay = [], 0.0  # 0.0: what _consume passes after a successful connect
+    for _ in range(count):
+        delay = policy.next_delay(delay)
+        result.append(delay)
+    return result
+
+
+def test_first_retry_is_jittered():
+    random.seed(1)
+    policy = ReconnectPolicy(min_delay=0.5, max_delay=20.0)
+    first = [policy.next_delay(0.0) for _ in range(200)]
+
+    assert all(0.5 <= d <= 1.5 for d in first)
+    assert len({round(d, 3) for d in first}) > 100  # clients do not retry in lockstep
+    assert max(first) - min(first) > 0.8
+
+
+def test_delays_grow_and_are_capped():
+    random.seed(2)
+    policy = ReconnectPolicy(min_delay=0.5, max_delay=20.0)
+    for _ in range(50):
+        sequence = delays(policy, 30)
+        assert all(policy.min_delay <= d <= policy.max_delay for d in sequence)
+        assert all(b <= max(a, policy.min_delay) * 3 for a, b in zip(sequence, sequence[1:]))
+    assert policy.max_delay in delays(policy, 200)
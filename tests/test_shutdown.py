@@ -0,0 +1,66 @@
+import asyncio
+import json
+import threading
+import time
+
+import websockets
+
+from klipperdesk_core import ConnectionEngine
+
+PRINTERS = 8
+TIMEOUT = 1.0
+
+
+async def deaf_handler(ws, path=None):
+    """Answer the subscribe, then never read again: close frames go unanswered"""
+    request = json.loads(await ws.recv())
+    await ws.send(json.dumps({"jsonrpc": "2.0", "id": request.get("id"), "result": {"status": {}}}))
+    ws.transport.pause_reading()
+    await ws.wait_closed()
+
+
+def start_deaf_servers(count):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def serve():
+        return [await websockets.serve(deaf_handler, "127.0.0.1", 0) for _ in range(count)]
+
+    servers = asyncio.run_coroutine_threadsafe(serve(), loop).result(timeout=5)
+    return loop, thread, servers
+
+
+def test_shutdown_is_bounded_with_deaf_printers():
+    server_loop, server_thread, servers = start_deaf_servers(PRINTERS)
+    ips = [f"127.0.0.1:{server.sockets[0].getsockname()[1]}" for server in servers]
+    engine = ConnectionEngine(on_mail=lambda ip: None)
+    try:
+        for i, ip in enumerate(ips):
+            engine.start_printer({"name": f"Deaf {i}", "ip": ip})
+        deadline = time.monotonic() + 5.0
+        while not all(engine.is_connected(ip) for ip in ips) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert all(engine.is_connected(ip) for ip in ips)
+
+        sessions = list(engine.sessions.values())
+        loop, thread = engine._loop, engine._loop_thread
+        started = time.monotonic()
+        engine.shutdown(timeout=TIMEOUT)
+        elapsed = time.monotonic() - started
+
+        assert elapsed < TIMEOUT + 0.25
+        assert all(session.done() for session in sessions)
+        assert not thread.is_alive()
+        assert not [task for task in asyncio.all_tasks(loop) if not task.done()]
+    finally:
+        async def close():
+            for server in servers:
+                for ws in list(server.websockets):
+                    ws.transport.abort()
+                server.close()
+            await asyncio.wait([asyncio.ensure_future(server.wait_closed()) for server in servers], timeout=2)
+
+        asyncio.run_coroutine_threadsafe(close(), server_loop).result(timeout=5)
+        server_loop.call_soon_threadsafe(server_loop.stop)
+        server_thread.join(timeout=5)
@@ -0,0 +1,50 @@
+import math
+
+from PyQt5 import QtCore
+
+from KlipperDesk import SparklineRenderer, TelemetryHistory
+
+SIZE = QtCore.QSize(120, 30)
+
+
+def sample(history: TelemetryHistory, ts: float, hotend):
+    history.add(ts, hotend_actual=hotend(ts), hotend_target=215.0 if hotend(ts) > 100 else 0.0,
+                bed_actual=60.0 + math.sin(ts / 7.0), progress=(ts % 300) / 3.0)
+
+
+def render_live(renderer, history, start, seconds, hotend, rate=4):
+    """Add samples in real time order, rendering incrementally once a second"""
+    ts = start
+    for second in range(seconds):
+        for i in range(rate):
+            ts = start + second + i / rate
+            sample(history, ts, hotend)
+        renderer.render(history, SIZE, 1.0, now=ts)
+    return ts
+
+
+def assert_incremental_matches_full(span, seconds, hotend):
+    history = TelemetryHistory()
+    incremental = SparklineRenderer(span)
+    now = render_live(incremental, history, 10_000.0, seconds, hotend)
+
+    live = incremental.render(history, SIZE, 1.0, now=now).toImage()
+    full = SparklineRenderer(span).render(history, SIZE, 1.0, now=now).toImage()
+
+    assert live == full
+    return incremental
+
+
+def test_incremental_render_matches_full_render(qapp):
+    assert_incremental_matches_full(600.0, 300, lambda ts: 20.0 + (ts - 10_000.0) * 0.7)
+
+
+def test_scale_shrinks_when_peak_scrolls_out(qapp):
+    # Heats to 260 °C, then cools to 40 °C; the peak leaves a 60 s window
+    def hotend(ts):
+        t = ts - 10_000.0
+        return 260.0 if t < 20 else 40.0
+
+    renderer = assert_incremental_matches_full(60.0, 150, hotend)
+
+    assert renderer._temp_scale == 100.0
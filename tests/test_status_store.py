@@ -0,0 +1,78 @@
+from klipperdesk_core import StatusStore
+
+IP = "10.0.0.1"
+
+
+def test_delta_merges_per_field():
+    store = StatusStore()
+    store.apply(IP, {"extruder": {"temperature": 20.0, "target": 0.0}, "print_stats": {"state": "standby"}})
+    store.apply(IP, {"extruder": {"target": 215.0}, "webhooks": "not an object"})
+
+    version, status = store.snapshot(IP)
+
+    assert status == {"extruder": {"temperature": 20.0, "target": 215.0}, "print_stats": {"state": "standby"}}
+    assert version == 4
+
+
+def test_nested_values_are_replaced_whole():
+    store = StatusStore()
+    store.apply(IP, {"toolhead": {"position": [0, 0, 0, 0], "extra": {"a": 1, "b": 2}}})
+    store.apply(IP, {"toolhead": {"extra": {"a": 3}}})
+
+    assert store.snapshot(IP)[1]["toolhead"] == {"position": [0, 0, 0, 0], "extra": {"a": 3}}
+
+
+def test_version_counts_changed_fields_only():
+    store = StatusStore()
+    assert store.apply(IP, {"extruder": {"temperature": 20.0}})
+    assert not store.apply(IP, {"extruder": {"temperature": 20.0}})  # same value
+    assert store.version(IP) == 1
+    assert store.apply(IP, {"extruder": {"temperature": 21.0, "target": 0.0}})
+    assert store.version(IP) == 3
+    assert store.version("10.0.0.9") == 0
+
+
+def test_changes_since_with_compacted_journal():
+    store = StatusStore()
+    store.apply(IP, {"extruder": {"temperature": 20.0}, "heater_bed": {"temperature": 25.0}})  # v1, v2
+    seen = store.version(IP)
+    store.apply(IP, {"extruder": {"temperature": 21.0}})                                        # v3
+    store.apply(IP, {"print_stats": {"state": "printing"}})                                    # v4
+    store.apply(IP, {"extruder": {"temperature": 22.0}})  # v5 replaces the v3 journal entry
+
+    assert store.changes_since(IP, seen) == (5, {"extruder": {"temperature": 22.0},
+                                                 "print_stats": {"state": "printing"}})
+    # A consumer that saw v3: the extruder entry moved past it, so it is resent with its latest value
+    assert store.changes_since(IP, 3) == (5, {"extruder": {"temperature": 22.0},
+                                              "print_stats": {"state": "printing"}})
+    assert store.changes_since(IP, 4) == (5, {"extruder": {"temperature": 22.0}})
+    assert store.changes_since(IP, 5) == (5, {})
+
+
+def test_since_zero_returns_the_full_snapshot():
+    store = StatusStore()
+    for i in range(10):
+        store.apply(IP, {"extruder": {"temperature": 20.0 + i}, "heater_bed": {"temperature": 60.0}})
+
+    version, changes = store.changes_since(IP, 0)
+
+    assert (version, changes) == store.snapshot(IP)
+    assert store.changed_objects_since(IP, 0) == store.snapshot(IP)
+
+
+def test_changed_objects_since_returns_whole_objects():
+    store = StatusStore()
+    store.apply(IP, {"extruder": {"temperature": 20.0, "target": 215.0}, "heater_bed": {"temperature": 60.0}})
+    seen = store.version(IP)
+    store.apply(IP, {"extruder": {"temperature": 30.0}})
+
+    assert store.changed_objects_since(IP, seen) == (seen + 1, {"extruder": {"temperature": 30.0, "target": 215.0}})
+
+
+def test_remove_resets_the_printer():
+    store = StatusStore()
+    store.apply(IP, {"extruder": {"temperature": 20.0}})
+    store.remove(IP)
+
+    assert store.snapshot(IP) == (0, {})
+    assert store.changes_since(IP, 0) == (0, {})
@@ -0,0 +1,25 @@
+from klipperdesk_core import FULL_SUBSCRIPTION, MINIMAL_SUBSCRIPTION, TELEMETRY_SUBSCRIPTION
+
+from conftest import IP
+
+
+def hide_all(app):
+    for widget in app.widgets:
+        widget.hide()
+    app._update_visibility()
+
+
+def test_full_subscription_only_has_fields_that_are_read():
+    assert "display_status" not in FULL_SUBSCRIPTION
+
+
+def test_hidden_printer_gets_minimal_subscription_by_default(make_app):
+    app = make_app()
+    hide_all(app)
+    assert app.ws_manager.engine._subscriptions[IP] == MINIMAL_SUBSCRIPTION
+
+
+def test_hidden_printer_keeps_temperatures_when_log_enabled(make_app):
+    app = make_app(telemetry_log_enabled=True)
+    hide_all(app)
+    assert app.ws_manager.engine._subscriptions[IP] == TELEMETRY_SUBSCRIPTION
@@ -0,0 +1,49 @@
+import math
+
+from KlipperDesk import TelemetryHistory
+
+
+def fill(history: TelemetryHistory, start: float, count: int, step: float):
+    for i in range(count):
+        history.add(start + i * step, hotend_actual=200.0 + i, bed_actual=60.0, progress=i / count)
+    return start + (count - 1) * step
+
+
+def test_partially_covered_window_uses_raw_samples():
+    history = TelemetryHistory()
+    now = fill(history, 1000.0, 240, 0.5)  # 2 minutes, well inside the raw ring
+
+    result = history.query(now - 600)
+
+    assert len(result["timestamp"]) == 240
+    assert result["timestamp"][-1] == now
+    assert result["hotend_actual"][-1] == 200.0 + 239
+
+
+def test_coarse_tier_includes_unfinished_bucket():
+    history = TelemetryHistory(raw_capacity=10, tiers=((1.0, 100), (30.0, 10)))
+    now = fill(history, 1000.0, 500, 0.5)  # raw and the 1 s tier have both evicted
+
+    result = history.query(now - 200)
+
+    # 30 s buckets starting at or after `since`, the last one still being filled
+    assert list(result["timestamp"]) == [1050.0 + 30.0 * i for i in range(7)]
+    assert result["hotend_actual"][-1] == sum(200.0 + i for i in range(460, 500)) / 40
+
+
+def test_window_reached_by_finer_tier():
+    history = TelemetryHistory(raw_capacity=10, tiers=((1.0, 100), (30.0, 10)))
+    now = fill(history, 1000.0, 100, 0.5)  # raw has evicted, the 1 s tier holds everything
+
+    result = history.query(now - 600)
+
+    timestamps = list(result["timestamp"])
+    assert timestamps == [1000.0 + i for i in range(50)]
+    assert not math.isnan(result["hotend_actual"][-1])
+
+
+def test_memory_is_fixed():
+    history = TelemetryHistory()
+    before = history.memory_bytes()
+    fill(history, 0.0, 10000, 1.0)
+    assert history.memory_bytes() == before == (2400 + 3600 + 2880) * 6 * 8
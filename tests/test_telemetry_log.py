@@ -0,0 +1,44 @@
+import json
+import math
+import os
+
+from klipperdesk_core import (
+    Config, ConnectionEngine, PrinterMailbox, SessionCounters, TelemetryLog, user_data_dir,
+)
+
+IP = "10.0.0.5"
+
+
+def notify(status):
+    return json.dumps({"jsonrpc": "2.0", "method": "notify_status_update", "params": [status, 0.0]})
+
+
+def test_log_is_off_by_default(tmp_path):
+    assert TelemetryLog.from_config(Config(str(tmp_path / "KDconfig.json"))) is None
+
+
+def test_enabled_log_defaults_to_user_data_dir(tmp_path):
+    config = Config(str(tmp_path / "KDconfig.json"))
+    config.config["telemetry_log_enabled"] = True
+    log = TelemetryLog.from_config(config)
+    assert log.directory == os.path.join(user_data_dir(), "telemetry")
+
+
+def test_engine_logs_every_parsed_delta(tmp_path):
+    engine = ConnectionEngine(on_mail=lambda ip: None)
+    engine.telemetry_log = TelemetryLog(str(tmp_path))
+    mailbox, counters = PrinterMailbox(), SessionCounters()
+
+    for i in range(50):
+        engine._ingest(notify({"extruder": {"temperature": 200.0 + i}}), IP, mailbox, counters, 0.0)
+    engine._ingest(notify({"print_stats": {"state": "printing"}}), IP, mailbox, counters, 0.0)
+    engine._ingest(notify({"print_stats": {"filename": "a.gcode"}}), IP, mailbox, counters, 0.0)  # nothing to log
+
+    records = engine.telemetry_log.read_range(IP, 0.0, float("inf"))
+    engine.telemetry_log.close()
+
+    # One record per delta as received, even though the mailbox merged them into one
+    assert len(records) == 51
+    assert [r[1] for r in records[:50]] == [200.0 + i for i in range(50)]
+    assert all(math.isnan(r[3]) for r in records[:50])  # bed was not part of those deltas
+    assert records[-1][6] != 0  # state code of "printing"
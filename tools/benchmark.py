@@ -0,0 +1,202 @@
+"""End-to-end load benchmark: fake Moonraker fleet -> WebSocketManager -> KlipperApp -> widgets.
+
+Starts tools/fake_moonraker.py in a subprocess, runs the real application
+against it (offscreen unless QT_QPA_PLATFORM is set) and reports client CPU
+per printer, memory, and frame-to-paint delivery latency percentiles.
+
+    python tools/benchmark.py --printers 20 --rate 5 --duration 30
+    python tools/benchmark.py --printers 10 --storm-every 5 --single
+    python tools/benchmark.py --printers 30 --deaf --max-shutdown 1.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class PaintProbe:
+    """Stands in for DebugHud on the widgets: measures delivery latency at paint time.
+
+    The fake server stamps print_stats.print_duration with wall-clock time
+    minus a shared epoch, so every repaint that shows new data yields one
+    latency sample.
+    """
+
+    def __init__(self, app, epoch: float):
+        self.app = app
+        self.epoch = epoch
+        self.latencies = []  # seconds
+        self.paint_times = []  # seconds
+        self._last_stamp = {}  # ip -> print_duration shown by the previous paint
+
+    def record_paint(self, ips: List[str], seconds: float):
+        now = time.time()
+        self.paint_times.append(seconds)
+        for ip in ips:
+            _, status = self.app.status_store.snapshot(ip)
+            stamp = status.get("print_stats", {}).get("print_duration")
+            if stamp is None or stamp == self._last_stamp.get(ip):
+                continue
+            self._last_stamp[ip] = stamp
+            self.latencies.append(now - (self.epoch + stamp))
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+def max_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 / (1024.0 if sys.platform == "darwin" else 1.0)
+
+
+def run(args) -> Dict:
+    from PyQt5 import QtWidgets, QtCore
+    import KlipperDesk
+
+    epoch = time.time()
+    workdir = tempfile.mkdtemp(prefix="kd-bench-")
+    config_path = os.path.join(workdir, "KDconfig.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "first_run": False,
+            "multiple_widgets": args.single,
+            "show_graphs": args.graphs,
+            "telemetry_log_enabled": False,
+            "thumbnail_cache_dir": os.path.join(workdir, "thumbnails"),
+            "printers": [{"name": f"Bench {i}", "ip": f"127.0.0.1:{args.base_port + i}", "enabled": True}
+                         for i in range(args.printers)],
+        }, f)
+
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "tools", "fake_moonraker.py"),
+                               "--printers", str(args.printers), "--rate", str(args.rate),
+                               "--base-port", str(args.base_port), "--epoch", repr(epoch),
+                               "--storm-every", str(args.storm_every)] + (["--deaf"] if args.deaf else []))
+    try:
+        time.sleep(1.0)  # let the fake fleet bind its ports
+        qt_app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+        qt_app.setQuitOnLastWindowClosed(False)
+        app = KlipperDesk.KlipperApp(config_path)
+        if not app.initialize() or not app.create_widgets():
+            raise RuntimeError("KlipperApp failed to start")
+        probe = PaintProbe(app, epoch)
+        for widget in app.widgets:
+            widget.debug_hud = probe
+
+        # Measure after a warm-up, so connection setup is not counted as load
+        engine = app.ws_manager.engine
+        marks = {}
+        def start_measuring():
+            marks["cpu"] = time.process_time()
+            marks["wall"] = time.monotonic()
+            marks["received"] = sum(c.received for c in engine.counters.values())
+            marks["reconnects"] = sum(c.reconnects for c in engine.counters.values())
+            probe.latencies.clear()
+            probe.paint_times.clear()
+        QtCore.QTimer.singleShot(int(args.warmup * 1000), start_measuring)
+        QtCore.QTimer.singleShot(int((args.warmup + args.duration) * 1000), qt_app.quit)
+        qt_app.exec_()
+
+        cpu = time.process_time() - marks["cpu"]
+        wall = time.monotonic() - marks["wall"]
+        received = sum(c.received for c in engine.counters.values()) - marks["received"]
+        reconnects = sum(c.reconnects for c in engine.counters.values()) - marks["reconnects"]
+        mailbox = engine.stats()
+        http = app.thumbnail_service.loader.http.stats()
+
+        shutdown_started = time.monotonic()
+        app.shutdown()
+        shutdown_seconds = time.monotonic() - shutdown_started
+    finally:
+        server.terminate()
+        server.wait(timeout=5)
+
+    return {
+        "printers": args.printers,
+        "rate": args.rate,
+        "seconds": wall,
+        "cpu_percent": cpu / wall * 100.0,
+        "cpu_ms_per_printer_second": cpu / wall / args.printers * 1000.0,
+        "max_rss_mb": max_rss_mb(),
+        "frames_received": received,
+        "frames_per_second": received / wall,
+        "coalesced": mailbox.get("coalesced", 0),
+        "dropped": mailbox.get("dropped", 0),
+        "reconnects": reconnects,
+        "paints": len(probe.paint_times),
+        "paint_ms_p50": percentile(probe.paint_times, 50) * 1000.0,
+        "paint_ms_p99": percentile(probe.paint_times, 99) * 1000.0,
+        "latency_samples": len(probe.latencies),
+        "latency_ms_p50": percentile(probe.latencies, 50) * 1000.0,
+        "latency_ms_p90": percentile(probe.latencies, 90) * 1000.0,
+        "latency_ms_p99": percentile(probe.latencies, 99) * 1000.0,
+        "latency_ms_max": max(probe.latencies, default=float("nan")) * 1000.0,
+        "http_requests": http["requests"],
+        "http_errors": http["errors"],
+        "shutdown_seconds": shutdown_seconds,
+    }
+
+
+def report(args, result: Dict):
+    print(f"\n{args.printers} printers x {args.rate:g} Hz, {result['seconds']:.1f} s measured")
+    print(f"  CPU       {result['cpu_percent']:.1f}% total, "
+          f"{result['cpu_ms_per_printer_second']:.2f} ms per printer-second")
+    print(f"  memory    {result['max_rss_mb']:.0f} MB max RSS")
+    print(f"  frames    {result['frames_received']} ({result['frames_per_second']:.0f}/s), "
+          f"coalesced {result['coalesced']}, dropped {result['dropped']}, reconnects {result['reconnects']}")
+    print(f"  paint     {result['paints']} repaints, p50 {result['paint_ms_p50']:.2f} ms, "
+          f"p99 {result['paint_ms_p99']:.2f} ms")
+    print(f"  latency   p50 {result['latency_ms_p50']:.0f} ms, p90 {result['latency_ms_p90']:.0f} ms, "
+          f"p99 {result['latency_ms_p99']:.0f} ms, max {result['latency_ms_max']:.0f} ms "
+          f"({result['latency_samples']} samples)")
+    print(f"  http      {result['http_requests']} requests (metadata + thumbnails), {result['http_errors']} errors")
+    print(f"  shutdown  {result['shutdown_seconds']:.2f} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="KlipperDesk end-to-end load benchmark")
+    parser.add_argument("--printers", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=4.0, help="status updates per second per printer")
+    parser.add_argument("--duration", type=float, default=15.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds before measuring starts")
+    parser.add_argument("--storm-every", type=float, default=0.0, help="server drops all connections every N s")
+    parser.add_argument("--deaf", action="store_true", help="server stops reading after subscribe (half-open peers)")
+    parser.add_argument("--max-shutdown", type=float, default=0.0,
+                        help="exit with status 1 if shutdown takes longer than this many seconds")
+    parser.add_argument("--single", action="store_true", help="one window per printer instead of one shared")
+    parser.add_argument("--graphs", action="store_true", help="enable the history graphs")
+    parser.add_argument("--base-port", type=int, default=17125)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        report(args, result)
+    if args.max_shutdown > 0 and result["shutdown_seconds"] > args.max_shutdown:
+        print(f"FAIL: shutdown took {result['shutdown_seconds']:.2f} s, bound is {args.max_shutdown:g} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
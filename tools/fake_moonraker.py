@@ -0,0 +1,220 @@
+"""Local stand-in for a fleet of Moonraker instances, for load testing KlipperDesk.
+
+Every simulated printer listens on its own port (base_port + n) and speaks
+the subset of Moonraker that KlipperDesk uses:
+
+    /websocket                    JSON-RPC: printer.objects.subscribe,
+                                  notify_status_update, notify_proc_stat_update
+    /server/files/metadata        file metadata with one or two thumbnails
+    /server/files/gcodes/<path>   thumbnail PNGs
+
+    python tools/fake_moonraker.py --printers 20 --rate 5 --storm-every 30
+
+print_stats.print_duration is wall-clock time minus --epoch, so a client in
+the same machine can compute delivery latency from any update it receives.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import struct
+import time
+import urllib.parse
+import zlib
+from http import HTTPStatus
+from typing import Dict, List, Optional
+
+import websockets
+
+THUMBNAIL_SIZES = ((32, 32), (300, 300))
+
+
+def solid_png(width: int, height: int, rgb) -> bytes:
+    """Minimal single-colour PNG, enough for QImage.fromData"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+class FakePrinter:
+    """Klipper object state of one simulated printer, advanced in real time"""
+
+    def __init__(self, index: int, epoch: float, print_seconds: float = 3600.0):
+        self.index = index
+        self.epoch = epoch
+        self.print_seconds = print_seconds
+        self.filename = f"bench/part_{index:03d}.gcode"
+        self.modified = epoch + index
+        self.file_size = 5_000_000 + index * 1000
+        self.started = time.time()
+        self.phase = random.random() * math.tau
+        self.rgb = (40 + index * 37 % 200, 120, 255 - index * 53 % 200)
+        self._pngs = {}
+
+    def status(self) -> Dict[str, Dict]:
+        now = time.time()
+        progress = ((now - self.started) / self.print_seconds) % 1.0
+        wobble = math.sin(now + self.phase)
+        return {
+            "extruder": {"temperature": round(215.0 + wobble * 0.8, 2), "target": 215.0},
+            "heater_bed": {"temperature": round(60.0 + wobble * 0.3, 2), "target": 60.0},
+            "print_stats": {"state": "printing", "filename": self.filename,
+                            "print_duration": now - self.epoch, "total_duration": now - self.started},
+            "display_status": {"progress": progress, "message": ""},
+            "virtual_sdcard": {"progress": progress, "file_position": int(progress * self.file_size),
+                               "file_size": self.file_size},
+        }
+
+    def metadata(self) -> Dict:
+        return {
+            "filename": self.filename,
+            "modified": self.modified,
+            "size": self.file_size,
+            "estimated_time": self.print_seconds,
+            "thumbnails": [{"width": w, "height": h, "size": 0,
+                            "relative_path": f".thumbs/part_{self.index:03d}-{w}x{h}.png"}
+                           for w, h in THUMBNAIL_SIZES],
+        }
+
+    def thumbnail(self, path: str) -> Optional[bytes]:
+        for w, h in THUMBNAIL_SIZES:
+            if path.endswith(f"part_{self.index:03d}-{w}x{h}.png"):
+                if (w, h) not in self._pngs:
+                    self._pngs[(w, h)] = solid_png(w, h, self.rgb)
+                return self._pngs[(w, h)]
+        return None
+
+
+def select_fields(status: Dict[str, Dict], objects: Dict[str, Optional[List[str]]]) -> Dict[str, Dict]:
+    """Restrict a status dict to the subscribed objects/fields (None means all fields)"""
+    out = {}
+    for obj, fields in objects.items():
+        if obj in status:
+            out[obj] = {k: v for k, v in status[obj].items() if not fields or k in fields}
+    return out
+
+
+class FakeMoonraker:
+    """One simulated printer: WebSocket JSON-RPC plus the HTTP file routes"""
+
+    def __init__(self, printer: FakePrinter, rate: float, proc_stat: bool = True, deaf: bool = False):
+        self.printer = printer
+        self.rate = rate
+        self.proc_stat = proc_stat
+        self.deaf = deaf
+        self.connections = set()
+        self.messages_sent = 0
+
+    async def process_request(self, path: str, headers):
+        """Serve plain HTTP routes; return None to continue with the WebSocket handshake"""
+        url = urllib.parse.urlsplit(path)
+        if url.path == "/websocket":
+            return None
+        if url.path == "/server/files/metadata":
+            body = json.dumps({"result": self.printer.metadata()}).encode()
+            return HTTPStatus.OK, [("Content-Type", "application/json")], body
+        if url.path.startswith("/server/files/gcodes/"):
+            data = self.printer.thumbnail(urllib.parse.unquote(url.path))
+            if data is not None:
+                return HTTPStatus.OK, [("Content-Type", "image/png")], data
+        return HTTPStatus.NOT_FOUND, [], b"not found"
+
+    async def handler(self, ws, path=None):
+        self.connections.add(ws)
+        objects = {}
+        pusher = None
+        try:
+            async for raw in ws:
+                request = json.loads(raw)
+                if request.get("method") != "printer.objects.subscribe":
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "id": request.get("id"), "result": {}}))
+                    continue
+                objects = request.get("params", {}).get("objects", {})
+                await ws.send(json.dumps({
+                    "jsonrpc": "2.0", "id": request.get("id"),
+                    "result": {"eventtime": time.monotonic(), "status": select_fields(self.printer.status(), objects)},
+                }))
+                if pusher is None:
+                    pusher = asyncio.ensure_future(self._push(ws, lambda: objects))
+                if self.deaf:
+                    # Half-open peer: keep sending, never read again (pings and close frames go unanswered)
+                    ws.transport.pause_reading()
+                    await pusher
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(ws)
+            if pusher is not None:
+                pusher.cancel()
+
+    async def _push(self, ws, subscribed):
+        """notify_status_update at `rate` Hz, notify_proc_stat_update once a second"""
+        interval = 1.0 / self.rate
+        next_proc = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            status = select_fields(self.printer.status(), subscribed())
+            await ws.send(json.dumps({"jsonrpc": "2.0", "method": "notify_status_update",
+                                      "params": [status, time.monotonic()]}))
+            self.messages_sent += 1
+            if self.proc_stat and time.monotonic() >= next_proc:
+                next_proc += 1.0
+                await ws.send(json.dumps({"jsonrpc": "2.0", "method": "notify_proc_stat_update", "params": [{
+                    "moonraker_stats": {"time": time.time(), "cpu_usage": 2.5, "memory": 40000, "mem_units": "kB"},
+                    "cpu_temp": 45.0, "network": {"eth0": {"rx_bytes": 0, "tx_bytes": 0}},
+                    "system_cpu_usage": {"cpu": 5.0}, "websocket_connections": len(self.connections),
+                }]}))
+
+    async def drop_connections(self):
+        """Close every client socket at once (reconnect storm)"""
+        await asyncio.gather(*(ws.close(code=1012) for ws in list(self.connections)), return_exceptions=True)
+
+
+async def run(printers: int, rate: float, host: str, base_port: int, epoch: float,
+              storm_every: float = 0.0, proc_stat: bool = True, deaf: bool = False):
+    fakes = [FakeMoonraker(FakePrinter(i, epoch), rate, proc_stat, deaf) for i in range(printers)]
+    servers = []
+    for i, fake in enumerate(fakes):
+        servers.append(await websockets.serve(fake.handler, host, base_port + i,
+                                              process_request=fake.process_request))
+    print(f"[FakeMoonraker] {printers} printer(s) on {host}:{base_port}-{base_port + printers - 1}, "
+          f"{rate:g} updates/s each", flush=True)
+    try:
+        while True:
+            if storm_every > 0:
+                await asyncio.sleep(storm_every)
+                await asyncio.gather(*(fake.drop_connections() for fake in fakes))
+                print("[FakeMoonraker] reconnect storm: dropped all connections", flush=True)
+            else:
+                await asyncio.sleep(3600)
+    finally:
+        for server in servers:
+            server.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Simulated Moonraker fleet for KlipperDesk load tests")
+    parser.add_argument("--printers", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=4.0, help="notify_status_update per second per printer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=17125)
+    parser.add_argument("--epoch", type=float, default=None, help="print_duration origin (wall clock)")
+    parser.add_argument("--storm-every", type=float, default=0.0, help="drop all connections every N seconds")
+    parser.add_argument("--no-proc-stat", action="store_true", help="do not send notify_proc_stat_update")
+    parser.add_argument("--deaf", action="store_true", help="stop reading from clients after they subscribe")
+    args = parser.parse_args(argv)
+    epoch = args.epoch if args.epoch is not None else time.time()
+    try:
+        asyncio.run(run(args.printers, args.rate, args.host, args.base_port, epoch,
+                        args.storm_every, not args.no_proc_stat, args.deaf))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()